@@ -1,32 +1,105 @@
+from datetime import date
+from decimal import Decimal
+from typing import Literal, Optional
+from uuid import UUID
 from psycopg import AsyncConnection
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, Query, UploadFile, status
+from fastapi.responses import StreamingResponse
 
 from db.postgres import get_async_session
 from app import auth
+from . import export
 from . import schema
 from . import handlers
 
 
 router = APIRouter()
 
+def expenditure_filters(
+    status: Optional[str] = Query(None, description="Only return expenditures with this status (e.g., 'Approved', 'Pending')."),
+    category: Optional[str] = Query(None, description="Only return expenditures in this category."),
+    date_from: Optional[date] = Query(None, description="Earliest date_of_expense to include (YYYY-MM-DD)."),
+    date_to: Optional[date] = Query(None, description="Latest date_of_expense to include (YYYY-MM-DD)."),
+    min_amount: Optional[Decimal] = Query(None, description="Smallest amount to include."),
+    max_amount: Optional[Decimal] = Query(None, description="Largest amount to include."),
+) -> schema.ExpenditureFilters:
+    """
+    Collect the listing filters from the query string
+    """
+    return schema.ExpenditureFilters(
+        status=status,
+        category=category,
+        date_from=date_from,
+        date_to=date_to,
+        min_amount=min_amount,
+        max_amount=max_amount,
+    )
+
+def csv_column_mapping(
+    date_column: str = Query("date", description="CSV header of the transaction date column."),
+    amount_column: str = Query("amount", description="CSV header of the amount column."),
+    name_column: str = Query("description", description="CSV header of the column used as the expenditure name."),
+    category_column: Optional[str] = Query(None, description="CSV header of the category column, if any."),
+    notes_column: Optional[str] = Query(None, description="CSV header of the notes column, if any."),
+    date_format: str = Query("%Y-%m-%d", description="strptime format of the date column."),
+    delimiter: str = Query(",", min_length=1, max_length=1, description="CSV field delimiter."),
+) -> schema.CsvColumnMapping:
+    """
+    Collect the CSV column mapping of a statement import from the query string
+    """
+    return schema.CsvColumnMapping(
+        date_column=date_column,
+        amount_column=amount_column,
+        name_column=name_column,
+        category_column=category_column,
+        notes_column=notes_column,
+        date_format=date_format,
+        delimiter=delimiter,
+    )
+
+class PageParams:
+    """
+    Cursor, page size and projection shared by the listing endpoints
+    """
+    def __init__(
+        self,
+        cursor: Optional[str] = Query(None, description="Opaque cursor returned as next_cursor by the previous page."),
+        limit: int = Query(handlers.DEFAULT_PAGE_SIZE, ge=1, le=handlers.MAX_PAGE_SIZE, description="Page size."),
+        fields: Optional[str] = Query(None, description="Comma separated columns to return, uuid and created_at are always included."),
+    ):
+        self.cursor = cursor
+        self.limit = limit
+        self.fields = fields
+
 @router.get(
     "",
     status_code=status.HTTP_200_OK,
+    response_model=schema.ExpenditurePage,
     responses={
-        status.HTTP_200_OK: {"description": "List of expenditures"},
+        status.HTTP_200_OK: {"description": "Page of expenditures"},
         status.HTTP_400_BAD_REQUEST: {"description": "Bad request"},
         status.HTTP_401_UNAUTHORIZED: {"description": "Unauthorized - invalid or missing token"},
         status.HTTP_500_INTERNAL_SERVER_ERROR: {"description": "Server error"},
     },
 )
 async def get_expenditure(
+    filters: schema.ExpenditureFilters = Depends(expenditure_filters),
+    page: PageParams = Depends(),
     current_user: dict = Depends(auth.get_current_user), 
     conn: AsyncConnection = Depends(get_async_session)):
     """
-    Get all expenditures for the authenticated user
+    Get a page of expenditures for the authenticated user, newest first.
+    Pass the returned next_cursor to get the following page.
     """
     try:
-        response = await handlers.get_expenditures(current_user, conn)
+        response = await handlers.list_expenditures(
+            current_user,
+            conn,
+            filters=filters,
+            cursor=page.cursor,
+            limit=page.limit,
+            fields=page.fields,
+        )
         return response
     except HTTPException as e:
         raise e
@@ -39,19 +112,28 @@ async def get_expenditure(
 @router.get(
     "/approved",
     status_code=status.HTTP_200_OK,
+    response_model=schema.ExpenditurePage,
     responses={
-        status.HTTP_200_OK: {"description": "List of approved expenditures"},
+        status.HTTP_200_OK: {"description": "Page of approved expenditures"},
         status.HTTP_400_BAD_REQUEST: {"description": "Bad request"},
     },
 )
 async def get_approved_expenditures(
+    page: PageParams = Depends(),
     current_user: dict = Depends(auth.get_current_user), 
     conn: AsyncConnection = Depends(get_async_session)):
     """
-    Get all approved expenditures from the database
+    Get a page of approved expenditures, same as GET /expenditure?status=Approved
     """
     try:
-        response = await handlers.get_approved_expenditures(current_user, conn)
+        response = await handlers.list_expenditures(
+            current_user,
+            conn,
+            filters=schema.ExpenditureFilters(status="Approved"),
+            cursor=page.cursor,
+            limit=page.limit,
+            fields=page.fields,
+        )
         return response
     except HTTPException as e:
         raise e
@@ -64,19 +146,28 @@ async def get_approved_expenditures(
 @router.get(
     "/pending",
     status_code=status.HTTP_200_OK,
+    response_model=schema.ExpenditurePage,
     responses={
-        status.HTTP_200_OK: {"description": "List of pending expenditures"},
+        status.HTTP_200_OK: {"description": "Page of pending expenditures"},
         status.HTTP_400_BAD_REQUEST: {"description": "Bad request"},
     },
 )
 async def get_pending_expenditures(
+    page: PageParams = Depends(),
     current_user: dict = Depends(auth.get_current_user),
     conn: AsyncConnection = Depends(get_async_session)):
     """
-    Get all pending expenditures from the database
+    Get a page of pending expenditures, same as GET /expenditure?status=Pending
     """
     try:
-        response = await handlers.get_pending_expenditures(current_user, conn)
+        response = await handlers.list_expenditures(
+            current_user,
+            conn,
+            filters=schema.ExpenditureFilters(status="Pending"),
+            cursor=page.cursor,
+            limit=page.limit,
+            fields=page.fields,
+        )
         return response
     except HTTPException as e:
         raise e
@@ -86,6 +177,104 @@ async def get_pending_expenditures(
             detail="Failed to get pending expenditures. Please try again in a while.",
         )
     
+@router.get(
+    "/export",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Streamed export of the matching expenditures",
+            "content": {media_type: {} for media_type in [*export.MEDIA_TYPES.values(), export.GZIP_MEDIA_TYPE]},
+        },
+        status.HTTP_400_BAD_REQUEST: {"description": "Requested format is not available"},
+        status.HTTP_401_UNAUTHORIZED: {"description": "Unauthorized - invalid or missing token"},
+    },
+)
+async def export_expenditures(
+    format: Literal["csv", "ndjson", "parquet"] = Query("csv", description="Export file format."),
+    gzip: bool = Query(False, description="Gzip csv and ndjson exports on the fly."),
+    filters: schema.ExpenditureFilters = Depends(expenditure_filters),
+    current_user: dict = Depends(auth.get_current_user)):
+    """
+    Export the authenticated user's expenditures, streamed in chunks with the same filters as listing
+    """
+    if format == "parquet" and not export.parquet_available():
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            detail="Parquet export is not available on this server, install pyarrow or use csv or ndjson.",
+        )
+
+    body = handlers.export_expenditures(current_user, filters=filters, export_format=format)
+    filename = f"expenditures.{format}"
+    media_type = export.MEDIA_TYPES[format]
+
+    # parquet is already compressed internally. the gzip file itself is the download, not a transfer
+    # encoding, so clients and proxies do not decompress it behind the .gz name
+    if gzip and format != "parquet":
+        body = export.gzip_stream(body)
+        filename += ".gz"
+        media_type = export.GZIP_MEDIA_TYPE
+
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+@router.get(
+    "/summary",
+    status_code=status.HTTP_200_OK,
+    response_model=schema.ExpenditureSummary,
+    responses={
+        status.HTTP_200_OK: {"description": "Spending totals overall, by category and by status"},
+        status.HTTP_401_UNAUTHORIZED: {"description": "Unauthorized - invalid or missing token"},
+        status.HTTP_500_INTERNAL_SERVER_ERROR: {"description": "Server error"},
+    },
+)
+async def get_expenditure_summary(
+    filters: schema.ExpenditureFilters = Depends(expenditure_filters),
+    current_user: dict = Depends(auth.get_current_user),
+    conn: AsyncConnection = Depends(get_async_session)):
+    """
+    Get spending totals for the authenticated user, overall and grouped by category and by status
+    """
+    try:
+        response = await handlers.get_expenditure_summary(current_user, conn, filters=filters)
+        return response
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(
+            status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to get expenditure summary. Please try again in a while.",
+        )
+
+@router.get(
+    "/summary/timeseries",
+    status_code=status.HTTP_200_OK,
+    response_model=schema.ExpenditureTimeseries,
+    responses={
+        status.HTTP_200_OK: {"description": "Spending totals per day, week or month"},
+        status.HTTP_401_UNAUTHORIZED: {"description": "Unauthorized - invalid or missing token"},
+        status.HTTP_500_INTERNAL_SERVER_ERROR: {"description": "Server error"},
+    },
+)
+async def get_expenditure_timeseries(
+    granularity: Literal["day", "week", "month"] = Query("month", description="Size of each bucket."),
+    filters: schema.ExpenditureFilters = Depends(expenditure_filters),
+    current_user: dict = Depends(auth.get_current_user),
+    conn: AsyncConnection = Depends(get_async_session)):
+    """
+    Get spending totals for the authenticated user per day, week or month of the expense date
+    """
+    try:
+        response = await handlers.get_expenditure_timeseries(current_user, conn, filters=filters, granularity=granularity)
+        return response
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(
+            status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to get expenditure timeseries. Please try again in a while.",
+        )
+    
 @router.post(
     "",
     status_code=status.HTTP_201_CREATED,
@@ -117,6 +306,197 @@ async def create_expenditure(
             detail="Failed to get expenditures. Please try again in a while.",
         )
     
+@router.post(
+    "/bulk",
+    status_code=status.HTTP_201_CREATED,
+    responses={
+        status.HTTP_201_CREATED: {"description": "Expenditures created, per item results in input order"},
+        status.HTTP_401_UNAUTHORIZED: {"description": "Unauthorized - invalid or missing token"},
+        status.HTTP_422_UNPROCESSABLE_ENTITY: {"description": "Some items are invalid and partial mode is off, nothing was created"},
+        status.HTTP_500_INTERNAL_SERVER_ERROR: {"description": "Database or unexpected server error"},
+    },
+)
+async def create_expenditures_bulk(
+    request: schema.ExpenditureBulkCreateRequest,
+    current_user: dict = Depends(auth.get_current_user),
+    conn: AsyncConnection = Depends(get_async_session)
+):
+    """
+    Create many expenditures for the authenticated user in a single transaction
+    """
+    try:
+        response = await handlers.create_expenditures_bulk(current_user, request, conn)
+        return response
+
+    except HTTPException as e:
+        raise e
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Server failed to create expenditures: {str(e)}. Please try again.",
+        )
+    
+@router.post(
+    "/import",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=schema.ImportJob,
+    responses={
+        status.HTTP_202_ACCEPTED: {"description": "Statement accepted, poll the returned job for progress"},
+        status.HTTP_401_UNAUTHORIZED: {"description": "Unauthorized - invalid or missing token"},
+        status.HTTP_413_REQUEST_ENTITY_TOO_LARGE: {"description": "Statement is too large"},
+        status.HTTP_500_INTERNAL_SERVER_ERROR: {"description": "Database or unexpected server error"},
+    },
+)
+async def import_statement(
+    background_tasks: BackgroundTasks,
+    statement: UploadFile = File(..., description="Bank statement export in CSV or OFX format."),
+    format: Literal["csv", "ofx"] = Query("csv", description="Statement file format."),
+    mapping: schema.CsvColumnMapping = Depends(csv_column_mapping),
+    current_user: dict = Depends(auth.get_current_user),
+    conn: AsyncConnection = Depends(get_async_session)
+):
+    """
+    Import a bank statement as pending expenditures. The file is parsed and loaded in the background,
+    lines whose date, amount and name match an existing expenditure are skipped.
+    """
+    try:
+        job, path = await handlers.create_import_job(current_user, statement, format, conn)
+        background_tasks.add_task(handlers.run_import_job, job['uuid'], current_user, path, format, mapping)
+        return job
+
+    except HTTPException as e:
+        raise e
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Server failed to import statement: {str(e)}. Please try again.",
+        )
+
+@router.get(
+    "/import/{job_id}",
+    status_code=status.HTTP_200_OK,
+    response_model=schema.ImportJob,
+    responses={
+        status.HTTP_200_OK: {"description": "Progress of the statement import"},
+        status.HTTP_404_NOT_FOUND: {"description": "Import job not found"},
+        status.HTTP_500_INTERNAL_SERVER_ERROR: {"description": "Internal server error"},
+    },
+)
+async def get_import_job(
+    job_id: UUID,
+    current_user: dict = Depends(auth.get_current_user),
+    conn: AsyncConnection = Depends(get_async_session)
+):
+    """
+    Get the status and row counts of a statement import
+    """
+    try:
+        response = await handlers.get_import_job(job_id=job_id, current_user=current_user, conn=conn)
+        return response
+
+    except HTTPException as e:
+        raise e
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Server failed to get import job: {str(e)}. Please try again.",
+        )
+
+@router.post(
+    "/batch/approve",
+    status_code=status.HTTP_200_OK,
+    responses={
+        status.HTTP_200_OK: {"description": "Per-ID outcomes: updated, not_pending or not_found"},
+        status.HTTP_401_UNAUTHORIZED: {"description": "Unauthorized - invalid or missing token"},
+        status.HTTP_500_INTERNAL_SERVER_ERROR: {"description": "Internal server error"},
+    },
+)
+async def approve_pending_expenditures_batch(
+    request: schema.ExpenditureBatchIdsRequest,
+    current_user: dict = Depends(auth.get_current_user),
+    conn: AsyncConnection = Depends(get_async_session)
+):
+    """
+    Approve many pending expenditures at once, in a single transaction.
+    """
+    try:
+        response = await handlers.approve_pending_expenditures_batch(ids=request.ids, current_user=current_user, conn=conn)
+        return response
+
+    except HTTPException as e:
+        raise e
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Server failed to approve expenditures: {str(e)}. Please try again.",
+        )
+
+@router.post(
+    "/batch/delete",
+    status_code=status.HTTP_200_OK,
+    responses={
+        status.HTTP_200_OK: {"description": "Per-ID outcomes: deleted or not_found"},
+        status.HTTP_401_UNAUTHORIZED: {"description": "Unauthorized - invalid or missing token"},
+        status.HTTP_500_INTERNAL_SERVER_ERROR: {"description": "Internal server error"},
+    },
+)
+async def delete_expenditures_batch(
+    request: schema.ExpenditureBatchIdsRequest,
+    current_user: dict = Depends(auth.get_current_user),
+    conn: AsyncConnection = Depends(get_async_session)
+):
+    """
+    Delete many expenditures at once, in a single transaction.
+    """
+    try:
+        response = await handlers.delete_expenditures_batch(ids=request.ids, current_user=current_user, conn=conn)
+        return response
+
+    except HTTPException as e:
+        raise e
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Server failed to delete expenditures: {str(e)}. Please try again.",
+        )
+
+@router.post(
+    "/batch/update",
+    status_code=status.HTTP_200_OK,
+    responses={
+        status.HTTP_200_OK: {"description": "Per-ID outcomes: updated or not_found"},
+        status.HTTP_400_BAD_REQUEST: {"description": "Duplicate IDs or empty patches"},
+        status.HTTP_401_UNAUTHORIZED: {"description": "Unauthorized - invalid or missing token"},
+        status.HTTP_500_INTERNAL_SERVER_ERROR: {"description": "Internal server error"},
+    },
+)
+async def update_expenditures_batch(
+    request: schema.ExpenditureBatchUpdateRequest,
+    current_user: dict = Depends(auth.get_current_user),
+    conn: AsyncConnection = Depends(get_async_session)
+):
+    """
+    Apply a separate patch to each of many expenditures, in a single transaction.
+    Only the fields provided in each patch are updated.
+    """
+    try:
+        response = await handlers.update_expenditures_batch(request=request, current_user=current_user, conn=conn)
+        return response
+
+    except HTTPException as e:
+        raise e
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Server failed to update expenditures: {str(e)}. Please try again.",
+        )
+
 @router.patch(
     "/{id}",
     status_code=status.HTTP_200_OK,
@@ -0,0 +1,139 @@
+"""
+Encoders used to stream an expenditure export batch by batch
+"""
+import csv
+import io
+import json
+import zlib
+from typing import AsyncIterator, List
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # parquet export is optional
+    pa = None
+    pq = None
+
+
+EXPORT_COLUMNS = (
+    "uuid", "name", "created_at", "date_of_expense",
+    "amount", "category", "notes", "status"
+)
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+GZIP_MEDIA_TYPE = "application/gzip"
+
+
+class CsvEncoder:
+    def __init__(self):
+        self._header_written = False
+
+    def encode(self, rows: List[dict]) -> bytes:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+        if not self._header_written:
+            writer.writeheader()
+            self._header_written = True
+        writer.writerows(rows)
+        return buffer.getvalue().encode("utf-8")
+
+    def close(self) -> bytes:
+        # an empty export still gets its header row
+        return self.encode([]) if not self._header_written else b""
+
+
+class NdjsonEncoder:
+    def encode(self, rows: List[dict]) -> bytes:
+        return "".join(json.dumps(row, default=str) + "\n" for row in rows).encode("utf-8")
+
+    def close(self) -> bytes:
+        return b""
+
+
+class _ChunkSink:
+    """
+    write-only file object handed to the parquet writer. bytes are drained after every row group,
+    while tell() keeps counting from the start of the file because parquet metadata stores absolute offsets.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class ParquetEncoder:
+    """
+    writes one parquet row group per batch, only the footer has to wait for the last batch
+    """
+
+    def __init__(self):
+        self._schema = pa.schema([
+            ("uuid", pa.string()),
+            ("name", pa.string()),
+            ("created_at", pa.timestamp("us", tz="UTC")),
+            ("date_of_expense", pa.date32()),
+            ("amount", pa.decimal128(10, 2)),
+            ("category", pa.string()),
+            ("notes", pa.string()),
+            ("status", pa.string()),
+        ])
+        self._sink = _ChunkSink()
+        self._writer = pq.ParquetWriter(pa.PythonFile(self._sink, mode="w"), self._schema)
+
+    def encode(self, rows: List[dict]) -> bytes:
+        rows = [{**row, "uuid": str(row["uuid"])} for row in rows]
+        self._writer.write_table(pa.Table.from_pylist(rows, schema=self._schema))
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        self._writer.close()
+        return self._sink.drain()
+
+
+def parquet_available() -> bool:
+    return pa is not None
+
+
+def get_encoder(export_format: str):
+    if export_format == "csv":
+        return CsvEncoder()
+    if export_format == "ndjson":
+        return NdjsonEncoder()
+    return ParquetEncoder()
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    gzip a byte stream on the fly without buffering it
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -1,79 +1,349 @@
-from fastapi import HTTPException, status
+import asyncio
+import base64
+import glob
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional
+from uuid import UUID, uuid4
+
+from fastapi import HTTPException, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
 from psycopg import AsyncConnection
+from pydantic import ValidationError
 
+from app.cache import TTLCache, listen_for_invalidations
+from config import settings
+from db.postgres import get_pool
+from . import export
 from . import schema
+from . import statement_import
 
 UPDATABLE_FIELDS = {
     "name", "date_of_expense", "amount", 
     "category", "notes", "status"
 }
 
-async def get_expenditures(
+LISTABLE_FIELDS = (
+    "uuid", "name", "created_at", "date_of_expense",
+    "amount", "category", "notes", "status"
+)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Spending summaries keyed by (user_uuid, kind, parameters), dropped by every write handler in every worker
+summary_cache = TTLCache(
+    maxsize=settings.SUMMARY_CACHE_MAX_SIZE,
+    ttl=settings.SUMMARY_CACHE_TTL_SECONDS,
+    name="expenditure_summary",
+)
+
+def invalidate_summary_cache(current_user: dict) -> None:
+    """
+    Drop every cached summary of the user after their expenditures changed
+    """
+    discard_summaries(str(current_user['uuid']))
+
+def discard_summaries(user_uuid: str) -> None:
+    summary_cache.discard_where(lambda key: key[0] == user_uuid)
+
+async def publish_summary_invalidation(conn: AsyncConnection, current_user: dict) -> None:
+    """
+    Notify the other workers that the user's cached summaries are stale.
+    Postgres only delivers the notification once the surrounding transaction commits.
+    """
+    if settings.SUMMARY_CACHE_NOTIFY_CHANNEL:
+        await conn.execute(
+            "SELECT pg_notify(%s, %s);",
+            (settings.SUMMARY_CACHE_NOTIFY_CHANNEL, str(current_user['uuid']))
+        )
+
+async def commit_expenditure_changes(conn: AsyncConnection, current_user: dict) -> None:
+    """
+    Commit a write to the user's expenditures and drop their cached summaries here and in the other workers
+    """
+    await publish_summary_invalidation(conn, current_user)
+    await conn.commit()
+    invalidate_summary_cache(current_user)
+
+async def listen_for_summary_invalidations() -> None:
+    """
+    Long running task that drops cached summaries invalidated by other workers
+    """
+    await listen_for_invalidations(settings.SUMMARY_CACHE_NOTIFY_CHANNEL, summary_cache, discard_summaries)
+
+def build_filter_clause(current_user: dict, filters: schema.ExpenditureFilters):
+    """
+    Build the WHERE clause and its parameters shared by every query that lists a user's expenditures
+    """
+    conditions = ["user_uuid = %s"]
+    params = [current_user['uuid']]
+
+    if filters.status is not None:
+        conditions.append("status = %s")
+        params.append(filters.status)
+    if filters.category is not None:
+        conditions.append("category = %s")
+        params.append(filters.category)
+    if filters.date_from is not None:
+        conditions.append("date_of_expense >= %s")
+        params.append(filters.date_from)
+    if filters.date_to is not None:
+        conditions.append("date_of_expense <= %s")
+        params.append(filters.date_to)
+    if filters.min_amount is not None:
+        conditions.append("amount >= %s")
+        params.append(filters.min_amount)
+    if filters.max_amount is not None:
+        conditions.append("amount <= %s")
+        params.append(filters.max_amount)
+
+    return " AND ".join(conditions), params
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    """
+    Turn a comma separated projection into a list of columns.
+    uuid and created_at are always returned since the cursor is built from them.
+    """
+    if not fields:
+        return list(LISTABLE_FIELDS)
+
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in LISTABLE_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed fields: {', '.join(LISTABLE_FIELDS)}."
+        )
+
+    return [field for field in LISTABLE_FIELDS if field in requested or field in ("uuid", "created_at")]
+
+def encode_cursor(row: dict) -> str:
+    raw = json.dumps([row['created_at'].isoformat(), str(row['uuid'])])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, uuid = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(created_at), UUID(uuid)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor."
+        )
+
+async def list_expenditures(
     current_user: dict,
-    conn: AsyncConnection
+    conn: AsyncConnection,
+    filters: schema.ExpenditureFilters,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    fields: Optional[str] = None,
 ):
     """
-    Get all expenditures for the authenticated user from the database
+    Get one page of the authenticated user's expenditures, newest first.
+    Pages are keyed on (created_at, uuid) so every page is an index range scan no matter how deep it is.
     """
-    try:
-        query = """
-            SELECT uuid, name, created_at, date_of_expense, amount, category, notes, status
-            FROM expenditure
-            WHERE user_uuid = %s
-            ORDER BY created_at DESC
-        """
+    columns = parse_fields(fields)
+    where_clause, params = build_filter_clause(current_user, filters)
+
+    if cursor:
+        where_clause += " AND (created_at, uuid) < (%s, %s)"
+        params.extend(decode_cursor(cursor))
 
+    query = f"""
+        SELECT {", ".join(columns)}
+        FROM expenditure
+        WHERE {where_clause}
+        ORDER BY created_at DESC, uuid DESC
+        LIMIT %s
+    """
+    params.append(limit + 1)
+
+    try:
         async with conn.cursor() as cur:
-            await cur.execute(query, (current_user['uuid'],))
+            await cur.execute(query, params)
             results = await cur.fetchall()
-            return results
+
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = encode_cursor(results[-1])
+
+        return {"items": results, "next_cursor": next_cursor}
             
     except Exception as e:
         raise e
+    
+def rollup_covers(filters: schema.ExpenditureFilters) -> bool:
+    """
+    The monthly rollup can answer a summary when the date range is made of whole months
+    and there is no amount filter, which it does not keep track of
+    """
+    if filters.min_amount is not None or filters.max_amount is not None:
+        return False
+    if filters.date_from is not None and filters.date_from.day != 1:
+        return False
+    if filters.date_to is not None and (filters.date_to + timedelta(days=1)).day != 1:
+        return False
+    return True
+
+def build_rollup_filter_clause(current_user: dict, filters: schema.ExpenditureFilters):
+    """
+    Same as build_filter_clause but for expenditure_monthly_rollup, only valid when rollup_covers(filters)
+    """
+    conditions = ["user_uuid = %s", "count <> 0"]
+    params = [current_user['uuid']]
 
-async def get_approved_expenditures(
+    if filters.status is not None:
+        conditions.append("status = %s")
+        params.append(filters.status)
+    if filters.category is not None:
+        conditions.append("category = %s")
+        params.append(filters.category)
+    if filters.date_from is not None:
+        conditions.append("month >= %s")
+        params.append(filters.date_from)
+    if filters.date_to is not None:
+        conditions.append("month <= %s")
+        params.append(filters.date_to)
+
+    return " AND ".join(conditions), params
+
+async def export_expenditures(
     current_user: dict,
-    conn: AsyncConnection
+    filters: schema.ExpenditureFilters,
+    export_format: str,
+) -> AsyncIterator[bytes]:
+    """
+    Stream every matching expenditure, encoded batch by batch.
+    Rows are read through a server-side cursor so memory stays flat no matter how many rows match.
+    The generator runs after the request dependencies are released, so it checks out its own connection.
+    """
+    where_clause, params = build_filter_clause(current_user, filters)
+    query = f"""
+        SELECT {", ".join(export.EXPORT_COLUMNS)}
+        FROM expenditure
+        WHERE {where_clause}
+        ORDER BY created_at DESC, uuid DESC
+    """
+    encoder = export.get_encoder(export_format)
+
+    async with get_pool().connection() as conn:
+        async with conn.cursor(name="expenditure_export") as cur:
+            await cur.execute(query, params)
+            while True:
+                rows = await cur.fetchmany(settings.EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                chunk = encoder.encode(rows)
+                if chunk:
+                    yield chunk
+
+    chunk = encoder.close()
+    if chunk:
+        yield chunk
+
+async def get_expenditure_summary(
+    current_user: dict,
+    conn: AsyncConnection,
+    filters: schema.ExpenditureFilters,
 ):
     """
-    get all expenditures that have status == 'Appproved' from the database
+    Totals of the user's expenditures overall, by category and by status, aggregated in one scan.
+    Whole-month ranges are read from the monthly rollup instead of the raw rows.
     """
-    try:
-        query = """
-            SELECT *
-            FROM expenditure
-            WHERE status='Approved' AND user_uuid = %s
-            ORDER BY created_at DESC
-        """
+    cache_key = (str(current_user['uuid']), "summary", filters.model_dump_json())
+    cached = summary_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    if rollup_covers(filters):
+        where_clause, params = build_rollup_filter_clause(current_user, filters)
+        source, total, count = "expenditure_monthly_rollup", "SUM(total)", "SUM(count)::bigint"
+    else:
+        where_clause, params = build_filter_clause(current_user, filters)
+        source, total, count = "expenditure", "SUM(amount)", "COUNT(*)"
 
+    query = f"""
+        SELECT category, status, COALESCE({total}, 0) AS total, COALESCE({count}, 0) AS count,
+            GROUPING(category, status) AS grouping_set
+        FROM {source}
+        WHERE {where_clause}
+        GROUP BY GROUPING SETS ((category), (status), ())
+        ORDER BY total DESC
+    """
+
+    try:
         async with conn.cursor() as cur:
-            await cur.execute(query, (current_user['uuid'],))
-            results = await cur.fetchall()
-            return results
-            
+            await cur.execute(query, params)
+            rows = await cur.fetchall()
+
+        summary = {"total": 0, "count": 0, "by_category": [], "by_status": []}
+        for row in rows:
+            # GROUPING() sets bit 1 for status and bit 2 for category when they are aggregated away.
+            # the rollup stores missing categories and statuses as ''
+            if row['grouping_set'] == 1:
+                summary["by_category"].append({"key": row['category'] or None, "total": row['total'], "count": row['count']})
+            elif row['grouping_set'] == 2:
+                summary["by_status"].append({"key": row['status'] or None, "total": row['total'], "count": row['count']})
+            else:
+                summary["total"] = row['total']
+                summary["count"] = row['count']
+
+        summary_cache.set(cache_key, summary)
+        return summary
+
     except Exception as e:
         raise e
-    
-async def get_pending_expenditures(
+
+async def get_expenditure_timeseries(
     current_user: dict,
-    conn: AsyncConnection
+    conn: AsyncConnection,
+    filters: schema.ExpenditureFilters,
+    granularity: str,
 ):
     """
-    get all expenditures that have status == 'Pending' from the database
+    Totals of the user's expenditures per day, week or month of date_of_expense.
+    Monthly buckets over whole months are read from the monthly rollup instead of the raw rows.
     """
-    try:
-        query = """
-            SELECT *
+    cache_key = (str(current_user['uuid']), f"timeseries:{granularity}", filters.model_dump_json())
+    cached = summary_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    if granularity == "month" and rollup_covers(filters):
+        where_clause, params = build_rollup_filter_clause(current_user, filters)
+        query = f"""
+            SELECT month AS period, SUM(total) AS total, SUM(count)::bigint AS count
+            FROM expenditure_monthly_rollup
+            WHERE {where_clause}
+            GROUP BY period
+            ORDER BY period
+        """
+    else:
+        where_clause, params = build_filter_clause(current_user, filters)
+        query = f"""
+            SELECT date_trunc(%s, date_of_expense)::date AS period, SUM(amount) AS total, COUNT(*) AS count
             FROM expenditure
-            WHERE status='Pending' AND user_uuid = %s
-            ORDER BY created_at DESC
+            WHERE {where_clause}
+            GROUP BY period
+            ORDER BY period
         """
+        params = [granularity, *params]
 
+    try:
         async with conn.cursor() as cur:
-            await cur.execute(query, (current_user['uuid'],))
-            results = await cur.fetchall()
-            return results
-            
+            await cur.execute(query, params)
+            buckets = await cur.fetchall()
+
+        timeseries = {"granularity": granularity, "buckets": buckets}
+        summary_cache.set(cache_key, timeseries)
+        return timeseries
+
     except Exception as e:
         raise e
     
@@ -116,7 +386,7 @@ async def create_expenditure(
             
             returned_data = await cur.fetchone()
         
-        await conn.commit()
+        await commit_expenditure_changes(conn, current_user)
             
         return {**expenditure.model_dump(), **returned_data}
 
@@ -128,6 +398,95 @@ async def create_expenditure(
         await conn.rollback()
         raise e
     
+async def create_expenditures_bulk(
+    current_user: dict,
+    request: schema.ExpenditureBulkCreateRequest,
+    conn: AsyncConnection
+):
+    """
+    Validate a batch of expenditures in one pass and insert the valid ones with a single statement.
+    Results are returned in input order. Without `partial`, any invalid item rejects the whole batch.
+    """
+    valid = []
+    errors = {}
+    for index, item in enumerate(request.items):
+        try:
+            valid.append((index, schema.ExpenditureModel.model_validate(item)))
+        except ValidationError as e:
+            errors[index] = json.loads(e.json(include_url=False))
+
+    if errors and not request.partial:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={
+                "message": "Some expenditures are invalid, nothing was created.",
+                "errors": [{"index": index, "errors": item_errors} for index, item_errors in errors.items()],
+            }
+        )
+
+    # uuids are generated here so the returned rows can be matched back to their input position
+    uuids = [uuid4() for _ in valid]
+    expenditures = [expenditure for _, expenditure in valid]
+
+    query = """
+        INSERT INTO expenditure (
+            uuid,
+            user_uuid,
+            name,
+            date_of_expense,
+            amount,
+            category,
+            notes,
+            status
+        )
+        SELECT item.uuid, %s, item.name, item.date_of_expense, item.amount, item.category, item.notes, item.status
+        FROM unnest(
+            %s::uuid[], %s::varchar[], %s::date[], %s::numeric[], %s::varchar[], %s::text[], %s::varchar[]
+        ) AS item(uuid, name, date_of_expense, amount, category, notes, status)
+        RETURNING uuid, created_at;
+    """
+    values = (
+        current_user['uuid'],
+        uuids,
+        [expenditure.name for expenditure in expenditures],
+        [expenditure.date_of_expense for expenditure in expenditures],
+        [expenditure.amount for expenditure in expenditures],
+        [expenditure.category for expenditure in expenditures],
+        [expenditure.notes for expenditure in expenditures],
+        [expenditure.status for expenditure in expenditures],
+    )
+
+    created_at = {}
+    if valid:
+        try:
+            async with conn.cursor() as cur:
+                await cur.execute(query, values)
+                created_at = {row['uuid']: row['created_at'] for row in await cur.fetchall()}
+
+            await commit_expenditure_changes(conn, current_user)
+
+        except Exception as e:
+            await conn.rollback()
+            raise e
+
+    results = [None] * len(request.items)
+    for (index, expenditure), uuid in zip(valid, uuids):
+        results[index] = {
+            "index": index,
+            "outcome": "created",
+            **expenditure.model_dump(),
+            "uuid": uuid,
+            "created_at": created_at[uuid],
+        }
+    for index, item_errors in errors.items():
+        results[index] = {"index": index, "outcome": "error", "errors": item_errors}
+
+    return {
+        "created_count": len(valid),
+        "error_count": len(errors),
+        "results": results,
+    }
+    
 async def update_expenditure_by_id(
     id: str, 
     data: schema.ExpenditureUpdateModel,
@@ -188,7 +547,7 @@ async def update_expenditure_by_id(
                     detail=f"Expenditure with ID '{id}' not found or you do not have permission."
                 )
 
-        await conn.commit()
+        await commit_expenditure_changes(conn, current_user)
         return updated_row
 
     except HTTPException as e:
@@ -226,7 +585,7 @@ async def approve_single_pending_expenditure(
                     detail=f"No pending expenditure with ID '{id}' found to approve or you do not have permission."
                 )
             
-        await conn.commit()
+        await commit_expenditure_changes(conn, current_user)
         return updated_row
     
     except HTTPException as e:
@@ -253,7 +612,7 @@ async def approve_all_pending_expenditures(
             await cur.execute(query, values)
             updated_count = cur.rowcount
 
-        await conn.commit()
+        await commit_expenditure_changes(conn, current_user)
 
         return {"updated_count": updated_count}
     
@@ -261,6 +620,159 @@ async def approve_all_pending_expenditures(
         await conn.rollback()
         raise e
     
+BATCH_RETURNING_FIELDS = ("uuid", "name", "status", "amount", "category", "date_of_expense", "notes")
+BATCH_RETURNING = ", ".join(f"e.{field}" for field in BATCH_RETURNING_FIELDS)
+
+def batch_columns(alias: str) -> str:
+    return ", ".join(f"{alias}.{field}" for field in BATCH_RETURNING_FIELDS)
+
+def batch_results(rows: List[dict], ids: List[UUID]):
+    """
+    Order the per-ID outcomes of a batch statement like the request and count them by outcome
+    """
+    by_id = {row['id']: row for row in rows}
+    results = []
+    counts = {}
+    for id in ids:
+        row = by_id[id]
+        outcome = row['outcome']
+        counts[outcome] = counts.get(outcome, 0) + 1
+        if row.get('uuid') is not None:
+            expenditure = {field: row[field] for field in BATCH_RETURNING_FIELDS}
+            results.append({"id": id, "outcome": outcome, "expenditure": expenditure})
+        else:
+            results.append({"id": id, "outcome": outcome})
+
+    return {"counts": counts, "results": results}
+
+async def run_batch_statement(query: str, values, ids: List[UUID], current_user: dict, conn: AsyncConnection):
+    try:
+        async with conn.cursor() as cur:
+            await cur.execute(query, values)
+            rows = await cur.fetchall()
+
+        await commit_expenditure_changes(conn, current_user)
+        return batch_results(rows, ids)
+
+    except Exception as e:
+        await conn.rollback()
+        raise e
+
+async def approve_pending_expenditures_batch(
+    ids: List[UUID],
+    current_user: dict,
+    conn: AsyncConnection
+):
+    """
+    Approve the listed expenditures in one statement.
+    Each ID comes back as 'updated', 'not_pending' (exists but is not Pending) or 'not_found'.
+    """
+    ids = list(dict.fromkeys(ids))
+    query = f"""
+        WITH approved AS (
+            UPDATE expenditure e
+            SET status = 'Approved'
+            WHERE e.uuid = ANY(%(ids)s) AND e.user_uuid = %(user_uuid)s AND e.status = 'Pending'
+            RETURNING {BATCH_RETURNING}
+        )
+        SELECT requested.id,
+            CASE
+                WHEN approved.uuid IS NOT NULL THEN 'updated'
+                WHEN existing.uuid IS NOT NULL THEN 'not_pending'
+                ELSE 'not_found'
+            END AS outcome,
+            {batch_columns("approved")}
+        FROM unnest(%(ids)s::uuid[]) AS requested(id)
+        LEFT JOIN approved ON approved.uuid = requested.id
+        LEFT JOIN expenditure existing ON existing.uuid = requested.id AND existing.user_uuid = %(user_uuid)s;
+    """
+    values = {"ids": ids, "user_uuid": current_user['uuid']}
+    return await run_batch_statement(query, values, ids, current_user, conn)
+
+async def delete_expenditures_batch(
+    ids: List[UUID],
+    current_user: dict,
+    conn: AsyncConnection
+):
+    """
+    Delete the listed expenditures in one statement, each ID comes back as 'deleted' or 'not_found'
+    """
+    ids = list(dict.fromkeys(ids))
+    query = """
+        WITH deleted AS (
+            DELETE FROM expenditure e
+            WHERE e.uuid = ANY(%(ids)s) AND e.user_uuid = %(user_uuid)s
+            RETURNING e.uuid
+        )
+        SELECT requested.id,
+            CASE WHEN deleted.uuid IS NOT NULL THEN 'deleted' ELSE 'not_found' END AS outcome
+        FROM unnest(%(ids)s::uuid[]) AS requested(id)
+        LEFT JOIN deleted ON deleted.uuid = requested.id;
+    """
+    values = {"ids": ids, "user_uuid": current_user['uuid']}
+    return await run_batch_statement(query, values, ids, current_user, conn)
+
+async def update_expenditures_batch(
+    request: schema.ExpenditureBatchUpdateRequest,
+    current_user: dict,
+    conn: AsyncConnection
+):
+    """
+    Apply a different patch to each listed expenditure in one statement.
+    Patches are sent as parallel arrays with a flag per field, so a field left out of a patch keeps
+    its value while category, notes or status explicitly set to null is cleared (the schema rejects null for
+    the other fields). Each ID comes back as 'updated' or 'not_found'.
+    """
+    patches = [item.model_dump(exclude_unset=True) for item in request.items]
+    ids = [patch.pop('id') for patch in patches]
+
+    if len(set(ids)) != len(ids):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Each expenditure can only appear once in a batch update."
+        )
+    if not all(patches):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No update data provided for some expenditures."
+        )
+
+    fields = sorted(UPDATABLE_FIELDS)
+    column_types = {
+        "name": "varchar", "date_of_expense": "date", "amount": "numeric",
+        "category": "varchar", "notes": "text", "status": "varchar",
+    }
+
+    array_params = ["%(ids)s::uuid[]"]
+    columns = ["uuid"]
+    set_parts = []
+    values = {"ids": ids, "user_uuid": current_user['uuid']}
+    for field in fields:
+        array_params += [f"%(set_{field})s::boolean[]", f"%({field})s::{column_types[field]}[]"]
+        columns += [f"set_{field}", field]
+        set_parts.append(f"{field} = CASE WHEN patch.set_{field} THEN patch.{field} ELSE e.{field} END")
+        values[f"set_{field}"] = [field in patch for patch in patches]
+        values[field] = [patch.get(field) for patch in patches]
+
+    query = f"""
+        WITH patch AS (
+            SELECT * FROM unnest({", ".join(array_params)}) AS patch({", ".join(columns)})
+        ),
+        updated AS (
+            UPDATE expenditure e
+            SET {", ".join(set_parts)}
+            FROM patch
+            WHERE e.uuid = patch.uuid AND e.user_uuid = %(user_uuid)s
+            RETURNING {BATCH_RETURNING}
+        )
+        SELECT requested.id,
+            CASE WHEN updated.uuid IS NOT NULL THEN 'updated' ELSE 'not_found' END AS outcome,
+            {batch_columns("updated")}
+        FROM unnest(%(ids)s::uuid[]) AS requested(id)
+        LEFT JOIN updated ON updated.uuid = requested.id;
+    """
+    return await run_batch_statement(query, values, ids, current_user, conn)
+
 async def delete_expenditure_by_id(
     id: str,
     current_user: dict,
@@ -286,7 +798,7 @@ async def delete_expenditure_by_id(
                     detail=f"Expenditure with ID '{id}' not found or you do not have permission."
                 )
 
-        await conn.commit()
+        await commit_expenditure_changes(conn, current_user)
         
         return {"id": id, "status": "deleted"}
 
@@ -295,4 +807,282 @@ async def delete_expenditure_by_id(
 
     except Exception as e:
         await conn.rollback()
-        raise e
\ No newline at end of file
+        raise e
+
+IMPORT_JOB_COLUMNS = (
+    "uuid", "status", "format", "filename", "bytes_total", "bytes_read", "rows_read",
+    "rows_inserted", "rows_duplicate", "rows_invalid", "error", "created_at", "updated_at", "finished_at"
+)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+async def spool_upload(upload: UploadFile, suffix: str):
+    """
+    Copy an uploaded statement to a temporary file chunk by chunk so the import can run after the request.
+    Returns the path and size of the copy, uploads larger than IMPORT_MAX_UPLOAD_BYTES are rejected.
+    """
+    spool = tempfile.NamedTemporaryFile(
+        prefix="statement-import-", suffix=suffix, dir=settings.IMPORT_SPOOL_DIR, delete=False
+    )
+    size = 0
+    try:
+        with spool:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > settings.IMPORT_MAX_UPLOAD_BYTES:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"Statement is larger than {settings.IMPORT_MAX_UPLOAD_BYTES} bytes.",
+                    )
+                await run_in_threadpool(spool.write, chunk)
+
+    except BaseException:
+        os.unlink(spool.name)
+        raise
+
+    return spool.name, size
+
+async def create_import_job(
+    current_user: dict,
+    upload: UploadFile,
+    import_format: str,
+    conn: AsyncConnection
+):
+    """
+    Spool the upload to disk and record a queued import job for it.
+    Returns the job and the path of the spooled statement for run_import_job.
+    """
+    path, size = await spool_upload(upload, suffix=f".{import_format}")
+
+    query = f"""
+        INSERT INTO import_jobs (user_uuid, format, filename, bytes_total, spool_path)
+        VALUES (%s, %s, %s, %s, %s)
+        RETURNING {", ".join(IMPORT_JOB_COLUMNS)};
+    """
+    values = (current_user['uuid'], import_format, (upload.filename or "")[:255] or None, size, path)
+
+    try:
+        async with conn.cursor() as cur:
+            await cur.execute(query, values)
+            job = await cur.fetchone()
+
+        await conn.commit()
+        return job, path
+
+    except Exception as e:
+        await conn.rollback()
+        os.unlink(path)
+        raise e
+
+async def run_import_job(
+    job_uuid: UUID,
+    current_user: dict,
+    path: str,
+    import_format: str,
+    mapping: schema.CsvColumnMapping,
+) -> None:
+    """
+    Parse a spooled statement and load it batch by batch. Every batch is copied into a temporary staging
+    table and inserted in one statement that skips lines whose date, amount and name already exist,
+    then the job progress is updated in the same transaction so a reader never sees counts for rows that
+    were rolled back. Runs as a background task, so it checks out its own connection.
+    """
+    async def finish(conn: AsyncConnection, job_status: str, error: Optional[str] = None) -> None:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                UPDATE import_jobs SET status = %s, error = %s, updated_at = NOW(), finished_at = NOW()
+                WHERE uuid = %s;
+                """,
+                (job_status, error, job_uuid)
+            )
+        await publish_summary_invalidation(conn, current_user)
+        await conn.commit()
+
+    insert_query = """
+        INSERT INTO expenditure (user_uuid, name, date_of_expense, amount, category, notes)
+        SELECT DISTINCT ON (staged.dedupe_hash)
+            %(user_uuid)s, staged.name, staged.date_of_expense, staged.amount, staged.category, staged.notes
+        FROM (
+            SELECT *, expenditure_dedupe_hash(date_of_expense, amount, name) AS dedupe_hash
+            FROM import_staging
+        ) staged
+        WHERE NOT EXISTS (
+            SELECT 1 FROM expenditure e
+            WHERE e.user_uuid = %(user_uuid)s
+            AND expenditure_dedupe_hash(e.date_of_expense, e.amount, e.name) = staged.dedupe_hash
+        )
+        ORDER BY staged.dedupe_hash;
+    """
+    progress_query = """
+        UPDATE import_jobs
+        SET bytes_read = %s, rows_read = rows_read + %s, rows_inserted = rows_inserted + %s,
+            rows_duplicate = rows_duplicate + %s, rows_invalid = rows_invalid + %s, updated_at = NOW()
+        WHERE uuid = %s;
+    """
+
+    try:
+        async with get_pool().connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "UPDATE import_jobs SET status = 'running', updated_at = NOW() WHERE uuid = %s;", (job_uuid,)
+                )
+            await conn.commit()
+
+            try:
+                with open(path, "rb") as statement:
+                    lines = statement_import.ByteCounter(statement)
+                    if import_format == "ofx":
+                        rows = statement_import.parse_ofx(iter(lines))
+                    else:
+                        rows = statement_import.parse_csv(iter(lines), mapping)
+                    pending = statement_import.batches(rows, settings.IMPORT_BATCH_SIZE)
+
+                    # parsing is cpu bound, so every batch is pulled off the event loop
+                    while (batch := await run_in_threadpool(next, pending, None)) is not None:
+                        expenditures, invalid = batch
+
+                        async with conn.transaction():
+                            async with conn.cursor() as cur:
+                                await cur.execute("""
+                                    CREATE TEMP TABLE import_staging (
+                                        name VARCHAR(255) NOT NULL,
+                                        date_of_expense DATE NOT NULL,
+                                        amount NUMERIC(10, 2) NOT NULL,
+                                        category VARCHAR(50),
+                                        notes TEXT
+                                    ) ON COMMIT DROP;
+                                """)
+                                async with cur.copy(
+                                    "COPY import_staging (name, date_of_expense, amount, category, notes) FROM STDIN"
+                                ) as copy:
+                                    for expenditure in expenditures:
+                                        await copy.write_row((
+                                            expenditure.name,
+                                            expenditure.date_of_expense,
+                                            expenditure.amount,
+                                            expenditure.category,
+                                            expenditure.notes,
+                                        ))
+
+                                await cur.execute(insert_query, {"user_uuid": current_user['uuid']})
+                                inserted = cur.rowcount
+                                await cur.execute(
+                                    progress_query,
+                                    (
+                                        lines.bytes_read,
+                                        len(expenditures) + invalid,
+                                        inserted,
+                                        len(expenditures) - inserted,
+                                        invalid,
+                                        job_uuid,
+                                    )
+                                )
+
+                await finish(conn, "completed")
+
+            except Exception as e:
+                await conn.rollback()
+                print(f"Statement import {job_uuid} failed: {e}")
+                await finish(conn, "failed", str(e))
+
+    except Exception as e:
+        print(f"Statement import {job_uuid} could not record its outcome: {e}")
+
+    finally:
+        # the stale import sweep may have deleted it already
+        remove_spool(path)
+        invalidate_summary_cache(current_user)
+
+def remove_spool(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+async def fail_stale_import_jobs() -> int:
+    """
+    Fail imports that made no progress for IMPORT_STALE_TIMEOUT_SECONDS, their worker was restarted or
+    died mid-import and nothing else will finish them. Their spooled statements are deleted, as is any
+    spooled statement that old without an unfinished job, e.g. left by a crash before the job was recorded.
+    Returns the number of jobs failed.
+    """
+    timeout = settings.IMPORT_STALE_TIMEOUT_SECONDS
+
+    async with get_pool().connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                UPDATE import_jobs
+                SET status = 'failed', error = %s, updated_at = NOW(), finished_at = NOW()
+                WHERE status IN ('queued', 'running') AND updated_at < NOW() - make_interval(secs => %s)
+                RETURNING spool_path;
+                """,
+                ("The import was interrupted by a server restart, please upload the statement again.", timeout)
+            )
+            stale = await cur.fetchall()
+            await cur.execute("SELECT spool_path FROM import_jobs WHERE status IN ('queued', 'running');")
+            active = {row['spool_path'] for row in await cur.fetchall()}
+
+    for row in stale:
+        if row['spool_path']:
+            remove_spool(row['spool_path'])
+
+    cutoff = time.time() - timeout
+    spool_dir = settings.IMPORT_SPOOL_DIR or tempfile.gettempdir()
+    for path in glob.glob(os.path.join(spool_dir, "statement-import-*")):
+        try:
+            if path not in active and os.path.getmtime(path) < cutoff:
+                remove_spool(path)
+        except FileNotFoundError:
+            pass
+
+    return len(stale)
+
+async def sweep_stale_import_jobs() -> None:
+    """
+    Long running task failing stale imports every third of IMPORT_STALE_TIMEOUT_SECONDS
+    """
+    while True:
+        try:
+            failed = await fail_stale_import_jobs()
+            if failed:
+                print(f"Failed {failed} statement imports interrupted by a server restart.")
+        except Exception as e:
+            print(f"Error sweeping stale statement imports: {e}")
+        await asyncio.sleep(settings.IMPORT_STALE_TIMEOUT_SECONDS / 3)
+
+async def get_import_job(
+    job_id: UUID,
+    current_user: dict,
+    conn: AsyncConnection
+):
+    """
+    Handler to get the progress of one of the user's statement imports
+    """
+    query = f"""
+        SELECT {", ".join(IMPORT_JOB_COLUMNS)}
+        FROM import_jobs
+        WHERE uuid = %s AND user_uuid = %s;
+    """
+
+    try:
+        async with conn.cursor() as cur:
+            await cur.execute(query, (job_id, current_user['uuid']))
+            job = await cur.fetchone()
+
+        await conn.commit()
+
+        if job is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Import job with ID '{job_id}' not found or you do not have permission."
+            )
+        return job
+
+    except HTTPException as e:
+        raise e
+
+    except Exception as e:
+        await conn.rollback()
+        raise e
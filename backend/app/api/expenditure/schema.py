@@ -1,7 +1,8 @@
-from datetime import date
-from pydantic import BaseModel, Field, condecimal, constr
-from typing import Optional
+from datetime import date, datetime
+from pydantic import BaseModel, Field, condecimal, constr, field_validator
+from typing import Any, Dict, List, Literal, Optional
 from decimal import Decimal
+from uuid import UUID
 
 
 class ExpenditureModel(BaseModel):
@@ -23,4 +24,90 @@ class ExpenditureUpdateModel(BaseModel):
     model_config = {
         "extra": "forbid",
         "min_anystr_length": 1 
-    }
\ No newline at end of file
+    }
+
+class ExpenditureBulkCreateRequest(BaseModel):
+    items: List[Dict[str, Any]] = Field(
+        min_length=1,
+        max_length=1000,
+        description="Expenditures to create, each in the ExpenditureModel format. Every item is validated individually.",
+    )
+    partial: bool = Field(False, description="Insert the valid items and report errors for the rest instead of rejecting the whole batch.")
+
+class ExpenditureBatchIdsRequest(BaseModel):
+    ids: List[UUID] = Field(min_length=1, max_length=1000, description="Expenditures to act on, duplicates are ignored.")
+
+class ExpenditureBatchPatch(ExpenditureUpdateModel):
+    id: UUID = Field(description="Expenditure to update.")
+
+    @field_validator("name", "date_of_expense", "amount")
+    @classmethod
+    def not_null(cls, value):
+        # these columns are NOT NULL, only category, notes and status can be cleared
+        if value is None:
+            raise ValueError("can not be cleared, leave it out of the patch to keep its value")
+        return value
+
+class ExpenditureBatchUpdateRequest(BaseModel):
+    items: List[ExpenditureBatchPatch] = Field(
+        min_length=1,
+        max_length=1000,
+        description="One patch per expenditure, only the fields present in a patch are changed.",
+    )
+
+class ExpenditureFilters(BaseModel):
+    status: Optional[str] = Field(None, description="Only return expenditures with this status (e.g., 'Approved', 'Pending').")
+    category: Optional[str] = Field(None, description="Only return expenditures in this category.")
+    date_from: Optional[date] = Field(None, description="Earliest date_of_expense to include (YYYY-MM-DD).")
+    date_to: Optional[date] = Field(None, description="Latest date_of_expense to include (YYYY-MM-DD).")
+    min_amount: Optional[Decimal] = Field(None, description="Smallest amount to include.")
+    max_amount: Optional[Decimal] = Field(None, description="Largest amount to include.")
+
+class ExpenditurePage(BaseModel):
+    items: List[Dict[str, Any]] = Field(description="Expenditures on this page, newest first.")
+    next_cursor: Optional[str] = Field(None, description="Opaque cursor for the next page, null on the last page.")
+
+class SummaryBucket(BaseModel):
+    key: Optional[str] = Field(None, description="The category or status of this bucket.")
+    total: Decimal = Field(description="Sum of the amounts in this bucket.")
+    count: int = Field(description="Number of expenditures in this bucket.")
+
+class ExpenditureSummary(BaseModel):
+    total: Decimal = Field(description="Sum of all matching amounts.")
+    count: int = Field(description="Number of matching expenditures.")
+    by_category: List[SummaryBucket]
+    by_status: List[SummaryBucket]
+
+class PeriodBucket(BaseModel):
+    period: date = Field(description="First day of the day, week or month.")
+    total: Decimal
+    count: int
+
+class ExpenditureTimeseries(BaseModel):
+    granularity: Literal["day", "week", "month"]
+    buckets: List[PeriodBucket]
+
+class CsvColumnMapping(BaseModel):
+    date_column: str = Field("date", description="Header of the column holding the transaction date.")
+    amount_column: str = Field("amount", description="Header of the column holding the amount.")
+    name_column: str = Field("description", description="Header of the column used as the expenditure name.")
+    category_column: Optional[str] = Field(None, description="Header of the column holding the category, if any.")
+    notes_column: Optional[str] = Field(None, description="Header of the column holding notes, if any.")
+    date_format: str = Field("%Y-%m-%d", description="strptime format of the date column.")
+    delimiter: str = Field(",", min_length=1, max_length=1)
+
+class ImportJob(BaseModel):
+    uuid: UUID
+    status: Literal["queued", "running", "completed", "failed"]
+    format: Literal["csv", "ofx"]
+    filename: Optional[str] = None
+    bytes_total: int = Field(description="Size of the uploaded statement.")
+    bytes_read: int = Field(description="How much of the statement has been parsed so far.")
+    rows_read: int
+    rows_inserted: int
+    rows_duplicate: int = Field(description="Rows skipped because the same date, amount and name already exist.")
+    rows_invalid: int = Field(description="Rows that could not be parsed into an expenditure.")
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,124 @@
+"""
+Incremental parsers for bank statement imports.
+Files are read line by line from disk so a statement of any size is parsed in constant memory.
+"""
+import csv
+import re
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from .schema import CsvColumnMapping, ExpenditureModel
+
+
+class ByteCounter:
+    """
+    iterate a binary file line by line while keeping track of how many bytes were consumed,
+    text mode files cannot report their position while being iterated
+    """
+
+    def __init__(self, file: BinaryIO, encoding: str = "utf-8"):
+        self.file = file
+        self.encoding = encoding
+        self.bytes_read = 0
+
+    def __iter__(self) -> Iterator[str]:
+        for raw_line in self.file:
+            self.bytes_read += len(raw_line)
+            yield raw_line.decode(self.encoding, errors="replace")
+
+
+def parse_amount(value: str) -> Decimal:
+    """
+    parse bank formatted amounts such as '$1,234.50', '-12.00' or '(12.00)'
+    """
+    value = value.strip()
+    negative = value.startswith("(") and value.endswith(")")
+    cleaned = re.sub(r"[^\d.\-]", "", value)
+    amount = Decimal(cleaned)
+    return -amount if negative else amount
+
+
+def _to_expenditure(name: str, date_of_expense: date, amount: Decimal, category=None, notes=None) -> ExpenditureModel:
+    return ExpenditureModel(
+        name=name.strip()[:255],
+        date_of_expense=date_of_expense,
+        amount=amount,
+        category=category.strip()[:50] if category else None,
+        notes=notes or None,
+    )
+
+
+def parse_csv(lines: Iterator[str], mapping: CsvColumnMapping) -> Iterator[Optional[ExpenditureModel]]:
+    """
+    yield one expenditure per statement row, or None for a row that could not be parsed
+    """
+    reader = csv.DictReader(lines, delimiter=mapping.delimiter)
+    for row in reader:
+        # a ragged row, shorter than the header, has None for its missing columns
+        try:
+            yield _to_expenditure(
+                name=row[mapping.name_column] or "",
+                date_of_expense=datetime.strptime((row[mapping.date_column] or "").strip(), mapping.date_format).date(),
+                amount=parse_amount(row[mapping.amount_column] or ""),
+                category=row.get(mapping.category_column) if mapping.category_column else None,
+                notes=row.get(mapping.notes_column) if mapping.notes_column else None,
+            )
+        except (AttributeError, KeyError, TypeError, ValueError, InvalidOperation, ValidationError):
+            yield None
+
+
+_ofx_leaf = re.compile(r"<(\w+)>([^<\r\n]*)")
+
+
+def parse_ofx(lines: Iterator[str]) -> Iterator[Optional[ExpenditureModel]]:
+    """
+    yield one expenditure per <STMTTRN> block. works for both SGML (OFX 1.x, unclosed leaf tags)
+    and XML (OFX 2.x) statements since only the transaction blocks are buffered.
+    """
+    block: Optional[List[str]] = None
+
+    for line in lines:
+        upper = line.upper()
+        if "<STMTTRN>" in upper:
+            block = []
+        if block is None:
+            continue
+
+        block.append(line)
+        if "</STMTTRN>" not in upper:
+            continue
+
+        fields = {tag.upper(): value.strip() for tag, value in _ofx_leaf.findall("".join(block))}
+        block = None
+        try:
+            yield _to_expenditure(
+                name=fields.get("NAME") or fields.get("PAYEE") or fields.get("MEMO") or "",
+                date_of_expense=datetime.strptime(fields["DTPOSTED"][:8], "%Y%m%d").date(),
+                amount=parse_amount(fields["TRNAMT"]),
+                notes=fields.get("MEMO"),
+            )
+        except (AttributeError, KeyError, ValueError, InvalidOperation, ValidationError):
+            yield None
+
+
+def batches(rows: Iterator[Optional[ExpenditureModel]], size: int) -> Iterator[Tuple[List[ExpenditureModel], int]]:
+    """
+    group parsed rows into (valid rows, invalid row count) batches of at most `size` rows
+    """
+    valid: List[ExpenditureModel] = []
+    invalid = 0
+    for row in rows:
+        if row is None:
+            invalid += 1
+        else:
+            valid.append(row)
+
+        if len(valid) + invalid >= size:
+            yield valid, invalid
+            valid, invalid = [], 0
+
+    if valid or invalid:
+        yield valid, invalid
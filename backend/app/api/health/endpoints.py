@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Request, status
+
+from . import schema
+from . import handlers
+
+router = APIRouter()
+
+@router.get("/live",
+    status_code=status.HTTP_200_OK,
+    response_model=schema.LivenessResponse,
+    responses={
+        status.HTTP_200_OK: {"description": "The worker is up and its event loop is responsive"},
+    },
+)
+async def get_liveness():
+    """
+    Liveness probe, never touches the database so an outage elsewhere does not get the worker restarted
+    """
+    return handlers.liveness()
+
+@router.get("/ready",
+    status_code=status.HTTP_200_OK,
+    response_model=schema.ReadinessResponse,
+    responses={
+        status.HTTP_200_OK: {"description": "The worker can serve traffic"},
+        status.HTTP_503_SERVICE_UNAVAILABLE: {"description": "The database is unreachable, not migrated, or the OpenAI client is missing"},
+    },
+)
+async def get_readiness(request: Request):
+    """
+    Readiness probe, checks the database connection and schema version and the OpenAI client
+    """
+    return await handlers.readiness(request)
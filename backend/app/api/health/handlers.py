@@ -0,0 +1,48 @@
+import asyncio
+
+from fastapi import Request, status
+from fastapi.responses import JSONResponse
+
+from config import settings
+from db import migrations, postgres
+from . import schema
+
+
+async def check_database() -> str:
+    """
+    check out a pooled connection and make sure the schema is migrated, in one query
+    """
+    try:
+        async with postgres.get_pool().connection(timeout=settings.HEALTH_CHECK_TIMEOUT_SECONDS) as conn:
+            version = await asyncio.wait_for(
+                migrations.current_version(conn), timeout=settings.HEALTH_CHECK_TIMEOUT_SECONDS
+            )
+    except asyncio.TimeoutError:
+        return "timed out"
+    except Exception as e:
+        return f"unavailable: {e}"
+
+    if version < migrations.LATEST_VERSION:
+        return f"schema at version {version}, expected {migrations.LATEST_VERSION}"
+    return "ok"
+
+
+def liveness() -> schema.LivenessResponse:
+    return schema.LivenessResponse(status="ok")
+
+
+async def readiness(request: Request) -> JSONResponse:
+    """
+    200 when this worker can serve traffic, 503 with the failed checks otherwise
+    """
+    checks = {
+        "database": await check_database(),
+        "openai_client": "ok" if hasattr(request.app.state, "openai_client") else "not initialized",
+    }
+    ready = all(result == "ok" for result in checks.values())
+
+    response = schema.ReadinessResponse(status="ready" if ready else "unavailable", checks=checks)
+    return JSONResponse(
+        response.model_dump(),
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
@@ -0,0 +1,8 @@
+from fastapi import APIRouter
+
+from .endpoints import router as health_router
+
+
+router = APIRouter()
+
+router.include_router(health_router, prefix="/health", tags=["health"])
@@ -0,0 +1,12 @@
+from pydantic import BaseModel, Field
+from typing import Dict
+
+
+# Schema for liveness responses
+class LivenessResponse(BaseModel):
+    status: str = Field(description="Always 'ok' while the worker's event loop is serving requests.")
+
+# Schema for readiness responses
+class ReadinessResponse(BaseModel):
+    status: str = Field(description="'ready' when every check passed, 'unavailable' otherwise.")
+    checks: Dict[str, str] = Field(description="Outcome of every readiness check, 'ok' or what failed.")
@@ -1,9 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from openai import OpenAI
+import os
+from typing import Optional
+from uuid import UUID
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from openai import AsyncOpenAI
+from psycopg import AsyncConnection
 
+from db.postgres import get_async_session
+from llm import audio
 from llm.gpt import get_openai_client
 from . import schema
 from . import handlers
+from . import jobs
 
 
 router = APIRouter()
@@ -19,7 +28,7 @@ router = APIRouter()
 )
 async def get_chat_response(
     chat_history: schema.TextChatModel,
-    client: OpenAI = Depends(get_openai_client)
+    client: AsyncOpenAI = Depends(get_openai_client)
 ):
     try:
         response = await handlers.get_chat_response(chat_history=chat_history, client=client)
@@ -34,10 +43,34 @@ async def get_chat_response(
             detail=f"Server failed: {str(e)}. Please try again in a while.",
         )
 
+@router.post(
+    "/chat/stream",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Server-sent events: token, expense, and a terminal done or error event",
+            "content": {"text/event-stream": {}},
+        },
+    },
+)
+async def stream_chat_response(
+    chat_history: schema.TextChatModel,
+    client: AsyncOpenAI = Depends(get_openai_client)
+):
+    """
+    Streams the chat response as server-sent events, emitting each extracted expense as soon as it is complete.
+    """
+    return StreamingResponse(
+        handlers.stream_chat_response(chat_history=chat_history, client=client),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.post("/transcribe-audio/")
 async def transcribe_audio(
     file: UploadFile = File(...), 
-    client: OpenAI = Depends(get_openai_client)
+    client: AsyncOpenAI = Depends(get_openai_client)
 ):
     """
     Receives an audio file and transcribes it to text using OpenAI's Whisper model.
@@ -53,4 +86,122 @@ async def transcribe_audio(
         raise HTTPException(
             status.HTTP_500_BAD_REQUEST,
             detail=f"Server failed: {str(e)}. Please try again in a while.",
-        )
\ No newline at end of file
+        )
+
+@router.post(
+    "/transcribe-audio/stream",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    responses={
+        status.HTTP_200_OK: {
+            "description": "Server-sent events: segment, partial, and a terminal done or error event",
+            "content": {"text/event-stream": {}},
+        },
+        status.HTTP_400_BAD_REQUEST: {"description": "Not an audio file"},
+    },
+)
+async def stream_audio_transcription(
+    file: UploadFile = File(...),
+    client: AsyncOpenAI = Depends(get_openai_client)
+):
+    """
+    Transcribes a long recording in segments and streams each segment's text as soon as it is ready.
+    """
+    await handlers.validate_audio_upload(file)
+    # the upload is closed once this function returns, the stream works on its own copy.
+    # the copy is deleted by a background task, which also runs when the client leaves before the stream starts
+    path = await audio.spool_to_file(file)
+    return StreamingResponse(
+        handlers.stream_audio_transcription(path=path, filename=file.filename, client=client),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(os.unlink, path),
+    )
+
+@router.post(
+    "/jobs/chat",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=schema.LLMJob,
+    responses={
+        status.HTTP_202_ACCEPTED: {"description": "Chat job queued, poll it or wait for the callback"},
+        status.HTTP_400_BAD_REQUEST: {"description": "Callback host is not allowed"},
+    },
+)
+async def submit_chat_job(
+    request: schema.ChatJobRequest,
+    conn: AsyncConnection = Depends(get_async_session)
+):
+    """
+    Queues a chat extraction to run in the background and returns the job right away.
+    """
+    try:
+        response = await jobs.submit_chat_job(request=request, conn=conn)
+        return response
+
+    except HTTPException as e:
+        raise e
+
+    except Exception as e:
+        raise HTTPException(
+            status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Server failed to queue chat job: {str(e)}. Please try again in a while.",
+        )
+
+@router.post(
+    "/jobs/transcribe",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=schema.LLMJob,
+    responses={
+        status.HTTP_202_ACCEPTED: {"description": "Transcription job queued, poll it or wait for the callback"},
+        status.HTTP_400_BAD_REQUEST: {"description": "Not an audio file or callback host is not allowed"},
+    },
+)
+async def submit_transcription_job(
+    file: UploadFile = File(...),
+    callback_url: Optional[str] = Form(None),
+    conn: AsyncConnection = Depends(get_async_session)
+):
+    """
+    Queues a Whisper transcription to run in the background and returns the job right away.
+    """
+    try:
+        response = await jobs.submit_transcription_job(audio_file=file, callback_url=callback_url, conn=conn)
+        return response
+
+    except HTTPException as e:
+        raise e
+
+    except Exception as e:
+        raise HTTPException(
+            status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Server failed to queue transcription job: {str(e)}. Please try again in a while.",
+        )
+
+@router.get(
+    "/jobs/{job_id}",
+    status_code=status.HTTP_200_OK,
+    response_model=schema.LLMJob,
+    responses={
+        status.HTTP_200_OK: {"description": "Current state of the job, with the result once completed"},
+        status.HTTP_404_NOT_FOUND: {"description": "Job not found"},
+    },
+)
+async def get_job(
+    job_id: UUID,
+    conn: AsyncConnection = Depends(get_async_session)
+):
+    """
+    Returns the status of a background chat or transcription job and its result once completed.
+    """
+    try:
+        response = await jobs.get_job(job_id=job_id, conn=conn)
+        return response
+
+    except HTTPException as e:
+        raise e
+
+    except Exception as e:
+        raise HTTPException(
+            status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Server failed to get job: {str(e)}. Please try again in a while.",
+        )
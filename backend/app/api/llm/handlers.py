@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, status
 from openai import (
-    OpenAI, 
+    AsyncOpenAI, 
     AuthenticationError, 
     BadRequestError, 
     RateLimitError, 
@@ -8,18 +8,33 @@ from openai import (
     APIConnectionError,
     APIError
 )
+import asyncio
 import json
+import os
 from datetime import datetime
+from typing import AsyncIterator, BinaryIO, Tuple, Union
 from zoneinfo import ZoneInfo
 
-from llm.gpt import get_openai_client
+from config import settings
+from llm.gpt import get_openai_client, llm_slot, record_token_usage, track_llm_call
+from llm import audio, extractors
+from llm.audio import SNIFF_BYTES, sniff_audio_format
+from llm.images import preprocess_image_url
+from llm import response_cache
+from llm.stream_parser import ExpenseStreamParser
 from . import schema
 
+CHAT_MODEL = "gpt-5-nano-2025-08-07"
+TRANSCRIPTION_MODEL = "whisper-1"
+# bump whenever the system prompt changes so cached responses from the old prompt are not reused
+PROMPT_VERSION = "1"
+
 sgt_zone = ZoneInfo("Asia/Singapore") 
-now_in_sgt = datetime.now(sgt_zone)
-current_date_sgt = now_in_sgt.strftime("%Y-%m-%d")
 
-system_prompt = f"The current date is {current_date_sgt}" + """You are an expert in extracting expense details. You can extract multiple expenses if the user query provides it, and you should add them into the expense list. For images, you should combine the expenses into one expense unless otherwise stated by the user.
+def current_date_sgt() -> str:
+    return datetime.now(sgt_zone).strftime("%Y-%m-%d")
+
+system_prompt_template = """You are an expert in extracting expense details. You can extract multiple expenses if the user query provides it, and you should add them into the expense list. For images, you should combine the expenses into one expense unless otherwise stated by the user.
 For the expense date, use the current date unless the user explicitly states a date. Your response should summarise the expenses across the caht history.
 
 Respond strictly in this format:
@@ -46,87 +61,319 @@ Only respond with this JSON format.
 
 router = APIRouter()
 
-async def get_chat_response(
-    chat_history: schema.TextChatModel,
-    client: OpenAI = Depends(get_openai_client)
-):
-    initial_history = [{"role": "system", "content": system_prompt}]
-    full_history = initial_history + [msg.model_dump() for msg in chat_history.chat_history]
-
-    response = client.chat.completions.create(
-        model="gpt-5-nano-2025-08-07",
-        messages=full_history,
-    )
-
-    json_string = response.choices[0].message.content 
-    try:
-        return json.loads(json_string)
-    
-    except AuthenticationError as e:
-        raise HTTPException(
+def to_http_exception(e: Exception) -> HTTPException:
+    """
+    map an exception raised while generating LLM output to the HTTPException returned to the client
+    """
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, AuthenticationError):
+        return HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"OpenAI Authentication Error: {e.message}"
         )
-    except BadRequestError as e:
-        raise HTTPException(
+    if isinstance(e, BadRequestError):
+        return HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"OpenAI Bad Request Error: {e.message}"
         )
-    except RateLimitError as e:
-        raise HTTPException(
+    if isinstance(e, RateLimitError):
+        return HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
             detail=f"OpenAI Rate Limit Exceeded: {e.message}"
         )
-    except (APITimeoutError, APIConnectionError) as e:
-        raise HTTPException(
+    if isinstance(e, (APITimeoutError, APIConnectionError)):
+        return HTTPException(
             status_code=status.HTTP_504_GATEWAY_TIMEOUT,
             detail=f"OpenAI Connection Error: {e.message}"
         )
-    except APIError as e:
-        raise HTTPException(
+    if isinstance(e, APIError):
+        return HTTPException(
             status_code=status.HTTP_502_BAD_GATEWAY,
             detail=f"OpenAI API Error: {e.message}"
         )
-        
-    except json.JSONDecodeError as e:
-      raise HTTPException(
-          status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-          detail=f"Error parsing LLM output to json: {str(e)}"
-      )
+    if isinstance(e, json.JSONDecodeError):
+        return HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error parsing LLM output to json: {str(e)}"
+        )
+    return HTTPException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        detail=f"Error with generating LLM output: {str(e)}"
+    )
+
+def build_messages(chat_history: schema.TextChatModel, prompt_date: str) -> list:
+    """
+    prepend the system prompt for the given date to the chat history sent by the client
+    """
+    system_prompt = f"The current date is {prompt_date}" + system_prompt_template
+    initial_history = [{"role": "system", "content": system_prompt}]
+    return initial_history + [msg.model_dump() for msg in chat_history.chat_history]
+
+async def preprocess_chat_images(chat_history: schema.TextChatModel) -> schema.TextChatModel:
+    """
+    return a copy of the chat history with every image shrunk, images are processed concurrently
+    """
+    chat_history = chat_history.model_copy(deep=True)
+    image_parts = [
+        part
+        for message in chat_history.chat_history
+        for part in message.content
+        if isinstance(part, schema.ImageContentPart)
+    ]
+    urls = await asyncio.gather(*(preprocess_image_url(part.image_url.url) for part in image_parts))
+    for part, url in zip(image_parts, urls):
+        part.image_url.url = url
+    return chat_history
+
+def response_cache_key(chat_history: schema.TextChatModel, prompt_date: str) -> str:
+    return response_cache.cache_key(chat_history.model_dump(), CHAT_MODEL, PROMPT_VERSION, prompt_date)
+
+async def generate_chat_response(chat_history: schema.TextChatModel, client: AsyncOpenAI) -> dict:
+    """
+    return the parsed model reply for the chat history. simple text requests may be answered by the
+    local extractor, otherwise the response cache is tried before the model.
+    upstream errors are raised as is so callers can tell transient failures apart.
+    """
+    prompt_date = current_date_sgt()
+    local_response = extractors.route(chat_history.model_dump()["chat_history"], prompt_date)
+    if local_response is not None:
+        return local_response
+
+    cache_key = response_cache_key(chat_history, prompt_date)
+    cached_response = await response_cache.lookup(cache_key)
+    if cached_response is not None:
+        return cached_response
+
+    # the cache key stays on the original images, a hit never pays for preprocessing
+    full_history = build_messages(await preprocess_chat_images(chat_history), prompt_date)
+
+    async with llm_slot(), track_llm_call("chat", CHAT_MODEL) as span:
+        response = await client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=full_history,
+            timeout=settings.LLM_CHAT_TIMEOUT_SECONDS,
+        )
+        record_token_usage(CHAT_MODEL, response.usage, span)
+
+    json_string = response.choices[0].message.content 
+    parsed_response = json.loads(json_string)
+
+    await response_cache.store(cache_key, parsed_response)
+    return parsed_response
+
+async def get_chat_response(
+    chat_history: schema.TextChatModel,
+    client: AsyncOpenAI = Depends(get_openai_client)
+):
+    try:
+        return await generate_chat_response(chat_history, client)
     
     except Exception as e:
-      raise HTTPException(
-          status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-          detail=f"Error with generating LLM output: {str(e)}"
-      )
-    
-async def get_audio_transcription(audio_file: UploadFile, client: OpenAI) -> dict:
+        raise to_http_exception(e)
+
+def sse_event(event: str, data) -> str:
     """
-    Reads an uploaded audio file and calls the OpenAI Whisper API 
-    for transcription.
+    format a single server-sent event
     """
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def stream_chat_response(
+    chat_history: schema.TextChatModel,
+    client: AsyncOpenAI
+) -> AsyncIterator[str]:
+    """
+    Stream the model reply as server-sent events.
+    `token` events carry the raw text deltas, an `expense` event is sent as soon as an element of the
+    expense list is complete, and the stream always ends with either a `done` event holding the full
+    parsed reply or an `error` event holding the status code and detail.
+    """
+    prompt_date = current_date_sgt()
+    cache_key = response_cache_key(chat_history, prompt_date)
+    parser = ExpenseStreamParser()
+
+    try:
+        ready_response = extractors.route(chat_history.model_dump()["chat_history"], prompt_date)
+        if ready_response is None:
+            ready_response = await response_cache.lookup(cache_key)
+        if ready_response is not None:
+            for expense in ready_response.get("expense") or []:
+                yield sse_event("expense", expense)
+            yield sse_event("done", ready_response)
+            return
+
+        full_history = build_messages(await preprocess_chat_images(chat_history), prompt_date)
+        async with llm_slot(), track_llm_call("chat_stream", CHAT_MODEL) as span:
+            stream = await client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=full_history,
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=settings.LLM_CHAT_TIMEOUT_SECONDS,
+            )
+            async with stream:
+                async for chunk in stream:
+                    # with include_usage the last chunk carries the usage of the whole stream and no choices
+                    record_token_usage(CHAT_MODEL, chunk.usage, span)
+                    if not chunk.choices:
+                        continue
+
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+
+                    yield sse_event("token", {"delta": delta})
+                    for expense in parser.feed(delta):
+                        yield sse_event("expense", expense)
+
+        parsed_response = parser.close()
+        await response_cache.store(cache_key, parsed_response)
+        yield sse_event("done", parsed_response)
+
+    except Exception as e:
+        http_exception = to_http_exception(e)
+        yield sse_event("error", {
+            "status_code": http_exception.status_code,
+            "detail": http_exception.detail,
+        })
     
+async def transcribe_audio(
+    filename: str, audio: Union[bytes, BinaryIO], client: AsyncOpenAI, wait_for_slot: bool = False
+) -> dict:
+    """
+    transcribe one audio file with Whisper, upstream errors are raised as is.
+    file objects are read in chunks while the request is sent and rewound on retries.
+    """
+    async with llm_slot(wait=wait_for_slot), track_llm_call("transcription", TRANSCRIPTION_MODEL):
+        response = await client.audio.transcriptions.create(
+            model=TRANSCRIPTION_MODEL,
+            file=(filename, audio),
+            timeout=settings.LLM_TRANSCRIBE_TIMEOUT_SECONDS,
+        )
+
+    return {"transcription": response.text}
+
+def needs_segmenting(size: int) -> bool:
+    """
+    only files big enough to possibly run past one segment are probed, smaller ones go out as they are
+    """
+    return size > settings.LLM_AUDIO_SEGMENT_MIN_BYTES and audio.ffmpeg_binary() is not None
+
+def check_whisper_size(size: int) -> None:
+    if size > audio.WHISPER_MAX_BYTES and audio.ffmpeg_binary() is None:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Audio files over {audio.WHISPER_MAX_BYTES} bytes can not be transcribed on this server.",
+        )
+
+async def transcribe_segments(path: str, filename: str, client: AsyncOpenAI) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Transcribe a spooled audio file, split into segments that are transcribed concurrently.
+    Yields a `segment` event as each segment finishes, a `partial` event with the stitched transcript
+    whenever the finished segments at the start of the file grow, and a final `done` event.
+    A file that fits in one segment is sent to Whisper unchanged.
+    """
+    duration, silences = await audio.analyze(path)
+    segments = audio.plan_segments(duration, silences)
+
+    if len(segments) == 1 and os.path.getsize(path) <= audio.WHISPER_MAX_BYTES:
+        with open(path, "rb") as audio_file:
+            result = await transcribe_audio(filename, audio_file, client)
+        yield "done", {**result, "segments": 1}
+        return
+
+    stem = os.path.splitext(filename or "audio")[0]
+    # segments queue for a model slot without the queue timeout, one late segment would fail the whole file.
+    # at most half the slots go to one recording so that two of them cannot starve everything else
+    semaphore = asyncio.Semaphore(max(1, min(settings.LLM_AUDIO_SEGMENT_CONCURRENCY, settings.LLM_MAX_CONCURRENCY // 2)))
+
+    async def run(segment: audio.Segment):
+        async with semaphore:
+            data = await audio.extract_segment(path, segment)
+            result = await transcribe_audio(f"{stem}-{segment.index}.flac", data, client, wait_for_slot=True)
+            return segment, result["transcription"]
+
+    tasks = [asyncio.create_task(run(segment)) for segment in segments]
+    texts = [None] * len(segments)
+    ready = 0
+    try:
+        for finished in asyncio.as_completed(tasks):
+            segment, text = await finished
+            texts[segment.index] = text
+            yield "segment", {"index": segment.index, "start": segment.start, "end": segment.end, "text": text}
+
+            previous_ready = ready
+            while ready < len(texts) and texts[ready] is not None:
+                ready += 1
+            if ready > previous_ready and ready < len(texts):
+                yield "partial", {"transcription": audio.stitch(segments[:ready], texts[:ready])}
+
+    finally:
+        # a failed segment fails the whole file, nothing else needs to keep running
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    yield "done", {"transcription": audio.stitch(segments, texts), "segments": len(segments)}
+
+async def transcribe_path(path: str, filename: str, client: AsyncOpenAI) -> dict:
+    """
+    transcribe a spooled audio file, segmented when it is long enough and ffmpeg is available
+    """
+    size = os.path.getsize(path)
+    check_whisper_size(size)
+
+    if not needs_segmenting(size):
+        with open(path, "rb") as audio_file:
+            return await transcribe_audio(filename, audio_file, client)
+
+    async for event, data in transcribe_segments(path, filename, client):
+        if event == "done":
+            return {"transcription": data["transcription"]}
+
+async def validate_audio_upload(audio_file: UploadFile) -> None:
+    """
+    Check the declared type and the magic bytes of an uploaded audio file without reading it whole.
+    The file is left positioned at its start.
+    """
     if not audio_file.content_type or not audio_file.content_type.startswith("audio/"):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Invalid file type: {audio_file.content_type}. Please upload an audio file."
         )
 
-    try:
-        audio_bytes = await audio_file.read()
-
-        if not audio_bytes:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="The audio file is empty."
-            )
+    header = await audio_file.read(SNIFF_BYTES)
+    await audio_file.seek(0)
 
-        response = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=(audio_file.filename, audio_bytes)
+    if not header:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The audio file is empty."
+        )
+    if sniff_audio_format(header) is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="The uploaded file is not in a supported audio format."
         )
 
-        return {"transcription": response.text}
+async def get_audio_transcription(audio_file: UploadFile, client: AsyncOpenAI) -> dict:
+    """
+    Calls the OpenAI Whisper API to transcribe an uploaded audio file.
+    The upload is already spooled by the form parser, its file object is streamed to the api as is
+    instead of being copied into memory first.
+    """
+    await validate_audio_upload(audio_file)
+    check_whisper_size(audio_file.size or 0)
+
+    try:
+        if not needs_segmenting(audio_file.size or 0):
+            return await transcribe_audio(audio_file.filename, audio_file.file, client)
+
+        path = await audio.spool_to_file(audio_file)
+        try:
+            return await transcribe_path(path, audio_file.filename, client)
+        finally:
+            os.unlink(path)
 
     except BadRequestError as e:
         raise HTTPException(
@@ -143,4 +390,29 @@ async def get_audio_transcription(audio_file: UploadFile, client: OpenAI) -> dic
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"OpenAI API error: {e.message}"
-        )
\ No newline at end of file
+        )
+
+async def stream_audio_transcription(path: str, filename: str, client: AsyncOpenAI) -> AsyncIterator[str]:
+    """
+    Stream the transcription of a spooled audio file as server-sent events.
+    `segment` events arrive in completion order, `partial` events carry the transcript stitched so far,
+    and the stream ends with a `done` or an `error` event like the chat stream. The caller deletes the file.
+    """
+    try:
+        check_whisper_size(os.path.getsize(path))
+
+        if not needs_segmenting(os.path.getsize(path)):
+            with open(path, "rb") as audio_file:
+                result = await transcribe_audio(filename, audio_file, client)
+            yield sse_event("done", {**result, "segments": 1})
+            return
+
+        async for event, data in transcribe_segments(path, filename, client):
+            yield sse_event(event, data)
+
+    except Exception as e:
+        http_exception = to_http_exception(e)
+        yield sse_event("error", {
+            "status_code": http_exception.status_code,
+            "detail": http_exception.detail,
+        })
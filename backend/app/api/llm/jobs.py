@@ -0,0 +1,336 @@
+"""
+Postgres backed queue for chat extraction and transcription jobs.
+Submitting only inserts a row, a pool of worker tasks started with the app claims jobs with
+SELECT ... FOR UPDATE SKIP LOCKED, so any number of workers across processes never run the same job.
+Rate limits and timeouts are retried with exponential backoff, other failures fail the job.
+The audio of transcription jobs is spooled to LLM_JOB_SPOOL_DIR, the row only keeps its path.
+Clients poll GET /llm/jobs/{id} or pass a callback_url that receives the finished job.
+"""
+import asyncio
+import os
+import random
+from typing import List, Optional, Tuple
+from urllib.parse import urlparse
+from uuid import UUID
+
+import httpx
+from fastapi import HTTPException, UploadFile, status
+from openai import APIConnectionError, APITimeoutError, AsyncOpenAI, RateLimitError
+from psycopg import AsyncConnection
+from psycopg.types.json import Jsonb
+
+from config import settings
+from db.postgres import get_pool
+from llm import audio
+from . import handlers
+from . import schema
+
+
+JOB_COLUMNS = (
+    "uuid", "kind", "status", "attempts", "result", "error",
+    "run_at", "created_at", "updated_at", "finished_at"
+)
+
+# set on submit so an idle worker in this process starts right away instead of at its next poll
+_wakeup = asyncio.Event()
+# set on shutdown, workers finish the job they are running and then exit
+_stopping = asyncio.Event()
+
+
+def allowed_callback(url: Optional[str]) -> bool:
+    if url is None:
+        return True
+    allowed_hosts = {host.strip().lower() for host in settings.LLM_JOB_CALLBACK_ALLOWED_HOSTS.split(",") if host.strip()}
+    return (urlparse(url).hostname or "").lower() in allowed_hosts
+
+
+async def enqueue_job(conn: AsyncConnection, kind: str, payload: dict, audio_path: Optional[str], callback_url: Optional[str]):
+    if not allowed_callback(callback_url):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Callbacks to this host are not allowed.",
+        )
+
+    query = f"""
+        INSERT INTO llm_jobs (kind, payload, audio_path, callback_url)
+        VALUES (%s, %s, %s, %s)
+        RETURNING {", ".join(JOB_COLUMNS)};
+    """
+
+    try:
+        async with conn.cursor() as cur:
+            await cur.execute(query, (kind, Jsonb(payload), audio_path, callback_url))
+            job = await cur.fetchone()
+
+        await conn.commit()
+        _wakeup.set()
+        return job
+
+    except Exception as e:
+        await conn.rollback()
+        raise e
+
+
+async def submit_chat_job(request: schema.ChatJobRequest, conn: AsyncConnection):
+    """
+    queue a chat extraction, the result is the same body POST /llm/chat returns
+    """
+    payload = request.model_dump(mode="json", exclude={"callback_url"})
+    callback_url = str(request.callback_url) if request.callback_url else None
+    return await enqueue_job(conn, "chat", payload, None, callback_url)
+
+
+async def submit_transcription_job(audio_file: UploadFile, callback_url: Optional[str], conn: AsyncConnection):
+    """
+    queue a Whisper transcription, the audio is spooled to LLM_JOB_SPOOL_DIR until it has been transcribed
+    """
+    await handlers.validate_audio_upload(audio_file)
+    path = await audio.spool_to_file(audio_file, settings.LLM_JOB_SPOOL_DIR)
+
+    payload = {"filename": audio_file.filename or "audio"}
+    try:
+        return await enqueue_job(conn, "transcription", payload, path, callback_url)
+    except BaseException:
+        os.unlink(path)
+        raise
+
+
+async def get_job(job_id: UUID, conn: AsyncConnection):
+    query = f"""
+        SELECT {", ".join(JOB_COLUMNS)}
+        FROM llm_jobs
+        WHERE uuid = %s;
+    """
+
+    try:
+        async with conn.cursor() as cur:
+            await cur.execute(query, (job_id,))
+            job = await cur.fetchone()
+
+        await conn.commit()
+
+        if job is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"LLM job with ID '{job_id}' not found."
+            )
+        return job
+
+    except HTTPException as e:
+        raise e
+
+    except Exception as e:
+        await conn.rollback()
+        raise e
+
+
+async def claim_job() -> Optional[dict]:
+    """
+    lock the next runnable job for this worker. a job still marked running after the lock timeout
+    belonged to a worker that died and is claimed again.
+    """
+    query = """
+        UPDATE llm_jobs
+        SET status = 'running', attempts = attempts + 1, locked_at = NOW(), updated_at = NOW()
+        WHERE uuid = (
+            SELECT uuid FROM llm_jobs
+            WHERE (status = 'queued' AND run_at <= NOW())
+            OR (status = 'running' AND locked_at < NOW() - make_interval(secs => %s))
+            ORDER BY run_at
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING uuid, kind, payload, audio_path, attempts, callback_url;
+    """
+
+    async with get_pool().connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, (settings.LLM_JOB_LOCK_TIMEOUT_SECONDS,))
+            return await cur.fetchone()
+
+
+async def refresh_lock(job_uuid) -> None:
+    """
+    keep a long running job from being claimed again by another worker while this one is still on it
+    """
+    while True:
+        await asyncio.sleep(settings.LLM_JOB_LOCK_TIMEOUT_SECONDS / 3)
+        try:
+            async with get_pool().connection() as conn:
+                await conn.execute(
+                    "UPDATE llm_jobs SET locked_at = NOW() WHERE uuid = %s AND status = 'running';", (job_uuid,)
+                )
+        except Exception as e:
+            print(f"LLM job {job_uuid} could not refresh its lock: {e}")
+
+
+def discard_audio(job: dict) -> None:
+    if job.get('audio_path'):
+        try:
+            os.unlink(job['audio_path'])
+        except FileNotFoundError:
+            pass
+
+
+async def update_job(job_uuid, sets: str, values: tuple) -> Optional[dict]:
+    query = f"""
+        UPDATE llm_jobs
+        SET {sets}, locked_at = NULL, updated_at = NOW()
+        WHERE uuid = %s
+        RETURNING {", ".join(JOB_COLUMNS)};
+    """
+
+    async with get_pool().connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, values + (job_uuid,))
+            return await cur.fetchone()
+
+
+def retry_delay(attempts: int, e: Exception) -> float:
+    """
+    exponential backoff with full jitter, never sooner than a Retry-After sent by the api
+    """
+    delay = min(settings.LLM_JOB_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), settings.LLM_JOB_BACKOFF_MAX_SECONDS)
+    delay = random.uniform(delay / 2, delay)
+
+    response = getattr(e, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    return delay
+
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, (RateLimitError, APITimeoutError, APIConnectionError)):
+        return True
+    # no free llm_slot in this worker
+    return isinstance(e, HTTPException) and e.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+async def run_job(job: dict, client: AsyncOpenAI):
+    if job['kind'] == "chat":
+        chat_history = schema.TextChatModel.model_validate(job['payload'])
+        return await handlers.generate_chat_response(chat_history, client)
+
+    # the file is streamed to the api, or segmented when it is long, and never read into memory whole
+    return await handlers.transcribe_path(job['audio_path'], job['payload']['filename'], client)
+
+
+async def deliver_callback(http_client: httpx.AsyncClient, url: str, job: dict) -> None:
+    """
+    POST the finished job to its callback url, a few quick retries and then give up, the job can still be polled
+    """
+    body = schema.LLMJob.model_validate(job).model_dump(mode="json")
+
+    for attempt in range(3):
+        try:
+            response = await http_client.post(url, json=body)
+            if response.status_code < 500:
+                await update_job(job['uuid'], "callback_delivered_at = NOW()", ())
+                return
+        except httpx.HTTPError as e:
+            print(f"LLM job {job['uuid']} callback failed: {e}")
+        await asyncio.sleep(2 ** attempt)
+
+    print(f"LLM job {job['uuid']} callback to {url} was not delivered.")
+
+
+async def process_job(job: dict, client: AsyncOpenAI, http_client: httpx.AsyncClient) -> None:
+    if job['attempts'] > settings.LLM_JOB_MAX_ATTEMPTS:
+        error = {"status_code": status.HTTP_504_GATEWAY_TIMEOUT, "detail": "Job was abandoned by its worker too many times."}
+        finished = await update_job(job['uuid'], "status = 'failed', error = %s, finished_at = NOW()", (Jsonb(error),))
+    else:
+        heartbeat = asyncio.create_task(refresh_lock(job['uuid']))
+        try:
+            result = await run_job(job, client)
+
+        except asyncio.CancelledError:
+            # shutting down, hand the job back without counting the attempt
+            await update_job(job['uuid'], "status = 'queued', attempts = attempts - 1", ())
+            raise
+
+        except Exception as e:
+            http_exception = handlers.to_http_exception(e)
+            error = {"status_code": http_exception.status_code, "detail": http_exception.detail}
+
+            if is_retryable(e) and job['attempts'] < settings.LLM_JOB_MAX_ATTEMPTS:
+                delay = retry_delay(job['attempts'], e)
+                await update_job(
+                    job['uuid'],
+                    "status = 'queued', error = %s, run_at = NOW() + make_interval(secs => %s)",
+                    (Jsonb(error), delay)
+                )
+                print(f"LLM job {job['uuid']} attempt {job['attempts']} failed, retrying in {delay:.1f}s: {error['detail']}")
+                return
+
+            finished = await update_job(job['uuid'], "status = 'failed', error = %s, finished_at = NOW()", (Jsonb(error),))
+
+        else:
+            finished = await update_job(
+                job['uuid'],
+                "status = 'completed', result = %s, error = NULL, finished_at = NOW()",
+                (Jsonb(result),)
+            )
+
+        finally:
+            heartbeat.cancel()
+
+    # only jobs that will not run again get here, retries and hand backs returned above
+    discard_audio(job)
+
+    if job['callback_url'] and finished is not None:
+        await deliver_callback(http_client, job['callback_url'], finished)
+
+
+async def worker(client: AsyncOpenAI, http_client: httpx.AsyncClient) -> None:
+    while not _stopping.is_set():
+        try:
+            _wakeup.clear()
+            job = await claim_job()
+        except Exception as e:
+            print(f"LLM job worker could not claim a job: {e}")
+            job = None
+
+        if job is None:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=settings.LLM_JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        try:
+            await process_job(job, client, http_client)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # the job stays running and is picked up again once its lock times out
+            print(f"LLM job {job['uuid']} could not be processed: {e}")
+
+
+def start_workers(client: AsyncOpenAI) -> Tuple[List[asyncio.Task], httpx.AsyncClient]:
+    """
+    start LLM_JOB_WORKERS worker tasks sharing the app's OpenAI client and one http client for callbacks
+    """
+    _stopping.clear()
+    http_client = httpx.AsyncClient(timeout=settings.LLM_JOB_CALLBACK_TIMEOUT_SECONDS, follow_redirects=False)
+    tasks = [asyncio.create_task(worker(client, http_client)) for _ in range(settings.LLM_JOB_WORKERS)]
+    return tasks, http_client
+
+
+async def stop_workers(tasks: List[asyncio.Task], http_client: httpx.AsyncClient) -> None:
+    """
+    let running jobs finish for up to LLM_JOB_DRAIN_TIMEOUT_SECONDS, then cancel whatever is left.
+    idle workers exit right away and no new job is claimed meanwhile.
+    """
+    _stopping.set()
+    _wakeup.set()
+    _, unfinished = await asyncio.wait(tasks, timeout=settings.LLM_JOB_DRAIN_TIMEOUT_SECONDS)
+    if unfinished:
+        print(f"{len(unfinished)} LLM jobs still running at the drain deadline, they go back to the queue.")
+    for task in unfinished:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await http_client.aclose()
@@ -1,5 +1,7 @@
-from pydantic import BaseModel, Field, conlist
-from typing import Literal, List, Union
+from datetime import datetime
+from pydantic import BaseModel, Field, HttpUrl, conlist
+from typing import Any, Dict, Literal, List, Optional, Union
+from uuid import UUID
 
 
 class ImageURL(BaseModel):
@@ -34,4 +36,26 @@ class TextChatModel(BaseModel):
         ..., 
         description="The complete list of preceding messages in the OpenAI format.",
         min_items=1
-    )
\ No newline at end of file
+    )
+
+class ChatJobRequest(TextChatModel):
+    """Chat history to extract expenses from in the background."""
+
+    callback_url: Optional[HttpUrl] = Field(
+        None,
+        description="Optional URL that receives the finished job as a JSON POST.",
+    )
+
+class LLMJob(BaseModel):
+    """State of a background chat or transcription job."""
+
+    uuid: UUID
+    kind: Literal['chat', 'transcription']
+    status: Literal['queued', 'running', 'completed', 'failed']
+    attempts: int = Field(description="Number of times a worker has picked up the job.")
+    result: Optional[Dict[str, Any]] = Field(None, description="Same body as the synchronous endpoint, once completed.")
+    error: Optional[Dict[str, Any]] = Field(None, description="status_code and detail of the last failure.")
+    run_at: datetime = Field(description="Earliest time the job runs next, later than created_at after a retry.")
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,23 @@
+from fastapi import APIRouter, status
+from fastapi.responses import PlainTextResponse
+
+from . import handlers
+
+# version of the Prometheus text exposition format written by app.metrics.render
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+router = APIRouter()
+
+@router.get("",
+    status_code=status.HTTP_200_OK,
+    response_class=PlainTextResponse,
+    responses={
+        status.HTTP_200_OK: {"description": "All metrics of the server's workers in the Prometheus text format"},
+    },
+)
+async def get_metrics():
+    """
+    Request latency, requests in flight, event loop lag, OpenAI latency and token usage, database pool
+    and cache statistics of every worker, for Prometheus to scrape
+    """
+    return PlainTextResponse(await handlers.get_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,73 @@
+import asyncio
+
+from fastapi.concurrency import run_in_threadpool
+
+from app import metrics
+from app.cache import caches
+from config import settings
+from db import postgres
+
+# the lag of a healthy loop is well under a millisecond, anything blocking it shows up in the upper buckets
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+event_loop_lag_seconds = metrics.Histogram(
+    "event_loop_lag_seconds", "How late the event loop woke up a task sleeping for a fixed interval", LOOP_LAG_BUCKETS
+)
+db_pool = metrics.Gauge("db_pool", "Database connection pool statistics by stat, see psycopg_pool get_stats")
+cache_entries = metrics.Gauge("cache_entries", "Entries held by each in-process cache")
+cache_lookups = metrics.Gauge("cache_lookups", "Lookups of each in-process cache by result, since start up")
+cache_hit_ratio = metrics.Gauge("cache_hit_ratio", "Share of lookups of each in-process cache that were hits")
+
+
+def collect_db_pool() -> None:
+    """
+    copy the pool statistics into the db_pool gauge, counters such as requests_wait_ms are cumulative
+    """
+    for stat, value in postgres.get_pool_stats().items():
+        db_pool.set(value, stat=stat)
+
+
+def collect_caches() -> None:
+    for cache in list(caches):
+        stats = cache.stats()
+        cache_entries.set(stats["size"], cache=stats["name"])
+        cache_lookups.set(stats["hits"], cache=stats["name"], result="hit")
+        cache_lookups.set(stats["misses"], cache=stats["name"], result="miss")
+        cache_hit_ratio.set(stats["hit_ratio"], cache=stats["name"])
+
+
+metrics.register_collector(collect_db_pool)
+metrics.register_collector(collect_caches)
+
+
+async def monitor_event_loop_lag() -> None:
+    """
+    sleep METRICS_LOOP_LAG_INTERVAL_SECONDS at a time and record how much later than that the loop woke up
+    """
+    loop = asyncio.get_running_loop()
+    interval = settings.METRICS_LOOP_LAG_INTERVAL_SECONDS
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        event_loop_lag_seconds.observe(max(0.0, loop.time() - start - interval))
+
+
+async def export_metrics_snapshots() -> None:
+    """
+    write this worker's metrics to METRICS_MULTIPROC_DIR every METRICS_EXPORT_INTERVAL_SECONDS for the other workers
+    """
+    while True:
+        try:
+            await run_in_threadpool(metrics.export_snapshot)
+        except Exception as e:
+            print(f"Error exporting metrics snapshot: {e}")
+        await asyncio.sleep(settings.METRICS_EXPORT_INTERVAL_SECONDS)
+
+
+async def get_metrics() -> str:
+    """
+    with several workers rendering reads and merges every worker's export file, which is kept off the event loop
+    """
+    if settings.METRICS_MULTIPROC_DIR:
+        return await run_in_threadpool(metrics.render)
+    return metrics.render()
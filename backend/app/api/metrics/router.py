@@ -0,0 +1,8 @@
+from fastapi import APIRouter
+
+from .endpoints import router as metrics_router
+
+
+router = APIRouter()
+
+router.include_router(metrics_router, prefix="/metrics", tags=["metrics"])
@@ -1,12 +1,19 @@
 from fastapi import APIRouter
 
+from config import settings
+
 from .expenditure.router import router as expenditure_router
+from .health.router import router as health_router
 from .llm.router import router as llm_router
+from .metrics.router import router as metrics_router
 from .user.router import router as user_router
 
 
 router = APIRouter()
 
 router.include_router(expenditure_router)
+router.include_router(health_router)
 router.include_router(llm_router)
+if settings.METRICS_ENABLED:
+    router.include_router(metrics_router)
 router.include_router(user_router)
\ No newline at end of file
@@ -3,14 +3,20 @@ from psycopg import AsyncConnection, errors as psycopg_errors
 import datetime as datetime
 
 from db.postgres import get_async_session
-from app.auth import hash_password, verify_password, create_access_token
+from app.auth import (
+    hash_password_async,
+    verify_password_async,
+    create_access_token,
+    invalidate_principal,
+    publish_principal_invalidation,
+)
 from . import schema
 
 async def create_user(conn, user_data: schema.UserRegisterRequest):
     """
     create a new user in the database
     """
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await hash_password_async(user_data.password)
     
     insert_query = """
     INSERT INTO users (username, full_name, email, hashed_password)
@@ -71,7 +77,7 @@ async def login_user(conn, login_data: schema.UserLoginRequest):
             await cur.execute(query, (login_data.username,))
             user = await cur.fetchone()
             
-            if not user or not verify_password(login_data.password, user['hashed_password']):
+            if not user or not await verify_password_async(login_data.password, user['hashed_password']):
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="Invalid username or password."
@@ -124,7 +130,10 @@ async def logout_user(conn, current_user: dict):
             if not updated_user:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
             
+            await publish_principal_invalidation(cur, current_user['username'])
+            
         await conn.commit()
+        invalidate_principal(current_user['username'])
         return {
             "message": "User logged out successfully. All tokens invalidated.",
             "username": updated_user['username']
@@ -163,7 +172,7 @@ async def update_user(conn, current_user: dict, update_data: schema.UserUpdateRe
                 params.append(update_data.email)
             
             if update_data.password:
-                hashed_password = hash_password(update_data.password)
+                hashed_password = await hash_password_async(update_data.password)
                 update_parts.append("hashed_password = %s")
                 params.append(hashed_password)
             
@@ -189,7 +198,10 @@ async def update_user(conn, current_user: dict, update_data: schema.UserUpdateRe
             if not updated_user:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
             
+            await publish_principal_invalidation(cur, cur_username)
+            
         await conn.commit()
+        invalidate_principal(cur_username)
         return updated_user
             
     except psycopg_errors.UniqueViolation as e:
@@ -236,7 +248,10 @@ async def delete_user(conn, current_user: dict):
                     detail="User not found."
                 )
             
+            await publish_principal_invalidation(cur, cur_username)
+            
             await conn.commit()
+            invalidate_principal(cur_username)
             return {"message": "User deleted successfully.", "uuid": deleted_user['uuid']}
 
     except HTTPException:
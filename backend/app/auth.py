@@ -1,20 +1,60 @@
 """
 JWT Authentication utilities for user authentication and authorization
 """
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 import jwt 
 import bcrypt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from psycopg import AsyncConnection
+from psycopg import AsyncConnection, AsyncCursor
 
+from app import tracing
+from app.cache import TTLCache, listen_for_invalidations
+from app.metrics import Counter, Summary
 from config import settings
 from db.postgres import get_async_session
 
 # Security scheme for Swagger UI
 security_authorization = HTTPBearer()
 
+# Verified users keyed by (username, token_version), so warm requests skip the users table lookup
+principal_cache = TTLCache(
+    maxsize=settings.AUTH_CACHE_MAX_SIZE,
+    ttl=settings.AUTH_CACHE_TTL_SECONDS,
+    name="auth_principal",
+)
+
+
+def invalidate_principal(username: str) -> None:
+    """
+    Drop every cached principal of a user in this worker
+    """
+    principal_cache.discard_where(lambda key: key[0] == username)
+
+
+async def publish_principal_invalidation(cur: AsyncCursor, username: str) -> None:
+    """
+    Notify the other workers that a user's cached principal is stale.
+    Postgres only delivers the notification once the surrounding transaction commits.
+    """
+    if settings.AUTH_CACHE_NOTIFY_CHANNEL:
+        await cur.execute(
+            "SELECT pg_notify(%s, %s);",
+            (settings.AUTH_CACHE_NOTIFY_CHANNEL, username)
+        )
+
+
+async def listen_for_principal_invalidations() -> None:
+    """
+    Long running task that drops cached principals invalidated by other workers
+    """
+    await listen_for_invalidations(settings.AUTH_CACHE_NOTIFY_CHANNEL, principal_cache, invalidate_principal)
+
 
 def create_access_token(data: dict, expiry_time: Optional[timedelta] = None) -> str:
     """
@@ -34,6 +74,75 @@ def create_access_token(data: dict, expiry_time: Optional[timedelta] = None) ->
     return encoded_jwt
 
 
+# bcrypt holds the event loop for hundreds of milliseconds per call, so it runs on its own small pool.
+# at most BCRYPT_MAX_WORKERS calls run at once and BCRYPT_MAX_QUEUE more may wait before we shed load.
+_bcrypt_executor = ThreadPoolExecutor(
+    max_workers=settings.BCRYPT_MAX_WORKERS,
+    thread_name_prefix="bcrypt",
+)
+# calls submitted and not finished, including those whose request was cancelled while the hash still runs
+_bcrypt_pending = 0
+_bcrypt_pending_lock = threading.Lock()
+
+bcrypt_queue_seconds = Summary("bcrypt_queue_seconds", "Time bcrypt calls spent waiting for a worker thread")
+bcrypt_work_seconds = Summary("bcrypt_work_seconds", "Time bcrypt calls spent hashing")
+bcrypt_rejected_total = Counter("bcrypt_rejected_total", "bcrypt calls rejected because the queue was full")
+
+
+async def _run_bcrypt(operation: str, func, *args):
+    """
+    Run a bcrypt call on the bounded worker pool, raising 503 when the queue is full
+    """
+    global _bcrypt_pending
+
+    with _bcrypt_pending_lock:
+        if _bcrypt_pending >= settings.BCRYPT_MAX_WORKERS + settings.BCRYPT_MAX_QUEUE:
+            bcrypt_rejected_total.inc(operation=operation)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy. Please try again shortly.",
+                headers={"Retry-After": "1"},
+            )
+        _bcrypt_pending += 1
+
+    submitted_at = time.perf_counter()
+
+    def timed_call():
+        started_at = time.perf_counter()
+        result = func(*args)
+        return result, started_at - submitted_at, time.perf_counter() - started_at
+
+    def release(future):
+        # runs when the hash is done, or right away if it is cancelled before a thread picked it up,
+        # never when only the awaiting request goes away
+        global _bcrypt_pending
+        with _bcrypt_pending_lock:
+            _bcrypt_pending -= 1
+
+    try:
+        future = _bcrypt_executor.submit(timed_call)
+    except BaseException:
+        release(None)
+        raise
+    future.add_done_callback(release)
+    with tracing.span("auth.bcrypt", operation=operation):
+        result, queued, worked = await asyncio.wrap_future(future)
+
+    bcrypt_queue_seconds.observe(queued, operation=operation)
+    bcrypt_work_seconds.observe(worked, operation=operation)
+    return result
+
+
+def _password_bytes(password: str) -> bytes:
+    password_bytes = password.encode('utf-8')
+    if len(password_bytes) > 72:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Password cannot be longer than 72 bytes."
+        )
+    return password_bytes
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
     Verify a plain password against its hashed version
@@ -48,17 +157,28 @@ def hash_password(password: str) -> str:
     """
     Hash a password using bcrypt
     """
-    random_salt = bcrypt.gensalt()
-    password_bytes = password.encode('utf-8')
-    if len(password_bytes) > 72:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Password cannot be longer than 72 bytes."
-        )
+    random_salt = bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)
+    password_bytes = _password_bytes(password)
     
     return bcrypt.hashpw(password_bytes, random_salt).decode('utf-8')
 
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """
+    Verify a plain password against its hashed version without blocking the event loop
+    """
+    return await _run_bcrypt("verify", verify_password, plain_password, hashed_password)
+
+
+async def hash_password_async(password: str) -> str:
+    """
+    Hash a password using bcrypt without blocking the event loop
+    """
+    _password_bytes(password)
+    return await _run_bcrypt("hash", hash_password, password)
+
+
+@tracing.traced("auth.get_current_user")
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security_authorization),
     conn: AsyncConnection = Depends(get_async_session)
@@ -94,6 +214,11 @@ async def get_current_user(
     except jwt.JWTError:
         raise credentials_exception
     
+    cache_key = (username, token_version)
+    cached_user = principal_cache.get(cache_key)
+    if cached_user is not None:
+        return dict(cached_user)
+
     # Get user from database and verify token version
     try:
         async with conn.cursor() as cur:
@@ -114,8 +239,9 @@ async def get_current_user(
                     detail="Token has been revoked. Please login again.",
                     headers={"WWW-Authenticate": "Bearer"},
                 )
-                
-            return user
+            
+            principal_cache.set(cache_key, user)
+            return dict(user)
             
     except HTTPException:
         raise
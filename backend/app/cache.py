@@ -0,0 +1,109 @@
+"""
+Small in-process caches shared by the api modules
+"""
+import asyncio
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from psycopg import AsyncConnection, sql
+
+from config import settings
+
+
+# every live cache, so their hit ratios can be exported at /metrics
+caches: "weakref.WeakSet[TTLCache]" = weakref.WeakSet()
+
+
+class TTLCache:
+    """
+    least recently used cache where every entry also expires after `ttl` seconds.
+    the event loop is single threaded so no locking is needed, hits and misses are counted for metrics.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, name: str = "cache"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        caches.add(self)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        if self.maxsize <= 0:
+            return
+
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def discard_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """
+        remove every entry whose key matches the predicate, returns the number of removed entries
+        """
+        stale = [key for key in self._data if predicate(key)]
+        for key in stale:
+            del self._data[key]
+        return len(stale)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+async def listen_for_invalidations(channel: str, cache: TTLCache, invalidate: Callable[[str], None]) -> None:
+    """
+    Long running task that calls `invalidate` with the payload of every notification other workers send on
+    `channel` with pg_notify. The whole cache is cleared whenever the listening connection is (re)established
+    since notifications sent while it was down are lost.
+    """
+    while True:
+        try:
+            conn = await AsyncConnection.connect(str(settings.DATABASE_URL), autocommit=True)
+            async with conn:
+                await conn.execute(sql.SQL("LISTEN {};").format(sql.Identifier(channel)))
+                cache.clear()
+                async for notify in conn.notifies():
+                    invalidate(notify.payload)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Invalidation listener on '{channel}' error, reconnecting: {e}")
+            cache.clear()
+            await asyncio.sleep(5)
@@ -1,14 +1,43 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from psycopg import AsyncConnection
-from openai import OpenAI
-
+from app import auth, metrics, watchdog
+from app.api.expenditure import handlers as expenditure_handlers
+from app.api.llm import jobs as llm_jobs
+from app.api.metrics import handlers as metrics_handlers
+from app.middleware import BodySizeLimitMiddleware, MetricsMiddleware, RequestIdMiddleware, ServerTimingMiddleware
 from app.api.router import router
 from config import settings
+from db import migrations, postgres
+from llm.gpt import create_openai_client
 
 
 app = FastAPI(root_path="/api")
 
+# multipart framing adds a little on top of the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+audio_upload_limit = (settings.LLM_AUDIO_MAX_BYTES + MULTIPART_OVERHEAD_BYTES, ("multipart/form-data",))
+
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    default_limit=settings.MAX_REQUEST_BODY_BYTES,
+    path_limits={
+        "/llm/transcribe-audio/": audio_upload_limit,
+        "/llm/transcribe-audio/stream": audio_upload_limit,
+        "/llm/jobs/transcribe": audio_upload_limit,
+        "/expenditure/import": (settings.IMPORT_MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES, ("multipart/form-data",)),
+    },
+)
+
+if settings.DB_QUERY_INSTRUMENTATION:
+    app.add_middleware(ServerTimingMiddleware)
+
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+app.add_middleware(RequestIdMiddleware)
+
+# added last so it wraps everything, error responses from the other middleware keep their CORS headers
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -18,100 +47,61 @@ app.add_middleware(
 )
 
 @app.on_event("startup")
-async def database_setup():
+async def pool_setup():
     """
-    on start up of the application, check for the existence of the required tables and create it if it
-    does not exist.
-    """
-
-    query = """
-    SELECT EXISTS (
-        SELECT 1
-        FROM information_schema.tables 
-        WHERE table_name = 'expenditure'
-    );
-    """
-    create_table_query = """
-    CREATE TABLE expenditure (
-        uuid UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-        user_uuid UUID NOT NULL REFERENCES users(uuid) ON DELETE CASCADE,
-        name VARCHAR(255) NOT NULL,
-        created_at TIMESTAMPTZ DEFAULT NOW(),
-        date_of_expense DATE NOT NULL,
-        amount NUMERIC(10, 2) NOT NULL,
-        category VARCHAR(50),
-        notes TEXT,
-        status VARCHAR(20) DEFAULT 'Pending'
-    );
-    """
-    query_user_table = """
-    SELECT EXISTS (
-        SELECT 1
-        FROM information_schema.tables 
-        WHERE table_name = 'users'
-    );
-    """
-    create_user_table_query ="""
-    CREATE TABLE users (
-        uuid UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-        username VARCHAR(150) NOT NULL,
-        full_name VARCHAR(255),
-        email VARCHAR(255),
-        hashed_password VARCHAR(255),
-        token_version INTEGER DEFAULT 1 NOT NULL,
-        created TIMESTAMPTZ DEFAULT NOW(),
-        updated TIMESTAMPTZ DEFAULT NOW(),
-
-        CONSTRAINT users_username_key UNIQUE (username),
-        CONSTRAINT users_email_key UNIQUE (email)
-    );
-    """
-    
-    check_token_version_column = """
-    SELECT EXISTS (
-        SELECT 1
-        FROM information_schema.columns
-        WHERE table_name = 'users' AND column_name = 'token_version'
-    );
-    """
-    
-    add_token_version_column = """
-    ALTER TABLE users 
-    ADD COLUMN token_version INTEGER DEFAULT 1 NOT NULL;
+    on start up of the application, open the database connection pool shared by all requests
     """
+    await postgres.open_pool()
+    print("Database connection pool opened.")
 
+@app.on_event("startup")
+async def database_setup():
+    """
+    on start up of the application, apply any pending schema migrations.
+    once the schema is current this is a single version lookup.
+    """
     try:
-        conn = await AsyncConnection.connect(str(settings.DATABASE_URL), autocommit=True)
-        async with conn.cursor() as cur:
-
-            await cur.execute(query_user_table)
-            result = await cur.fetchone()
-            if not result[0]:
-                await cur.execute(create_user_table_query)
-                await conn.commit()
-                print("Table 'users' created.")
-            else:
-                print("Table 'users' already exists.")
-                await cur.execute(check_token_version_column)
-                has_token_version = await cur.fetchone()
-                if not has_token_version[0]:
-                    await cur.execute(add_token_version_column)
-                    await conn.commit()
-                    print("Column 'token_version' added to 'users' table.")
-            
-
-            await cur.execute(query)
-            result = await cur.fetchone()
-            if not result[0]:
-                await cur.execute(create_table_query)
-                await conn.commit()
-                print("Table 'expenditure' created.")
-            else:
-                print("Table 'expenditure' already exists.")
-                
-        await conn.close()
+        async with postgres.get_pool().connection() as conn:
+            version = await migrations.migrate(conn)
+            print(f"Database schema at version {version}.")
     except Exception as e:
-        print(f"Error checking or creating table: {e}")
+        print(f"Error migrating database schema: {e}")
+
+@app.on_event("startup")
+async def principal_cache_listener_setup():
+    """
+    on start up of the application, listen for principal cache invalidations from other workers
+    """
+    if settings.AUTH_CACHE_NOTIFY_CHANNEL:
+        app.state.principal_listener = asyncio.create_task(auth.listen_for_principal_invalidations())
+        print(f"Listening for principal cache invalidations on '{settings.AUTH_CACHE_NOTIFY_CHANNEL}'.")
+
+@app.on_event("startup")
+async def summary_cache_listener_setup():
+    """
+    on start up of the application, listen for spending summary invalidations from other workers
+    """
+    if settings.SUMMARY_CACHE_NOTIFY_CHANNEL:
+        app.state.summary_listener = asyncio.create_task(expenditure_handlers.listen_for_summary_invalidations())
+        print(f"Listening for summary cache invalidations on '{settings.SUMMARY_CACHE_NOTIFY_CHANNEL}'.")
+
+@app.on_event("startup")
+async def event_loop_lag_monitor_setup():
+    """
+    on start up of the application, start sampling the event loop lag exported at /metrics,
+    and exporting this worker's metrics for the others when there are several
+    """
+    if settings.METRICS_ENABLED:
+        app.state.loop_lag_monitor = asyncio.create_task(metrics_handlers.monitor_event_loop_lag())
+        if settings.METRICS_MULTIPROC_DIR:
+            app.state.metrics_exporter = asyncio.create_task(metrics_handlers.export_metrics_snapshots())
+
+@app.on_event("startup")
+async def stale_import_sweep_setup():
+    """
+    on start up of the application, start failing statement imports whose worker went away
+    """
+    app.state.stale_import_sweep = asyncio.create_task(expenditure_handlers.sweep_stale_import_jobs())
 
 @app.on_event("startup")
 async def client_setup():
@@ -119,17 +109,96 @@ async def client_setup():
     on start up of the application, initialize openai client
     """
     try:
-        client = OpenAI()
+        client = create_openai_client()
         app.state.openai_client = client
         print("OpenAI client initialized and attached to app state: openai_client")
     except Exception as e:
         print(f"CRITICAL: Failed to initialize OpenAI client: {e}")
 
+@app.on_event("startup")
+async def llm_job_workers_setup():
+    """
+    on start up of the application, start the workers of the background LLM job queue
+    """
+    if settings.LLM_JOB_WORKERS > 0 and hasattr(app.state, 'openai_client'):
+        app.state.llm_job_workers = llm_jobs.start_workers(app.state.openai_client)
+        print(f"Started {settings.LLM_JOB_WORKERS} LLM job workers.")
+
+@app.on_event("startup")
+async def loop_watchdog_setup():
+    """
+    on start up of the application, start the event loop watchdog when enabled.
+    it starts after the other hooks, blocking set up work such as loading certificates is not reported
+    """
+    if settings.LOOP_WATCHDOG_ENABLED:
+        app.state.loop_watchdog = watchdog.start()
+        print(f"Event loop watchdog reporting blocks over {settings.LOOP_WATCHDOG_THRESHOLD_MS}ms.")
+
+@app.on_event("shutdown")
+async def shutdown_llm_job_workers():
+    """
+    on shutdown of the application, stop the LLM job workers, jobs they were running go back to the queue
+    """
+    if hasattr(app.state, 'llm_job_workers'):
+        await llm_jobs.stop_workers(*app.state.llm_job_workers)
+        del app.state.llm_job_workers
+
 @app.on_event("shutdown")
 async def shutdown_openai_client():
     if hasattr(app.state, 'openai_client'):
+        await app.state.openai_client.close()
         del app.state.openai_client
 
+@app.on_event("shutdown")
+async def shutdown_principal_cache_listener():
+    if hasattr(app.state, 'principal_listener'):
+        app.state.principal_listener.cancel()
+        del app.state.principal_listener
+
+@app.on_event("shutdown")
+async def shutdown_stale_import_sweep():
+    if hasattr(app.state, 'stale_import_sweep'):
+        app.state.stale_import_sweep.cancel()
+        del app.state.stale_import_sweep
+
+@app.on_event("shutdown")
+async def shutdown_summary_cache_listener():
+    if hasattr(app.state, 'summary_listener'):
+        app.state.summary_listener.cancel()
+        del app.state.summary_listener
+
+@app.on_event("shutdown")
+async def shutdown_event_loop_lag_monitor():
+    if hasattr(app.state, 'loop_lag_monitor'):
+        app.state.loop_lag_monitor.cancel()
+        del app.state.loop_lag_monitor
+
+@app.on_event("shutdown")
+async def shutdown_metrics_exporter():
+    """
+    on shutdown of the application, export this worker's metrics a last time so its counts stay in the totals
+    """
+    if hasattr(app.state, 'metrics_exporter'):
+        app.state.metrics_exporter.cancel()
+        del app.state.metrics_exporter
+        try:
+            metrics.export_snapshot()
+        except Exception as e:
+            print(f"Error exporting metrics snapshot: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_loop_watchdog():
+    if hasattr(app.state, 'loop_watchdog'):
+        app.state.loop_watchdog.stop()
+        del app.state.loop_watchdog
+
+@app.on_event("shutdown")
+async def shutdown_pool():
+    """
+    on shutdown of the application, drain and close the database connection pool
+    """
+    await postgres.close_pool()
+
 def swagger_ui_parameters():
     return {
         "defaultModelsExpandDepth": 0,
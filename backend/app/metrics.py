@@ -0,0 +1,336 @@
+"""
+In-process metrics shared by the api modules.
+Every metric registers itself on creation and `render` writes the registry in the Prometheus text
+exposition format served at GET /metrics. Values that are read from elsewhere (pool statistics,
+cache counters) are refreshed by collectors registered with `register_collector` right before rendering.
+
+With several worker processes (see gunicorn.conf.py) every worker writes a snapshot of its registry to
+METRICS_MULTIPROC_DIR every METRICS_EXPORT_INTERVAL_SECONDS, and `render` merges the snapshots of all
+workers, so any worker answers a scrape for the whole server. Counters, histograms and summaries are
+added up, including those of workers that exited, while gauges keep one series per live worker under
+a `worker` label. Other workers' values are at most one export interval old.
+"""
+import bisect
+import json
+import math
+import os
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from config import settings
+
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# metric name -> metric, in registration order
+REGISTRY: Dict[str, "Metric"] = {}
+_collectors: List[Callable[[], None]] = []
+
+
+def _label_key(labels: dict) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    labels = key + extra
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        REGISTRY[name] = self
+
+    def header(self, name: str = None, type: str = None) -> List[str]:
+        name = name or self.name
+        return [f"# HELP {name} {_escape(self.description)}", f"# TYPE {name} {type or self.type}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    monotonically increasing value, optionally split by labels
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def merge(self, key: LabelKey, value: float, worker: int, alive: bool) -> None:
+        self.values[key] = self.values.get(key, 0.0) + value
+
+    def snapshot(self) -> dict:
+        return {
+            ",".join(f"{k}={v}" for k, v in key) or "total": value
+            for key, value in self.values.items()
+        }
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in list(self.values.items())
+        ]
+
+
+class Gauge(Metric):
+    """
+    value that goes up and down (e.g. requests in flight), optionally split by labels
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self.values: Dict[LabelKey, float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        self.values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def merge(self, key: LabelKey, value: float, worker: int, alive: bool) -> None:
+        # a gauge is a current state, summing it across workers is not always meaningful (e.g. ratios)
+        if alive:
+            self.values[tuple(sorted(key + (("worker", str(worker)),)))] = value
+
+    def snapshot(self) -> dict:
+        return {
+            ",".join(f"{k}={v}" for k, v in key) or "total": value
+            for key, value in self.values.items()
+        }
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in list(self.values.items())
+        ]
+
+
+class Summary(Metric):
+    """
+    count, sum and max of observed values (e.g. durations in seconds), optionally split by labels
+    """
+
+    type = "summary"
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self.values: Dict[LabelKey, Dict[str, float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        entry = self.values.setdefault(key, {"count": 0, "sum": 0.0, "max": 0.0})
+        entry["count"] += 1
+        entry["sum"] += value
+        entry["max"] = max(entry["max"], value)
+
+    def merge(self, key: LabelKey, value: Dict[str, float], worker: int, alive: bool) -> None:
+        entry = self.values.setdefault(key, {"count": 0, "sum": 0.0, "max": 0.0})
+        entry["count"] += value["count"]
+        entry["sum"] += value["sum"]
+        entry["max"] = max(entry["max"], value["max"])
+
+    def snapshot(self) -> dict:
+        return {
+            ",".join(f"{k}={v}" for k, v in key) or "total": {
+                **entry,
+                "avg": entry["sum"] / entry["count"] if entry["count"] else 0.0,
+            }
+            for key, entry in self.values.items()
+        }
+
+    def render(self) -> List[str]:
+        entries = list(self.values.items())
+        lines = self.header()
+        for key, entry in entries:
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(entry['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {_format_value(entry['count'])}")
+        # the exposition format has no max for summaries, it is exported as a gauge of its own
+        lines += self.header(f"{self.name}_max", "gauge")
+        lines += [f"{self.name}_max{_format_labels(key)} {_format_value(entry['max'])}" for key, entry in entries]
+        return lines
+
+
+class Histogram(Metric):
+    """
+    observed values counted into buckets, so that percentiles can be computed across processes
+    """
+
+    type = "histogram"
+    # seconds, from a fast cache hit to a slow model call
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, name: str, description: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: a count for every bucket plus +Inf, then the sum
+        self.values: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def merge(self, key: LabelKey, value: List[float], worker: int, alive: bool) -> None:
+        entry = self.values.get(key)
+        if entry is None:
+            self.values[key] = list(value)
+        else:
+            self.values[key] = [total + count for total, count in zip(entry, value)]
+
+    def snapshot(self) -> dict:
+        return {
+            ",".join(f"{k}={v}" for k, v in key) or "total": {
+                "count": sum(entry[:-1]),
+                "sum": entry[-1],
+            }
+            for key, entry in self.values.items()
+        }
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, entry in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), entry[:-1]):
+                cumulative += count
+                le = (("le", _format_value(bound) if math.isinf(bound) else repr(float(bound))),)
+                lines.append(f"{self.name}_bucket{_format_labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(entry[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+def register_collector(collector: Callable[[], None]) -> None:
+    """
+    run `collector` before every render, it should set gauges from state owned by another module
+    """
+    _collectors.append(collector)
+
+
+def collect() -> None:
+    for collector in _collectors:
+        try:
+            collector()
+        except Exception as e:
+            print(f"Metrics collector {collector.__name__} failed: {e}")
+
+
+METRIC_TYPES = {metric_type.type: metric_type for metric_type in (Counter, Gauge, Summary, Histogram)}
+
+
+def registry_snapshot() -> dict:
+    """
+    the registry as plain JSON data, what a worker exports for the others
+    """
+    return {
+        name: {
+            "type": metric.type,
+            "description": metric.description,
+            "buckets": getattr(metric, "buckets", None),
+            "values": [[[list(label) for label in key], value] for key, value in list(metric.values.items())],
+        }
+        for name, metric in list(REGISTRY.items())
+    }
+
+
+def export_snapshot(directory: Optional[str] = None) -> None:
+    """
+    collect and write this worker's snapshot to `directory` (METRICS_MULTIPROC_DIR), replacing the previous one
+    """
+    directory = directory or settings.METRICS_MULTIPROC_DIR
+    if not directory:
+        return
+
+    collect()
+    path = Path(directory) / f"{os.getpid()}.json"
+    temporary = path.with_suffix(".tmp")
+    with open(temporary, "w") as f:
+        json.dump(registry_snapshot(), f)
+    os.replace(temporary, path)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def merge_snapshots(directory: str) -> Dict[str, Metric]:
+    """
+    unregistered metrics holding the sum of every worker's snapshot in `directory`
+    """
+    merged: Dict[str, Metric] = {}
+    for path in sorted(Path(directory).glob("*.json")):
+        try:
+            worker = int(path.stem)
+            with open(path) as f:
+                worker_snapshot = json.load(f)
+        except (ValueError, OSError) as e:
+            print(f"Skipping unreadable metrics snapshot {path.name}: {e}")
+            continue
+
+        alive = _alive(worker)
+        for name, data in worker_snapshot.items():
+            metric = merged.get(name)
+            if metric is None:
+                metric_type = METRIC_TYPES[data["type"]]
+                metric = merged[name] = metric_type.__new__(metric_type)
+                metric.name, metric.description, metric.values = name, data["description"], {}
+                if data["buckets"] is not None:
+                    metric.buckets = tuple(data["buckets"])
+            for key, value in data["values"]:
+                metric.merge(tuple(tuple(label) for label in key), value, worker, alive)
+    return merged
+
+
+def render() -> str:
+    """
+    the whole registry in the Prometheus text exposition format, version 0.0.4.
+    with METRICS_MULTIPROC_DIR set, the merged registries of all workers
+    """
+    if settings.METRICS_MULTIPROC_DIR:
+        export_snapshot()
+        metrics = list(merge_snapshots(settings.METRICS_MULTIPROC_DIR).values())
+    else:
+        collect()
+        metrics = list(REGISTRY.values())
+
+    lines = []
+    for metric in metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,267 @@
+"""
+ASGI middleware shared by the api
+"""
+import asyncio
+import re
+import time
+import uuid
+import weakref
+from typing import Dict, Iterable, Optional, Tuple
+
+from fastapi import HTTPException, status
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app import tracing
+from app.metrics import Counter, Gauge, Histogram, Summary
+from config import settings
+from db.instrumentation import QueryStats, log_event, request_query_stats
+
+
+class RequestBodyTooLarge(HTTPException):
+    """
+    raised from receive() once a body grows past its limit. it is an HTTPException so that
+    FastAPI's body parsing re-raises it as is instead of turning it into a generic 400.
+    """
+
+    def __init__(self, limit: int):
+        super().__init__(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Request body is larger than {limit} bytes.",
+        )
+
+
+class BodySizeLimitMiddleware:
+    """
+    Reject request bodies over a size limit before they are read in full.
+    A Content-Length over the limit is refused before a single body byte is received, and chunked
+    or understated bodies are cut off as soon as the running total passes the limit.
+    `path_limits` maps a route path to (limit, accepted content types), an empty tuple accepts any type.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        default_limit: int,
+        path_limits: Optional[Dict[str, Tuple[int, Iterable[str]]]] = None,
+    ):
+        self.app = app
+        self.default_limit = default_limit
+        self.path_limits = {path: (limit, tuple(types)) for path, (limit, types) in (path_limits or {}).items()}
+
+    def route_path(self, scope: Scope) -> str:
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        return path
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limit, content_types = self.path_limits.get(self.route_path(scope), (self.default_limit, ()))
+        headers = Headers(scope=scope)
+
+        if content_types:
+            content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+            if content_type not in content_types:
+                response = JSONResponse(
+                    {"detail": f"Unsupported content type: {content_type or 'none'}."},
+                    status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                )
+                await response(scope, receive, send)
+                return
+
+        content_length = headers.get("content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            too_large = RequestBodyTooLarge(limit)
+            response = JSONResponse({"detail": too_large.detail}, status_code=too_large.status_code)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise RequestBodyTooLarge(limit)
+            return message
+
+        async def tracking_send(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except RequestBodyTooLarge as e:
+            # only reached when nothing below turned the exception into a response
+            if response_started:
+                raise
+            response = JSONResponse({"detail": e.detail}, status_code=e.status_code)
+            await response(scope, receive, send)
+
+
+db_request_queries = Summary("db_request_queries", "Database statements issued per request by route")
+db_request_seconds = Summary("db_request_seconds", "Database time per request by route")
+
+
+def route_template(scope: Scope) -> str:
+    """
+    the matched route's path template (e.g. /expenditure/{id}), so metrics are not split per id
+    """
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class ServerTimingMiddleware:
+    """
+    Collect the database statements of every request (see db/instrumentation.py) and report them in
+    a Server-Timing header: `db` carries the total database time with the number of statements and
+    rows, `db-slowest` the slowest single statement and `total` the time until the response started.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats(scope["method"], scope["path"])
+        token = request_query_stats.set(stats)
+        start = time.perf_counter()
+
+        async def timing_send(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", ", ".join((
+                    f'db;dur={stats.seconds * 1000:.3f};desc="{stats.count} queries {stats.rows} rows"',
+                    f"db-slowest;dur={stats.slowest_seconds * 1000:.3f}",
+                    f"total;dur={(time.perf_counter() - start) * 1000:.3f}",
+                )))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timing_send)
+        finally:
+            request_query_stats.reset(token)
+            route = f"{scope['method']} {route_template(scope)}"
+            db_request_queries.observe(stats.count, route=route)
+            db_request_seconds.observe(stats.seconds, route=route)
+            if stats.seconds * 1000 >= settings.DB_SLOW_QUERY_MS:
+                log_event(
+                    "slow_request_queries",
+                    request=route,
+                    request_id=scope.get("state", {}).get("request_id"),
+                    queries=stats.count,
+                    duration_ms=round(stats.seconds * 1000, 3),
+                    rows=stats.rows,
+                    slowest_ms=round(stats.slowest_seconds * 1000, 3),
+                    slowest_statement=stats.slowest_statement,
+                )
+
+
+http_requests_in_flight = Gauge("http_requests_in_flight", "Requests currently being handled")
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds", "Time from receiving a request until its response is sent, by route and status"
+)
+http_exceptions_total = Counter("http_exceptions_total", "Requests that raised an unhandled exception, by route and type")
+
+
+class MetricsMiddleware:
+    """
+    Count requests in flight, time every request into a histogram labelled with the route template
+    and status code, and run it inside a server span continuing the caller's trace.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start = time.perf_counter()
+
+        async def status_send(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        with tracing.server_span(
+            scope["method"],
+            scope["headers"],
+            **{"http.request.method": scope["method"], "url.path": scope["path"]},
+        ) as span:
+            try:
+                await self.app(scope, receive, status_send)
+            except Exception as e:
+                http_exceptions_total.inc(method=scope["method"], route=route_template(scope), type=type(e).__name__)
+                raise
+            finally:
+                http_requests_in_flight.dec()
+                route = route_template(scope)
+                http_request_duration_seconds.observe(
+                    time.perf_counter() - start, method=scope["method"], route=route, status=status_code
+                )
+                span.update_name(f"{scope['method']} {route}")
+                span.set_attribute("http.route", route)
+                span.set_attribute("http.response.status_code", status_code)
+                if status_code >= 500:
+                    span.set_error()
+
+
+# the request each task is serving, so that code outside of it (e.g. app/watchdog.py) can tell which one is running
+active_requests: "weakref.WeakKeyDictionary[asyncio.Task, Scope]" = weakref.WeakKeyDictionary()
+
+# incoming ids are only reused when they are short and printable
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+
+class RequestIdMiddleware:
+    """
+    Give every request an id, taken from its X-Request-ID header when the caller sent a usable one.
+    The id is kept in the request state (`request.state.request_id`), returned in the X-Request-ID
+    response header and the scope is registered in `active_requests` under the task serving it.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = Headers(scope=scope).get("x-request-id", "")
+        if not REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+        scope.setdefault("state", {})["request_id"] = request_id
+
+        async def request_id_send(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                MutableHeaders(scope=message)["X-Request-ID"] = request_id
+            await send(message)
+
+        task = asyncio.current_task()
+        active_requests[task] = scope
+        try:
+            await self.app(scope, receive, request_id_send)
+        finally:
+            active_requests.pop(task, None)
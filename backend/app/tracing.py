@@ -0,0 +1,135 @@
+"""
+Trace spans around auth, database statements and upstream LLM calls.
+Spans go through the OpenTelemetry API when it is installed, so any OpenTelemetry SDK and exporter
+configured for the process (e.g. by `opentelemetry-instrument`) receives them with the incoming
+`traceparent` as parent. Without it, or with TRACING_ENABLED off, every span is a no-op.
+"""
+import functools
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional, Tuple
+
+from config import settings
+
+try:
+    from opentelemetry import context as otel_context, trace
+    from opentelemetry.propagate import extract
+    from opentelemetry.trace import SpanKind, Status, StatusCode
+except ImportError:
+    trace = None
+
+
+class NoopSpan:
+    """
+    stands in for an OpenTelemetry span when tracing is off
+    """
+
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+    def record_exception(self, exception: BaseException) -> None:
+        pass
+
+    def set_error(self, description: Optional[str] = None) -> None:
+        pass
+
+    def update_name(self, name: str) -> None:
+        pass
+
+    def is_recording(self) -> bool:
+        return False
+
+
+class OtelSpan:
+    """
+    thin wrapper so callers can mark errors without importing OpenTelemetry themselves
+    """
+
+    def __init__(self, span):
+        self.span = span
+
+    def set_attribute(self, key: str, value) -> None:
+        if value is not None:
+            self.span.set_attribute(key, value)
+
+    def record_exception(self, exception: BaseException) -> None:
+        self.span.record_exception(exception)
+        self.set_error(type(exception).__name__)
+
+    def set_error(self, description: Optional[str] = None) -> None:
+        self.span.set_status(Status(StatusCode.ERROR, description))
+
+    def update_name(self, name: str) -> None:
+        self.span.update_name(name)
+
+    def is_recording(self) -> bool:
+        return self.span.is_recording()
+
+
+NOOP_SPAN = NoopSpan()
+
+
+def enabled() -> bool:
+    return trace is not None and settings.TRACING_ENABLED
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[NoopSpan]:
+    """
+    run the block inside a child span of the current one, exceptions are recorded on the span and re-raised
+    """
+    if not enabled():
+        yield NOOP_SPAN
+        return
+
+    with trace.get_tracer(__name__).start_as_current_span(
+        name, record_exception=False, set_status_on_exception=False
+    ) as otel_span:
+        wrapped = OtelSpan(otel_span)
+        for key, value in attributes.items():
+            wrapped.set_attribute(key, value)
+        try:
+            yield wrapped
+        except Exception as e:
+            wrapped.record_exception(e)
+            raise
+
+
+@contextmanager
+def server_span(name: str, headers: Iterable[Tuple[bytes, bytes]], **attributes) -> Iterator[NoopSpan]:
+    """
+    root span of an incoming request, continuing the trace of the caller's `traceparent` header if any.
+    `headers` are the raw ASGI header pairs.
+    """
+    if not enabled():
+        yield NOOP_SPAN
+        return
+
+    carrier = {key.decode("latin-1"): value.decode("latin-1") for key, value in headers}
+    token = otel_context.attach(extract(carrier))
+    try:
+        with trace.get_tracer(__name__).start_as_current_span(
+            name, kind=SpanKind.SERVER, record_exception=False, set_status_on_exception=False
+        ) as otel_span:
+            wrapped = OtelSpan(otel_span)
+            for key, value in attributes.items():
+                wrapped.set_attribute(key, value)
+            try:
+                yield wrapped
+            except Exception as e:
+                wrapped.record_exception(e)
+                raise
+    finally:
+        otel_context.detach(token)
+
+
+def traced(name: str):
+    """
+    decorator running an async function inside a span, the signature is kept for FastAPI dependencies
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,233 @@
+"""
+Event loop watchdog, catching synchronous work inside `async def` code.
+A heartbeat task on the loop wakes up every LOOP_WATCHDOG_INTERVAL_MS. A monitor thread watches
+the heartbeat, and once it is more than LOOP_WATCHDOG_THRESHOLD_MS late it captures the stack
+of the loop thread, i.e. the code blocking it, together with the request being served (see
+RequestIdMiddleware). When the loop gets going again the block is logged as one JSON line and counted.
+
+`strict` turns blocks into test failures:
+
+    with TestClient(app) as client, watchdog.strict(50):
+        client.post("/user/login", json=...)
+
+raises LoopBlockedError on exit if any callback held the loop for 50ms or more.
+"""
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Iterator, List, NamedTuple, Optional
+
+from app.metrics import Counter, Histogram
+from app.middleware import active_requests, route_template
+from config import settings
+from db.instrumentation import log_event
+
+
+# innermost frames of the blocking stack that are logged
+STACK_LIMIT = 25
+
+event_loop_blocks_total = Counter("event_loop_blocks_total", "Times the event loop was blocked over the watchdog threshold, by route")
+event_loop_block_seconds = Histogram(
+    "event_loop_block_seconds",
+    "How long the event loop was blocked, for blocks over the watchdog threshold",
+    (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+
+class LoopBlockedError(AssertionError):
+    """
+    raised by `strict` when the event loop was blocked during the block
+    """
+
+
+class Block(NamedTuple):
+    seconds: float
+    method: Optional[str]
+    route: Optional[str]
+    request_id: Optional[str]
+    stack: List[str]
+
+
+class Sample(NamedTuple):
+    # when the heartbeat that was late at the time of the sample was due
+    due: float
+    stack: List[str]
+    scope: Optional[dict]
+
+
+class _Strict(NamedTuple):
+    threshold_ms: float
+    blocks: List[Block]
+
+
+_watchdogs: List["LoopWatchdog"] = []
+_strict: List[_Strict] = []
+
+
+class LoopWatchdog:
+    """
+    watchdog of a single event loop, created with `start` from a coroutine running on it
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, threshold_ms: float, interval_ms: float):
+        self.loop = loop
+        self.threshold_ms = threshold_ms
+        self.interval = interval_ms / 1000
+        self.loop_thread_id = threading.get_ident()
+        # when the heartbeat should run next, written on the loop thread and read by the monitor thread
+        self.due = time.monotonic()
+        self.sample: Optional[Sample] = None
+        # heartbeat whose block was already reported by `flush`
+        self.flushed: Optional[float] = None
+        self.stopped = threading.Event()
+        self.heartbeat_task = loop.create_task(self.heartbeat())
+        self.thread = threading.Thread(target=self.monitor, name="loop-watchdog", daemon=True)
+        self.thread.start()
+
+    def report_threshold_ms(self) -> float:
+        return min([self.threshold_ms] + [strict.threshold_ms for strict in _strict])
+
+    async def heartbeat(self) -> None:
+        while True:
+            now = time.monotonic()
+            blocked = now - self.due
+            if blocked * 1000 >= self.report_threshold_ms() and self.flushed != self.due:
+                self.report(blocked, self.sample_of(self.due))
+            self.due = now + self.interval
+            await asyncio.sleep(self.interval)
+
+    def sample_of(self, due: float) -> Optional[Sample]:
+        sample = self.sample
+        return sample if sample is not None and sample.due == due else None
+
+    def monitor(self) -> None:
+        """
+        runs on its own thread, takes one sample of the loop thread's stack per late heartbeat
+        """
+        while not self.stopped.wait(self.interval):
+            due = self.due
+            if self.sample_of(due) is not None or (time.monotonic() - due) * 1000 < self.report_threshold_ms():
+                continue
+
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = traceback.format_stack(frame, limit=STACK_LIMIT) if frame is not None else []
+            # the loop thread is stuck in the blocking call, so the running task cannot change meanwhile
+            task = asyncio.current_task(self.loop)
+            scope = active_requests.get(task) if task is not None else None
+            self.sample = Sample(due, [line.rstrip() for line in stack], scope)
+
+    def report(self, seconds: float, sample: Optional[Sample]) -> None:
+        """
+        runs on the loop once it is unblocked. without a sample the block ended before the monitor saw it
+        """
+        scope = sample.scope if sample is not None else None
+        block = Block(
+            seconds=seconds,
+            method=scope["method"] if scope is not None else None,
+            route=route_template(scope) if scope is not None else None,
+            request_id=scope.get("state", {}).get("request_id") if scope is not None else None,
+            stack=sample.stack if sample is not None else [],
+        )
+
+        for strict in _strict:
+            if seconds * 1000 >= strict.threshold_ms:
+                strict.blocks.append(block)
+
+        if seconds * 1000 < self.threshold_ms:
+            return
+
+        route = f"{block.method} {block.route}" if scope is not None else "none"
+        event_loop_blocks_total.inc(route=route)
+        event_loop_block_seconds.observe(seconds)
+        log_event(
+            "event_loop_blocked",
+            blocked_ms=round(seconds * 1000, 3),
+            request=route,
+            request_id=block.request_id,
+            stack=block.stack,
+        )
+
+    def flush(self) -> None:
+        """
+        report the block in progress right away, for `strict` exiting on the blocked loop itself
+        """
+        due = self.due
+        blocked = time.monotonic() - due
+        if due != self.flushed and blocked * 1000 >= self.report_threshold_ms():
+            self.flushed = due
+            self.report(blocked, self.sample_of(due))
+
+    def settle(self, since: float, timeout: float = 1.0) -> None:
+        """
+        wait from another thread until the heartbeat ran after `since`, so a block before that is reported
+        """
+        deadline = time.monotonic() + timeout
+        while not self.stopped.is_set() and self.due - self.interval < since and time.monotonic() < deadline:
+            time.sleep(self.interval / 2)
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.heartbeat_task.cancel()
+        if self in _watchdogs:
+            _watchdogs.remove(self)
+
+
+def start(threshold_ms: Optional[float] = None, interval_ms: Optional[float] = None) -> LoopWatchdog:
+    """
+    start watching the running event loop, defaults come from the LOOP_WATCHDOG_* settings
+    """
+    watchdog = LoopWatchdog(
+        asyncio.get_running_loop(),
+        settings.LOOP_WATCHDOG_THRESHOLD_MS if threshold_ms is None else threshold_ms,
+        settings.LOOP_WATCHDOG_INTERVAL_MS if interval_ms is None else interval_ms,
+    )
+    _watchdogs.append(watchdog)
+    return watchdog
+
+
+@contextmanager
+def strict(threshold_ms: Optional[float] = None) -> Iterator[List[Block]]:
+    """
+    Fail with LoopBlockedError if the event loop is blocked for `threshold_ms` or more (default
+    LOOP_WATCHDOG_STRICT_MS) while the block runs. Blocks are caught on every running watchdog, e.g. the
+    one started by the app with LOOP_WATCHDOG_ENABLED, and inside a coroutine one is started for its loop.
+    """
+    strict_mode = _Strict(settings.LOOP_WATCHDOG_STRICT_MS if threshold_ms is None else threshold_ms, [])
+
+    own_watchdog = None
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if loop is not None and not any(watchdog.loop is loop for watchdog in _watchdogs):
+        own_watchdog = start(interval_ms=min(settings.LOOP_WATCHDOG_INTERVAL_MS, strict_mode.threshold_ms / 2))
+    if not _watchdogs:
+        raise RuntimeError("No event loop watchdog is running, enable LOOP_WATCHDOG_ENABLED or enter strict() on the loop.")
+
+    _strict.append(strict_mode)
+    try:
+        yield strict_mode.blocks
+    finally:
+        exited_at = time.monotonic()
+        for watchdog in list(_watchdogs):
+            if watchdog.loop is loop:
+                watchdog.flush()
+            else:
+                watchdog.settle(exited_at)
+        _strict.remove(strict_mode)
+        if own_watchdog is not None:
+            own_watchdog.stop()
+
+    if strict_mode.blocks:
+        details = "\n\n".join(
+            f"blocked {block.seconds * 1000:.1f}ms"
+            + (f" in {block.method} {block.route} (request {block.request_id})" if block.route else "")
+            + ("\n" + "\n".join(block.stack) if block.stack else "")
+            for block in strict_mode.blocks
+        )
+        raise LoopBlockedError(
+            f"Event loop blocked {len(strict_mode.blocks)} time(s) for {strict_mode.threshold_ms}ms or more:\n\n{details}"
+        )
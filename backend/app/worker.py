@@ -0,0 +1,18 @@
+"""
+Uvicorn worker class for gunicorn, see gunicorn.conf.py
+"""
+from uvicorn_worker import UvicornWorker as BaseUvicornWorker
+
+from config import settings
+
+
+class UvicornWorker(BaseUvicornWorker):
+    """
+    uvicorn worker that lets requests in flight finish for SERVER_DRAIN_TIMEOUT_SECONDS on shutdown
+    before they are cancelled and the app's shutdown hooks run
+    """
+
+    CONFIG_KWARGS = {
+        **BaseUvicornWorker.CONFIG_KWARGS,
+        "timeout_graceful_shutdown": settings.SERVER_DRAIN_TIMEOUT_SECONDS,
+    }
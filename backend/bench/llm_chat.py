@@ -0,0 +1,292 @@
+"""
+Benchmark of the chat extraction path, replaying the payloads in test_llm.jsonl against POST /llm/chat.
+The app is driven in-process through httpx's ASGI transport, with its OpenAI client pointed at
+bench/mock_openai.py running in a child process, so neither the database nor the real api is needed.
+Every concurrency level reports p50/p95/p99 latency, throughput and event loop lag, and a final
+sequential pass under tracemalloc reports the memory allocated per request. Each level runs
+--rounds times and every metric is the median over the rounds, which keeps one noisy round from
+failing a check.
+
+The response cache is disabled and routing forced to the model unless --cache / --routing say
+otherwise, so every request takes the full path. Results are compared with a JSON baseline:
+
+    python -m bench.llm_chat --save       record bench/baselines/llm_chat.json
+    python -m bench.llm_chat --check      exit 1 when a metric regressed past the tolerance
+
+Baselines are only comparable on the same machine with the same workload options.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import httpx
+
+from bench import stats
+
+
+BENCH_DIR = Path(__file__).resolve().parent
+DEFAULT_PAYLOADS = BENCH_DIR.parents[1] / "test_llm.jsonl"
+DEFAULT_BASELINE = BENCH_DIR / "baselines" / "llm_chat.json"
+
+# options that change what is measured, a baseline recorded with different ones is not comparable
+WORKLOAD_OPTIONS = ("concurrency", "requests", "rounds", "latency_ms", "jitter_ms", "error_rate", "routing", "cache")
+
+TITLE_PATTERN = re.compile(r"^```(.+)```\s*$", re.MULTILINE)
+
+
+def load_payloads(path: Path) -> List[Tuple[str, dict]]:
+    """
+    split the file into (title, body) pairs, each body is the JSON following a ```title``` line
+    """
+    parts = TITLE_PATTERN.split(path.read_text())
+    return [(title.strip(), json.loads(body)) for title, body in zip(parts[1::2], parts[2::2])]
+
+
+def start_mock(latency_ms: float, jitter_ms: float, error_rate: float) -> Tuple[subprocess.Popen, str]:
+    """
+    run bench/mock_openai.py in a child process and return it with the base url it listens on
+    """
+    mock = subprocess.Popen(
+        [
+            sys.executable, "-m", "bench.mock_openai",
+            "--latency-ms", str(latency_ms),
+            "--jitter-ms", str(jitter_ms),
+            "--error-rate", str(error_rate),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+        cwd=BENCH_DIR.parent,
+    )
+    base_url = mock.stdout.readline().strip()
+    if not base_url:
+        mock.kill()
+        raise RuntimeError("mock OpenAI server did not start")
+    return mock, base_url
+
+
+async def send(client: httpx.AsyncClient, body: dict) -> Tuple[int, float]:
+    start = time.perf_counter()
+    response = await client.post("/llm/chat", json=body)
+    return response.status_code, time.perf_counter() - start
+
+
+async def run_level(client: httpx.AsyncClient, payloads: List[Tuple[str, dict]], concurrency: int, total: int) -> dict:
+    """
+    send `total` requests from `concurrency` clients, payloads taken round robin
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    for index in range(total):
+        queue.put_nowait(payloads[index % len(payloads)])
+
+    samples: List[Tuple[str, int, float]] = []
+
+    async def client_loop():
+        while not queue.empty():
+            title, body = queue.get_nowait()
+            status_code, elapsed = await send(client, body)
+            samples.append((title, status_code, elapsed))
+
+    monitor = stats.LoopLagMonitor()
+    monitor.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    loop_lag = await monitor.stop()
+
+    statuses = Counter(status_code for _, status_code, _ in samples)
+    by_payload = {
+        title: stats.distribution([elapsed for name, _, elapsed in samples if name == title], scale=1000)
+        for title, _ in payloads
+    }
+    return {
+        "requests": len(samples),
+        "error_rate": round(1 - statuses.get(200, 0) / len(samples), 4),
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "throughput_rps": round(len(samples) / wall, 2),
+        "latency_ms": stats.distribution([elapsed for _, _, elapsed in samples], scale=1000),
+        "latency_by_payload_ms": by_payload,
+        "loop_lag_ms": loop_lag,
+    }
+
+
+async def run_memory(client: httpx.AsyncClient, payloads: List[Tuple[str, dict]], total: int) -> dict:
+    """
+    send requests one at a time under tracemalloc: the peak each one allocates on top of what was
+    already live, and how much stays allocated per request once the pass is over
+    """
+    gc.collect()
+    tracemalloc.start()
+    start_current, _ = tracemalloc.get_traced_memory()
+
+    peaks = []
+    for index in range(total):
+        _, body = payloads[index % len(payloads)]
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        await send(client, body)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - before)
+
+    gc.collect()
+    end_current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "requests": total,
+        "peak_kib_per_request": stats.distribution(peaks, scale=1 / 1024),
+        "retained_kib_per_request": round((end_current - start_current) / total / 1024, 3),
+        # ru_maxrss is in KiB on linux
+        "max_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def regression_checks(result: dict, tolerance: float) -> List[stats.Check]:
+    """
+    latency and throughput are bounded relative to the baseline, loop lag and memory also get an
+    absolute slack since their baselines are small and noisy
+    """
+    checks = []
+    for level in result["levels"]:
+        prefix = f"levels.{level}"
+        checks += [
+            stats.Check(f"{prefix}.latency_ms.p50", "lower", tolerance, 5.0),
+            stats.Check(f"{prefix}.latency_ms.p95", "lower", tolerance, 10.0),
+            stats.Check(f"{prefix}.latency_ms.p99", "lower", tolerance, 20.0),
+            stats.Check(f"{prefix}.throughput_rps", "higher", tolerance),
+            stats.Check(f"{prefix}.error_rate", "lower", 0.0, 0.01),
+            stats.Check(f"{prefix}.loop_lag_ms.p99", "lower", tolerance, 10.0),
+            stats.Check(f"{prefix}.loop_lag_ms.max", "lower", tolerance, 50.0),
+        ]
+    checks += [
+        stats.Check("memory.peak_kib_per_request.p50", "lower", tolerance, 64.0),
+        stats.Check("memory.retained_kib_per_request", "lower", tolerance, 16.0),
+    ]
+    return checks
+
+
+async def run(args) -> dict:
+    # the app is imported only now, the client it creates reads the mock's url from the environment
+    from app.main import app
+    from config import settings
+    from llm import response_cache
+    from llm.gpt import create_openai_client
+
+    settings.LLM_EXTRACTION_ROUTING = args.routing
+    settings.LLM_CACHE_PERSISTENT = False
+    if not args.cache:
+        response_cache.memory_cache.maxsize = 0
+
+    payloads = load_payloads(args.payloads)
+    app.state.openai_client = create_openai_client()
+    transport = httpx.ASGITransport(app=app)
+    result = {"levels": {}}
+
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            await run_level(client, payloads, 1, args.warmup)
+
+            for concurrency in args.concurrency:
+                rounds = [await run_level(client, payloads, concurrency, args.requests) for _ in range(args.rounds)]
+                level = stats.median_of(rounds)
+                result["levels"][str(concurrency)] = level
+                print(
+                    f"concurrency {concurrency:>3}: {level['throughput_rps']:>8} req/s  "
+                    f"p50 {level['latency_ms']['p50']:>8} ms  p95 {level['latency_ms']['p95']:>8} ms  "
+                    f"p99 {level['latency_ms']['p99']:>8} ms  loop lag max {level['loop_lag_ms']['max']:>7} ms  "
+                    f"errors {level['error_rate']:.2%}"
+                )
+
+            result["memory"] = await run_memory(client, payloads, args.memory_requests)
+            print(
+                f"memory: peak {result['memory']['peak_kib_per_request']['p50']} KiB/request (p50), "
+                f"retained {result['memory']['retained_kib_per_request']} KiB/request, "
+                f"max rss {result['memory']['max_rss_mib']} MiB"
+            )
+    finally:
+        await app.state.openai_client.close()
+        del app.state.openai_client
+
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark POST /llm/chat against a mock OpenAI api.")
+    parser.add_argument("--payloads", type=Path, default=DEFAULT_PAYLOADS)
+    parser.add_argument(
+        "--concurrency", type=lambda value: [int(level) for level in value.split(",")], default=[1, 8, 32],
+        help="comma separated numbers of concurrent clients",
+    )
+    parser.add_argument("--requests", type=int, default=120, help="requests per concurrency level and round")
+    parser.add_argument("--rounds", type=int, default=3, help="runs per concurrency level, metrics are their median")
+    parser.add_argument("--warmup", type=int, default=8)
+    parser.add_argument("--memory-requests", type=int, default=40)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="mock OpenAI reply delay")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of mock OpenAI calls that fail")
+    parser.add_argument("--routing", choices=["llm", "auto", "local"], default="llm")
+    parser.add_argument("--cache", action="store_true", help="keep the response cache enabled")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--output", type=Path, default=None, help="also write the result here")
+    parser.add_argument("--save", action="store_true", help="store the result as the new baseline")
+    parser.add_argument("--check", action="store_true", help="exit 1 when the result regressed from the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="relative change tolerated by --check")
+    args = parser.parse_args(argv)
+
+    mock, base_url = start_mock(args.latency_ms, args.jitter_ms, args.error_rate)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    result["workload"] = {
+        option: str(value) if isinstance(value, Path) else value
+        for option, value in vars(args).items()
+        if option in WORKLOAD_OPTIONS
+    }
+    result["environment"] = stats.environment()
+    result["recorded_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+    if args.output:
+        stats.save_result(args.output, result)
+    if args.save:
+        stats.save_result(args.baseline, result)
+        print(f"Saved baseline to {args.baseline}.")
+
+    if not args.check:
+        return 0
+
+    baseline = stats.load_baseline(args.baseline)
+    if baseline is None:
+        print(f"No baseline at {args.baseline}, run with --save first.")
+        return 1
+    if baseline.get("workload") != result["workload"]:
+        print(f"Baseline workload {baseline.get('workload')} differs from this run, results are not comparable.")
+        return 1
+    if baseline.get("environment") != result["environment"]:
+        print(f"Warning: baseline was recorded on {baseline.get('environment')}, this run is on {result['environment']}.")
+
+    regressions = stats.compare(baseline, result, regression_checks(result, args.tolerance))
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    print(f"{len(regressions)} regressions against {args.baseline}.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+Stand-in for the OpenAI api used by the benchmarks.
+Chat completions (plain and streamed) and Whisper transcriptions are answered with a fixed, valid
+extraction reply after a configurable delay, and a configurable share of calls fail with 429 or 500
+so the retry and error paths are exercised too. It runs in its own process so its work never shows
+up in the event loop lag measured in the api process.
+
+run with `python -m bench.mock_openai [--latency-ms 50] [--error-rate 0.01]`, the first line
+printed is the base url to point OPENAI_BASE_URL at.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+
+REPLY = {
+    "response": "I found 2 expenses totalling $14.50: Mcdonald's ($10.00), Bubble Tea ($4.50).",
+    "expense": [
+        {"name": "Mcdonald's", "category": "Food", "price": 10.0, "date_of_expense": "2025-01-01"},
+        {"name": "Bubble Tea", "category": "Food", "price": 4.5, "date_of_expense": "2025-01-01"},
+    ],
+}
+TRANSCRIPTION = "Mcdonald's ten dollars and bubble tea four fifty."
+# streamed replies are cut into chunks of this many characters
+STREAM_CHUNK_CHARS = 16
+USAGE = {"prompt_tokens": 400, "completion_tokens": 80, "total_tokens": 480}
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops connections as soon as the benchmark opens a few dozen at once
+    request_queue_size = 1024
+
+    def __init__(self, address, latency_ms: float, jitter_ms: float, error_rate: float, error_status: int, seed: int):
+        super().__init__(address, MockOpenAIHandler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def next_call(self) -> Optional[int]:
+        """
+        count the call and decide whether it fails, returns the status code to fail with or None
+        """
+        with self.lock:
+            self.calls += 1
+            if self.random.random() < self.error_rate:
+                self.errors += 1
+                return self.error_status
+            return None
+
+    def delay(self) -> float:
+        with self.lock:
+            jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: MockOpenAIServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status_code: int, body: dict, headers: Optional[dict] = None) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(200, {"calls": self.server.calls, "errors": self.server.errors})
+        else:
+            self.send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("content-length", 0)))
+
+        error_status = self.server.next_call()
+        time.sleep(self.server.delay())
+        if error_status is not None:
+            # retry-after 0 keeps the client's retries from dominating the measurement
+            self.send_json(
+                error_status,
+                {"error": {"message": "injected failure", "type": "server_error", "code": None}},
+                {"retry-after": "0"},
+            )
+            return
+
+        if self.path.endswith("/audio/transcriptions"):
+            self.send_json(200, {"text": TRANSCRIPTION})
+        elif self.path.endswith("/chat/completions"):
+            request = json.loads(body)
+            if request.get("stream"):
+                self.stream_completion(request["model"], (request.get("stream_options") or {}).get("include_usage"))
+            else:
+                self.send_json(200, self.completion(request["model"]))
+        else:
+            self.send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+    def completion(self, model: str) -> dict:
+        return {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": json.dumps(REPLY)},
+            }],
+            "usage": USAGE,
+        }
+
+    def stream_completion(self, model: str, include_usage: bool = False) -> None:
+        content = json.dumps(REPLY)
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.send_header("connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        chunks: List[str] = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)]
+        for index, chunk in enumerate(chunks):
+            event = {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": chunk},
+                    "finish_reason": "stop" if index == len(chunks) - 1 else None,
+                }],
+            }
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+        if include_usage:
+            event = {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [],
+                "usage": USAGE,
+            }
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run a mock OpenAI api for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="delay before every reply")
+    parser.add_argument("--jitter-ms", type=float, default=10.0, help="the delay varies uniformly by up to this much")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls that fail")
+    parser.add_argument("--error-status", type=int, default=429, choices=[429, 500, 503])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server = MockOpenAIServer(
+        (args.host, args.port), args.latency_ms, args.jitter_ms, args.error_rate, args.error_status, args.seed
+    )
+    host, port = server.server_address[:2]
+    print(f"http://{host}:{port}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""
+Summaries and baseline comparison shared by the benchmarks.
+A baseline is the JSON result of an earlier run. `compare` walks a list of checks, each naming a
+path into the result, which direction is worse, and how much worse is still noise.
+"""
+import asyncio
+import json
+import math
+import os
+import platform
+import statistics
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """
+    nearest-rank percentile, q between 0 and 100
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def distribution(values: Sequence[float], scale: float = 1.0) -> Dict[str, float]:
+    """
+    p50/p95/p99/max/mean of the values, multiplied by `scale` (e.g. 1000 for seconds to milliseconds)
+    """
+    return {
+        "p50": round(percentile(values, 50) * scale, 3),
+        "p95": round(percentile(values, 95) * scale, 3),
+        "p99": round(percentile(values, 99) * scale, 3),
+        "max": round(max(values, default=0.0) * scale, 3),
+        "mean": round(sum(values) / len(values) * scale, 3) if values else 0.0,
+    }
+
+
+def median_of(results: List[Any]) -> Any:
+    """
+    merge repeated runs of the same benchmark by taking the median of every numeric value,
+    anything else is taken from the first run
+    """
+    first = results[0]
+    if isinstance(first, dict):
+        return {key: median_of([result[key] for result in results]) for key in first}
+    if isinstance(first, (int, float)) and not isinstance(first, bool):
+        return round(statistics.median(results), 3)
+    return first
+
+
+def environment() -> dict:
+    """
+    what the numbers depend on besides the code, printed next to a failed check
+    """
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+class LoopLagMonitor:
+    """
+    Measure how late the event loop wakes up a task sleeping `interval` seconds.
+    Anything blocking the loop, e.g. a synchronous call in an async handler, shows up directly as lag.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: List[float] = []
+        self.task: Optional[asyncio.Task] = None
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval))
+
+    def start(self) -> None:
+        self.samples = []
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> Dict[str, float]:
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        return distribution(self.samples, scale=1000)
+
+
+class Check(NamedTuple):
+    # dotted path into the result, e.g. "levels.8.latency_ms.p95"
+    path: str
+    # "lower" when a smaller value is better (latency), "higher" when a larger one is (throughput)
+    better: str
+    # relative and absolute change tolerated before it counts as a regression
+    tolerance: float
+    slack: float = 0.0
+
+
+def lookup(result: dict, path: str) -> Any:
+    value = result
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(baseline: dict, result: dict, checks: List[Check]) -> List[str]:
+    """
+    return a line for every check the result is worse on than the baseline allows,
+    checks missing from either side are skipped
+    """
+    regressions = []
+    for check in checks:
+        expected, actual = lookup(baseline, check.path), lookup(result, check.path)
+        if expected is None or actual is None:
+            continue
+
+        if check.better == "lower":
+            limit = expected * (1 + check.tolerance) + check.slack
+            failed = actual > limit
+        else:
+            limit = expected * (1 - check.tolerance) - check.slack
+            failed = actual < limit
+
+        if failed:
+            regressions.append(f"{check.path}: {actual} vs baseline {expected} (limit {round(limit, 3)})")
+    return regressions
+
+
+def load_baseline(path: Path) -> Optional[dict]:
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_result(path: Path, result: dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+        f.write("\n")
@@ -1,6 +1,6 @@
 from pydantic import field_validator, PostgresDsn, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from typing import Optional
+from typing import Literal, Optional
 
 
 class Settings(BaseSettings):
@@ -18,15 +18,162 @@ class Settings(BaseSettings):
     JWT_ALGORITHM: str 
     JWT_ACCESS_TOKEN_EXPIRE_MINUTES: int 
     
+    # bcrypt cost factor and the bounded worker pool that runs it off the event loop
+    BCRYPT_ROUNDS: int = 12
+    BCRYPT_MAX_WORKERS: int = 2
+    BCRYPT_MAX_QUEUE: int = 32
+    
     DATABASE_URL: Optional[PostgresDsn] = None
+
+    # Connection pool settings, see db/postgres.py
+    DB_POOL_MIN_SIZE: int = 2
+    DB_POOL_MAX_SIZE: int = 10
+    DB_POOL_MAX_IDLE_SECONDS: float = 300.0
+    DB_POOL_MAX_LIFETIME_SECONDS: float = 3600.0
+    DB_POOL_TIMEOUT_SECONDS: float = 30.0
+    DB_POOL_CLOSE_TIMEOUT_SECONDS: float = 5.0
+    DB_POOL_CHECK_ON_CHECKOUT: bool = True
+    # Per-request query stats and Server-Timing headers, see db/instrumentation.py
+    DB_QUERY_INSTRUMENTATION: bool = True
+    # statements slower than this are written to the slow query log
+    DB_SLOW_QUERY_MS: float = 200.0
+    # share of the selects slower than DB_EXPLAIN_BUDGET_MS that are planned again with EXPLAIN (never executed), 0 disables
+    DB_EXPLAIN_SAMPLE_RATE: float = 0.0
+    DB_EXPLAIN_BUDGET_MS: float = 500.0
+
+    # GET /metrics in the Prometheus text format, see app/metrics.py
+    METRICS_ENABLED: bool = True
+    # how often the event loop lag is sampled for the event_loop_lag_seconds histogram
+    METRICS_LOOP_LAG_INTERVAL_SECONDS: float = 0.5
+    # directory where each worker process exports its metrics, so that /metrics on any worker reports all of them.
+    # gunicorn.conf.py uses a fresh temporary directory when unset, a single process does not need one
+    METRICS_MULTIPROC_DIR: Optional[str] = None
+    METRICS_EXPORT_INTERVAL_SECONDS: float = 5.0
+    # spans for requests, auth, database statements and LLM calls when opentelemetry is installed, see app/tracing.py
+    TRACING_ENABLED: bool = True
+
+    # event loop watchdog for development and canary workers, logs the stack of anything blocking the loop, see app/watchdog.py
+    LOOP_WATCHDOG_ENABLED: bool = False
+    LOOP_WATCHDOG_THRESHOLD_MS: float = 100.0
+    LOOP_WATCHDOG_INTERVAL_MS: float = 20.0
+    # default threshold of watchdog.strict, which fails tests on any block this long
+    LOOP_WATCHDOG_STRICT_MS: float = 50.0
+
+    # Verified principal cache used by auth.get_current_user
+    AUTH_CACHE_MAX_SIZE: int = 10000
+    AUTH_CACHE_TTL_SECONDS: float = 60.0
+    # LISTEN/NOTIFY channel propagating invalidations (logout, password change) to the other workers.
+    # only leave it empty with a single worker, otherwise they accept revoked tokens until the TTL expires
+    AUTH_CACHE_NOTIFY_CHANNEL: Optional[str] = "principal_invalidation"
     # OPENAI_API: str
 
+    # Per-user spending summary cache, invalidated by the expenditure write handlers
+    SUMMARY_CACHE_MAX_SIZE: int = 10000
+    SUMMARY_CACHE_TTL_SECONDS: float = 300.0
+    # Like AUTH_CACHE_NOTIFY_CHANNEL, writes drop the user's summaries in every worker. empty only with SERVER_WORKERS=1
+    SUMMARY_CACHE_NOTIFY_CHANNEL: Optional[str] = "summary_invalidation"
+    # Rows fetched from the server-side cursor per chunk of an expenditure export
+    EXPORT_BATCH_SIZE: int = 1000
+    # Bank statement imports: largest accepted upload, rows per COPY batch and where uploads are spooled
+    IMPORT_MAX_UPLOAD_BYTES: int = 100 * 1024 * 1024
+    IMPORT_BATCH_SIZE: int = 5000
+    IMPORT_SPOOL_DIR: Optional[str] = None
+    # An import without progress for this long lost its worker, it is failed and its spooled file deleted
+    IMPORT_STALE_TIMEOUT_SECONDS: float = 900.0
+
+    # OpenAI client, connection pool and per-call timeouts, see llm/gpt.py
+    OPENAI_MAX_CONNECTIONS: int = 50
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    OPENAI_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    OPENAI_TIMEOUT_SECONDS: float = 60.0
+    OPENAI_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    OPENAI_MAX_RETRIES: int = 2
+    LLM_CHAT_TIMEOUT_SECONDS: float = 60.0
+    LLM_TRANSCRIBE_TIMEOUT_SECONDS: float = 120.0
+    # Request body limits enforced while the body streams in, see app/middleware.py.
+    # Whisper itself refuses files over 25 MB, larger uploads are only transcribed when ffmpeg can split them
+    MAX_REQUEST_BODY_BYTES: int = 32 * 1024 * 1024
+    LLM_AUDIO_MAX_BYTES: int = 100 * 1024 * 1024
+    # Long recordings are split into segments transcribed concurrently, see llm/audio.py
+    FFMPEG_BINARY: str = "ffmpeg"
+    LLM_AUDIO_SEGMENT_MIN_BYTES: int = 2 * 1024 * 1024
+    LLM_AUDIO_SEGMENT_SECONDS: float = 300.0
+    LLM_AUDIO_SEGMENT_OVERLAP_SECONDS: float = 2.0
+    LLM_AUDIO_SILENCE_SEARCH_SECONDS: float = 30.0
+    LLM_AUDIO_SILENCE_NOISE_DB: int = -35
+    LLM_AUDIO_SILENCE_MIN_SECONDS: float = 0.4
+    # segments of one recording transcribed at once, never more than half of LLM_MAX_CONCURRENCY
+    LLM_AUDIO_SEGMENT_CONCURRENCY: int = 4
+    # Upper bound on concurrent model calls per worker and how long a request may wait for a slot
+    LLM_MAX_CONCURRENCY: int = 8
+    LLM_QUEUE_TIMEOUT_SECONDS: float = 10.0
+
+    # Which chat requests are answered by a local extractor instead of the model, see llm/extractors.py
+    LLM_EXTRACTION_ROUTING: Literal["llm", "auto", "local"] = "auto"
+    LLM_LOCAL_EXTRACTOR: Literal["rules"] = "rules"
+    LLM_LOCAL_MIN_CONFIDENCE: float = 0.8
+
+    # Chat image preprocessing, see llm/images.py. The model downsizes anything over 2048px itself
+    LLM_IMAGE_PREPROCESS: bool = True
+    LLM_IMAGE_MAX_DIMENSION: int = 2048
+    LLM_IMAGE_FORMAT: str = "JPEG"
+    LLM_IMAGE_QUALITY: int = 85
+    LLM_IMAGE_AUTOCROP: bool = False
+    LLM_IMAGE_MAX_PIXELS: int = 64_000_000
+    LLM_IMAGE_MAX_WORKERS: int = 2
+
+    # Chat extraction response cache, see llm/response_cache.py
+    LLM_CACHE_MAX_ENTRIES: int = 1024
+    LLM_CACHE_TTL_SECONDS: float = 86400.0
+    LLM_CACHE_PERSISTENT: bool = False
+    LLM_CACHE_PERSISTENT_TTL_SECONDS: float = 7 * 86400.0
+    LLM_CACHE_PERSISTENT_MAX_ENTRIES: int = 50000
+    LLM_CACHE_EVICT_EVERY: int = 100
+
+    # Background LLM job queue, see app/api/llm/jobs.py. 0 workers leaves queued jobs to other processes
+    LLM_JOB_WORKERS: int = 2
+    LLM_JOB_POLL_SECONDS: float = 1.0
+    LLM_JOB_MAX_ATTEMPTS: int = 5
+    LLM_JOB_BACKOFF_BASE_SECONDS: float = 2.0
+    LLM_JOB_BACKOFF_MAX_SECONDS: float = 300.0
+    # A running job whose worker disappeared is picked up again after this long, running jobs refresh their lock meanwhile
+    LLM_JOB_LOCK_TIMEOUT_SECONDS: float = 600.0
+    # Where audio of transcription jobs waits for a worker, the system temp directory when unset.
+    # every process running job workers must see the same directory
+    LLM_JOB_SPOOL_DIR: Optional[str] = None
+    # Comma separated hosts that may receive job callbacks, callbacks are refused while empty
+    LLM_JOB_CALLBACK_ALLOWED_HOSTS: str = ""
+    LLM_JOB_CALLBACK_TIMEOUT_SECONDS: float = 10.0
+    # On shutdown, jobs already running get this long to finish before they are cancelled and go back to the queue
+    LLM_JOB_DRAIN_TIMEOUT_SECONDS: float = 20.0
+
+    # Production server, see gunicorn.conf.py. 0 workers starts one per available core
+    SERVER_BIND: str = "0.0.0.0:8000"
+    SERVER_WORKERS: int = 0
+    # On SIGTERM, requests in flight (including LLM calls and streams) get this long to finish before they are cancelled
+    SERVER_DRAIN_TIMEOUT_SECONDS: float = 30.0
+    SERVER_KEEPALIVE_SECONDS: int = 5
+    # Time between SIGTERM and SIGKILL, compose.yml reads the same variable for stop_grace_period.
+    # gunicorn kills workers still draining 10s before it, so the drain, job drain and pool close timeouts must fit
+    SERVER_STOP_TIMEOUT_SECONDS: int = 70
+    # Readiness checks give up on the database after this long
+    HEALTH_CHECK_TIMEOUT_SECONDS: float = 2.0
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
         extra='ignore' 
     )
 
+    @field_validator("LLM_AUDIO_SILENCE_SEARCH_SECONDS")
+    @classmethod
+    def check_silence_search(cls, v: float, info) -> float:
+        """A cut is searched for within the segment, so the window has to be shorter than it."""
+        segment_seconds = info.data.get("LLM_AUDIO_SEGMENT_SECONDS")
+        if segment_seconds is not None and v >= segment_seconds:
+            raise ValueError(f"must be less than LLM_AUDIO_SEGMENT_SECONDS ({segment_seconds})")
+        return v
+
     @field_validator("DATABASE_URL", mode="before")
     @classmethod
     def assemble_db_url(cls, v: Optional[str], info) -> str:
@@ -0,0 +1,193 @@
+"""
+Per-request database query instrumentation.
+Connections from the pool create `InstrumentedCursor`s, which time every statement and add it to the
+`QueryStats` of the current request (a context variable set by ServerTimingMiddleware). Statements
+slower than DB_SLOW_QUERY_MS are written to the slow query log as one JSON object per line, and a
+sample of the selects over DB_EXPLAIN_BUDGET_MS is planned again with a plain EXPLAIN on a
+separate connection so the plan can be logged too. The statement itself is never executed again:
+a select can still have side effects (nextval, pg_notify, volatile functions), which EXPLAIN ANALYZE
+would repeat.
+Every statement also runs in a `db.execute` span (see app/tracing.py).
+Query parameters are never logged, only their number.
+"""
+import asyncio
+import json
+import random
+import re
+import time
+from contextvars import ContextVar
+from typing import Iterable, Optional, Set
+
+from psycopg import AsyncCursor, sql
+
+from app import tracing
+from config import settings
+
+
+# statements logged or explained are cut to this many characters
+STATEMENT_MAX_CHARS = 2000
+EXPLAIN_TIMEOUT_MS = 10_000
+
+_whitespace = re.compile(r"\s+")
+_select = re.compile(r"^\s*select\b", re.IGNORECASE)
+
+# only one plan is captured at a time, samples arriving meanwhile are dropped
+_explain_lock = asyncio.Lock()
+_explain_tasks: Set[asyncio.Task] = set()
+
+
+class QueryStats:
+    """
+    queries issued while handling one request
+    """
+
+    def __init__(self, method: Optional[str] = None, path: Optional[str] = None):
+        self.method = method
+        self.path = path
+        self.count = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.slowest_seconds = 0.0
+        self.slowest_statement: Optional[str] = None
+
+    def record(self, seconds: float, rows: int) -> bool:
+        """
+        add one statement, returns True when it is the slowest so far and its text should be kept
+        """
+        self.count += 1
+        self.seconds += seconds
+        self.rows += rows
+        if seconds > self.slowest_seconds:
+            self.slowest_seconds = seconds
+            return True
+        return False
+
+
+request_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("request_query_stats", default=None)
+
+
+def statement_text(query, context) -> str:
+    if isinstance(query, sql.Composable):
+        query = query.as_string(context)
+    elif isinstance(query, bytes):
+        query = query.decode("utf-8", errors="replace")
+    return _whitespace.sub(" ", query).strip()[:STATEMENT_MAX_CHARS]
+
+
+def log_event(event: str, **fields) -> None:
+    """
+    write one structured log line
+    """
+    print(json.dumps({"event": event, **fields}, default=str), flush=True)
+
+
+def explainable(statement: str) -> bool:
+    """
+    only the plans of selects are captured, writes are not what the sampling is after
+    """
+    return bool(_select.match(statement))
+
+
+async def capture_plan(query, params, statement: str, seconds: float) -> None:
+    """
+    plan the statement again with EXPLAIN on its own connection and log the plan.
+    without ANALYZE the statement is not executed, the estimates are logged next to the measured duration.
+    """
+    from db.postgres import get_pool
+
+    # the plan's own queries are not part of any request
+    request_query_stats.set(None)
+
+    if _explain_lock.locked():
+        return
+
+    async with _explain_lock:
+        try:
+            async with get_pool().connection() as conn:
+                async with conn.transaction(force_rollback=True):
+                    # a plain cursor, the plan is not timed or logged as a slow query itself
+                    async with AsyncCursor(conn) as cur:
+                        await cur.execute(f"SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS};")
+                        await cur.execute(
+                            sql.SQL("EXPLAIN (FORMAT JSON) ") + (
+                                query if isinstance(query, sql.Composable) else sql.SQL(query)
+                            ),
+                            params,
+                        )
+                        row = await cur.fetchone()
+        except Exception as e:
+            log_event("query_plan_failed", statement=statement, error=str(e))
+            return
+
+    plan = next(iter(row.values())) if isinstance(row, dict) else row[0]
+    log_event("query_plan", statement=statement, duration_ms=round(seconds * 1000, 3), plan=plan)
+
+
+def maybe_capture_plan(query, params, statement: str, seconds: float) -> None:
+    """
+    capture the plan of a statement over budget in the background, for a DB_EXPLAIN_SAMPLE_RATE share of them
+    """
+    if not explainable(statement) or random.random() >= settings.DB_EXPLAIN_SAMPLE_RATE:
+        return
+
+    task = asyncio.create_task(capture_plan(query, params, statement, seconds))
+    _explain_tasks.add(task)
+    task.add_done_callback(_explain_tasks.discard)
+
+
+class InstrumentedCursor(AsyncCursor):
+    """
+    cursor that records the duration and row count of every statement it executes
+    """
+
+    def _record(self, query, params, seconds: float) -> None:
+        stats = request_query_stats.get()
+        slow = seconds * 1000 >= settings.DB_SLOW_QUERY_MS
+        explain = settings.DB_EXPLAIN_SAMPLE_RATE > 0 and seconds * 1000 >= settings.DB_EXPLAIN_BUDGET_MS
+
+        rows = max(self.rowcount, 0)
+        slowest = stats is not None and stats.record(seconds, rows)
+        if not (slowest or slow or explain):
+            return
+
+        statement = statement_text(query, self)
+        if slowest:
+            stats.slowest_statement = statement
+
+        if slow:
+            log_event(
+                "slow_query",
+                request=f"{stats.method} {stats.path}" if stats is not None else None,
+                statement=statement,
+                duration_ms=round(seconds * 1000, 3),
+                rows=rows,
+                params=len(params) if params is not None else 0,
+            )
+        if explain:
+            maybe_capture_plan(query, params, statement, seconds)
+
+    async def execute(self, query, params=None, *, prepare=None, binary=None):
+        # the pool's empty health check statement on checkout is not a query of the request
+        if query == "":
+            return await super().execute(query, params, prepare=prepare, binary=binary)
+
+        with tracing.span("db.execute", **{"db.system": "postgresql"}) as span:
+            if span.is_recording():
+                span.set_attribute("db.statement", statement_text(query, self))
+            start = time.perf_counter()
+            try:
+                return await super().execute(query, params, prepare=prepare, binary=binary)
+            finally:
+                self._record(query, params, time.perf_counter() - start)
+                span.set_attribute("db.rows", max(self.rowcount, 0))
+
+    async def executemany(self, query, params_seq: Iterable, *, returning: bool = False) -> None:
+        with tracing.span("db.executemany", **{"db.system": "postgresql"}) as span:
+            if span.is_recording():
+                span.set_attribute("db.statement", statement_text(query, self))
+            start = time.perf_counter()
+            try:
+                await super().executemany(query, params_seq, returning=returning)
+            finally:
+                # a batch is counted as one statement, its parameters are not explained
+                self._record(query, None, time.perf_counter() - start)
@@ -0,0 +1,295 @@
+"""
+Versioned schema migrations.
+Every migration runs once, in order, inside a single transaction guarded by an advisory lock so that
+workers booting together never race each other. Once the schema is current, startup costs one query.
+
+run manually with `python -m db.migrations`
+"""
+import asyncio
+from typing import List, NamedTuple
+
+from psycopg import AsyncConnection, errors as psycopg_errors
+from psycopg.rows import dict_row
+
+from config import settings
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    sql: str
+
+
+# arbitrary application wide key for pg_advisory_xact_lock
+MIGRATION_LOCK_KEY = 7_245_310_001
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline users and expenditure tables", """
+        CREATE TABLE IF NOT EXISTS users (
+            uuid UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            username VARCHAR(150) NOT NULL,
+            full_name VARCHAR(255),
+            email VARCHAR(255),
+            hashed_password VARCHAR(255),
+            token_version INTEGER DEFAULT 1 NOT NULL,
+            created TIMESTAMPTZ DEFAULT NOW(),
+            updated TIMESTAMPTZ DEFAULT NOW(),
+
+            CONSTRAINT users_username_key UNIQUE (username),
+            CONSTRAINT users_email_key UNIQUE (email)
+        );
+
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS token_version INTEGER DEFAULT 1 NOT NULL;
+
+        CREATE TABLE IF NOT EXISTS expenditure (
+            uuid UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            user_uuid UUID NOT NULL REFERENCES users(uuid) ON DELETE CASCADE,
+            name VARCHAR(255) NOT NULL,
+            created_at TIMESTAMPTZ DEFAULT NOW(),
+            date_of_expense DATE NOT NULL,
+            amount NUMERIC(10, 2) NOT NULL,
+            category VARCHAR(50),
+            notes TEXT,
+            status VARCHAR(20) DEFAULT 'Pending'
+        );
+    """),
+    Migration(2, "llm response cache table", """
+        CREATE TABLE IF NOT EXISTS llm_response_cache (
+            key CHAR(64) PRIMARY KEY,
+            response JSONB NOT NULL,
+            hits INTEGER DEFAULT 0 NOT NULL,
+            created_at TIMESTAMPTZ DEFAULT NOW() NOT NULL,
+            last_hit_at TIMESTAMPTZ DEFAULT NOW() NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS llm_response_cache_last_hit_at_idx
+            ON llm_response_cache (last_hit_at DESC);
+    """),
+    Migration(3, "expenditure listing indexes", """
+        CREATE INDEX IF NOT EXISTS expenditure_user_created_idx
+            ON expenditure (user_uuid, created_at DESC, uuid DESC);
+
+        CREATE INDEX IF NOT EXISTS expenditure_user_status_created_idx
+            ON expenditure (user_uuid, status, created_at DESC, uuid DESC);
+    """),
+    Migration(4, "expenditure monthly rollup", """
+        CREATE TABLE IF NOT EXISTS expenditure_monthly_rollup (
+            user_uuid UUID NOT NULL,
+            month DATE NOT NULL,
+            category VARCHAR(50) NOT NULL DEFAULT '',
+            status VARCHAR(20) NOT NULL DEFAULT '',
+            total NUMERIC(14, 2) NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+
+            PRIMARY KEY (user_uuid, month, category, status)
+        );
+
+        -- fold the net change of one statement into the rollup. a bucket whose expenditures are all moved
+        -- or deleted is kept with count 0 and skipped by readers
+        CREATE OR REPLACE FUNCTION expenditure_rollup_apply_deltas() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO expenditure_monthly_rollup AS r (user_uuid, month, category, status, total, count)
+                SELECT user_uuid, date_trunc('month', date_of_expense)::date, COALESCE(category, ''),
+                    COALESCE(status, ''), SUM(amount), COUNT(*)
+                FROM new_rows
+                GROUP BY 1, 2, 3, 4
+                ON CONFLICT (user_uuid, month, category, status)
+                DO UPDATE SET total = r.total + EXCLUDED.total, count = r.count + EXCLUDED.count;
+
+            ELSIF TG_OP = 'DELETE' THEN
+                INSERT INTO expenditure_monthly_rollup AS r (user_uuid, month, category, status, total, count)
+                SELECT user_uuid, date_trunc('month', date_of_expense)::date, COALESCE(category, ''),
+                    COALESCE(status, ''), -SUM(amount), -COUNT(*)
+                FROM old_rows
+                GROUP BY 1, 2, 3, 4
+                ON CONFLICT (user_uuid, month, category, status)
+                DO UPDATE SET total = r.total + EXCLUDED.total, count = r.count + EXCLUDED.count;
+
+            ELSE
+                INSERT INTO expenditure_monthly_rollup AS r (user_uuid, month, category, status, total, count)
+                SELECT user_uuid, month, category, status, SUM(total), SUM(count)
+                FROM (
+                    SELECT user_uuid, date_trunc('month', date_of_expense)::date AS month,
+                        COALESCE(category, '') AS category, COALESCE(status, '') AS status, amount AS total, 1 AS count
+                    FROM new_rows
+                    UNION ALL
+                    SELECT user_uuid, date_trunc('month', date_of_expense)::date,
+                        COALESCE(category, ''), COALESCE(status, ''), -amount, -1
+                    FROM old_rows
+                ) deltas
+                GROUP BY user_uuid, month, category, status
+                HAVING SUM(total) <> 0 OR SUM(count) <> 0
+                ON CONFLICT (user_uuid, month, category, status)
+                DO UPDATE SET total = r.total + EXCLUDED.total, count = r.count + EXCLUDED.count;
+            END IF;
+
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS expenditure_rollup_insert ON expenditure;
+        CREATE TRIGGER expenditure_rollup_insert
+            AFTER INSERT ON expenditure
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION expenditure_rollup_apply_deltas();
+
+        DROP TRIGGER IF EXISTS expenditure_rollup_update ON expenditure;
+        CREATE TRIGGER expenditure_rollup_update
+            AFTER UPDATE ON expenditure
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION expenditure_rollup_apply_deltas();
+
+        DROP TRIGGER IF EXISTS expenditure_rollup_delete ON expenditure;
+        CREATE TRIGGER expenditure_rollup_delete
+            AFTER DELETE ON expenditure
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION expenditure_rollup_apply_deltas();
+
+        -- backfill from the rows that already exist
+        INSERT INTO expenditure_monthly_rollup (user_uuid, month, category, status, total, count)
+        SELECT user_uuid, date_trunc('month', date_of_expense)::date, COALESCE(category, ''),
+            COALESCE(status, ''), SUM(amount), COUNT(*)
+        FROM expenditure
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (user_uuid, month, category, status) DO NOTHING;
+    """),
+    Migration(5, "statement import jobs and dedupe index", """
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            uuid UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            user_uuid UUID NOT NULL REFERENCES users(uuid) ON DELETE CASCADE,
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            format VARCHAR(10) NOT NULL,
+            filename VARCHAR(255),
+            bytes_total BIGINT NOT NULL DEFAULT 0,
+            bytes_read BIGINT NOT NULL DEFAULT 0,
+            rows_read INTEGER NOT NULL DEFAULT 0,
+            rows_inserted INTEGER NOT NULL DEFAULT 0,
+            rows_duplicate INTEGER NOT NULL DEFAULT 0,
+            rows_invalid INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            finished_at TIMESTAMPTZ
+        );
+
+        CREATE INDEX IF NOT EXISTS import_jobs_user_created_idx
+            ON import_jobs (user_uuid, created_at DESC);
+
+        -- identity of a statement line, built only from immutable casts so it can back an index
+        CREATE OR REPLACE FUNCTION expenditure_dedupe_hash(date, numeric, text) RETURNS text AS $$
+            SELECT md5(($1 - DATE '1970-01-01')::text || '|' || $2::text || '|' || lower($3));
+        $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+        CREATE INDEX IF NOT EXISTS expenditure_user_dedupe_idx
+            ON expenditure (user_uuid, expenditure_dedupe_hash(date_of_expense, amount, name));
+    """),
+    Migration(6, "llm job queue", """
+        CREATE TABLE IF NOT EXISTS llm_jobs (
+            uuid UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            kind VARCHAR(20) NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            payload JSONB NOT NULL DEFAULT '{}',
+            audio BYTEA,
+            result JSONB,
+            error JSONB,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            callback_url TEXT,
+            callback_delivered_at TIMESTAMPTZ,
+            run_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            locked_at TIMESTAMPTZ,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            finished_at TIMESTAMPTZ
+        );
+
+        -- workers only ever scan jobs that can still run
+        CREATE INDEX IF NOT EXISTS llm_jobs_runnable_idx
+            ON llm_jobs (run_at) WHERE status IN ('queued', 'running');
+    """),
+    Migration(7, "llm job audio spooled to disk", """
+        ALTER TABLE llm_jobs ADD COLUMN IF NOT EXISTS audio_path TEXT;
+
+        -- audio used to be stored inline, jobs still waiting on it can not be moved to disk
+        UPDATE llm_jobs
+        SET status = 'failed', finished_at = NOW(), updated_at = NOW(),
+            error = '{"status_code": 503, "detail": "Job was dropped by a server upgrade, please submit it again."}'
+        WHERE audio IS NOT NULL AND status IN ('queued', 'running');
+
+        ALTER TABLE llm_jobs DROP COLUMN IF EXISTS audio;
+    """),
+    Migration(8, "import job spool path", """
+        -- lets a sweep fail imports whose worker went away and delete what they had spooled
+        ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS spool_path TEXT;
+
+        CREATE INDEX IF NOT EXISTS import_jobs_unfinished_idx
+            ON import_jobs (updated_at) WHERE status IN ('queued', 'running');
+    """),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+async def current_version(conn: AsyncConnection) -> int:
+    """
+    return the applied schema version, 0 for a database that has never been migrated
+    """
+    try:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_migrations;")
+            row = await cur.fetchone()
+        await conn.commit()
+        return row["version"] if isinstance(row, dict) else row[0]
+
+    except psycopg_errors.UndefinedTable:
+        await conn.rollback()
+        return 0
+
+
+async def migrate(conn: AsyncConnection) -> int:
+    """
+    apply every pending migration and return the resulting schema version
+    """
+    if await current_version(conn) >= LATEST_VERSION:
+        return LATEST_VERSION
+
+    async with conn.transaction():
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATION_LOCK_KEY,))
+            await cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name VARCHAR(255) NOT NULL,
+                    applied_at TIMESTAMPTZ DEFAULT NOW() NOT NULL
+                );
+            """)
+
+            # another worker may have finished migrating while we waited for the lock
+            await cur.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_migrations;")
+            version = (await cur.fetchone())["version"]
+
+            for migration in MIGRATIONS:
+                if migration.version <= version:
+                    continue
+
+                await cur.execute(migration.sql)
+                await cur.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (%s, %s);",
+                    (migration.version, migration.name)
+                )
+                print(f"Applied migration {migration.version}: {migration.name}")
+                version = migration.version
+
+    return version
+
+
+async def run_migrations() -> int:
+    """
+    migrate the configured database on a dedicated connection, used outside of the app startup hook
+    """
+    async with await AsyncConnection.connect(str(settings.DATABASE_URL)) as conn:
+        return await migrate(conn)
+
+
+if __name__ == "__main__":
+    print(f"Database schema at version {asyncio.run(run_migrations())}.")
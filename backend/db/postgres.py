@@ -1,20 +1,91 @@
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
 from psycopg import AsyncConnection
 from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
 from config import settings
+from db.instrumentation import InstrumentedCursor
 
 
-async def get_async_session() -> AsyncGenerator[AsyncConnection, None]:
+pool: Optional[AsyncConnectionPool] = None
+
+
+async def open_pool() -> AsyncConnectionPool:
     """
-    open an asynchronous connection to the database and yield the connection for use in the endpoint.
-    getter function ensures that the connection is properly closed after being used in the endpoint.
+    create the process-wide connection pool. called once from the fastapi startup hook so that every
+    request reuses an already established connection instead of paying for a new handshake.
     """
-    
-    conn = await AsyncConnection.connect(
+    global pool
+
+    if pool is not None:
+        return pool
+
+    pool = AsyncConnectionPool(
         conninfo=str(settings.DATABASE_URL),
-        row_factory=dict_row,
+        min_size=settings.DB_POOL_MIN_SIZE,
+        max_size=settings.DB_POOL_MAX_SIZE,
+        max_idle=settings.DB_POOL_MAX_IDLE_SECONDS,
+        max_lifetime=settings.DB_POOL_MAX_LIFETIME_SECONDS,
+        timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+        check=AsyncConnectionPool.check_connection if settings.DB_POOL_CHECK_ON_CHECKOUT else None,
+        kwargs={
+            "row_factory": dict_row,
+            **({"cursor_factory": InstrumentedCursor} if settings.DB_QUERY_INSTRUMENTATION else {}),
+        },
+        name="hci-backend",
+        open=False,
     )
-    try:
+    # do not block startup on the database, connections are filled in the background
+    await pool.open(wait=False)
+    return pool
+
+
+async def close_pool() -> None:
+    """
+    drain the connection pool on shutdown, waiting for checked out connections to be returned.
+    """
+    global pool
+
+    if pool is None:
+        return
+
+    await pool.close(timeout=settings.DB_POOL_CLOSE_TIMEOUT_SECONDS)
+    pool = None
+
+
+def get_pool() -> AsyncConnectionPool:
+    """
+    return the process-wide pool, for code that needs a connection outside of a request dependency.
+    """
+    if pool is None:
+        raise RuntimeError("Database connection pool not initialized during startup.")
+
+    return pool
+
+
+def get_pool_stats() -> dict:
+    """
+    snapshot of the pool usage. `requests_wait_ms` is the cumulative time spent waiting for a
+    connection and `saturation` is the share of `max_size` currently checked out.
+    """
+    if pool is None:
+        return {}
+
+    stats = pool.get_stats()
+    pool_size = stats.get("pool_size", 0)
+    in_use = pool_size - stats.get("pool_available", 0)
+
+    return {
+        **stats,
+        "pool_in_use": in_use,
+        "saturation": in_use / pool.max_size if pool.max_size else 0.0,
+    }
+
+
+async def get_async_session() -> AsyncGenerator[AsyncConnection, None]:
+    """
+    check out a connection from the pool and yield it for use in the endpoint.
+    fastapi caches dependencies per request, so `auth.get_current_user` and the endpoint share
+    this single connection. it is returned to the pool once the request is done.
+    """
+    async with get_pool().connection() as conn:
         yield conn
-    finally:
-        await conn.close()
\ No newline at end of file
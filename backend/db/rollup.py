@@ -0,0 +1,111 @@
+"""
+Reconcile expenditure_monthly_rollup with the expenditure table.
+The rollup is maintained by statement triggers (see migration 4), this is the tool to detect and repair drift,
+e.g. after manual data fixes with the triggers disabled.
+
+run with `python -m db.rollup verify [--user UUID]` or `python -m db.rollup rebuild [--user UUID]`
+"""
+import argparse
+import asyncio
+import sys
+from typing import List, Optional
+
+from psycopg import AsyncConnection
+from psycopg.rows import dict_row
+
+from config import settings
+
+
+# rollup buckets recomputed from the raw rows, optionally scoped to one user
+EXPECTED_ROLLUP = """
+    SELECT user_uuid, date_trunc('month', date_of_expense)::date AS month,
+        COALESCE(category, '') AS category, COALESCE(status, '') AS status,
+        SUM(amount) AS total, COUNT(*) AS count
+    FROM expenditure
+    WHERE %(user_uuid)s::uuid IS NULL OR user_uuid = %(user_uuid)s::uuid
+    GROUP BY 1, 2, 3, 4
+"""
+
+
+async def verify(conn: AsyncConnection, user_uuid: Optional[str] = None) -> List[dict]:
+    """
+    return every bucket where the rollup disagrees with the raw expenditure rows
+    """
+    query = f"""
+        WITH expected AS ({EXPECTED_ROLLUP}),
+        actual AS (
+            SELECT user_uuid, month, category, status, total, count
+            FROM expenditure_monthly_rollup
+            WHERE count <> 0 AND (%(user_uuid)s::uuid IS NULL OR user_uuid = %(user_uuid)s::uuid)
+        )
+        SELECT COALESCE(e.user_uuid, a.user_uuid) AS user_uuid,
+            COALESCE(e.month, a.month) AS month,
+            COALESCE(e.category, a.category) AS category,
+            COALESCE(e.status, a.status) AS status,
+            e.total AS expected_total, a.total AS actual_total,
+            e.count AS expected_count, a.count AS actual_count
+        FROM expected e
+        FULL OUTER JOIN actual a
+            ON e.user_uuid = a.user_uuid AND e.month = a.month
+            AND e.category = a.category AND e.status = a.status
+        WHERE e.total IS DISTINCT FROM a.total OR e.count IS DISTINCT FROM a.count
+        ORDER BY 1, 2, 3, 4;
+    """
+
+    async with conn.cursor(row_factory=dict_row) as cur:
+        await cur.execute(query, {"user_uuid": user_uuid})
+        drift = await cur.fetchall()
+    await conn.commit()
+    return drift
+
+
+async def rebuild(conn: AsyncConnection, user_uuid: Optional[str] = None) -> int:
+    """
+    recompute the rollup from the raw rows and return the number of buckets written.
+    writers are blocked for the duration so no change slips in between the delete and the insert.
+    """
+    async with conn.transaction():
+        async with conn.cursor() as cur:
+            await cur.execute("LOCK TABLE expenditure IN SHARE MODE;")
+            await cur.execute(
+                """
+                DELETE FROM expenditure_monthly_rollup
+                WHERE %(user_uuid)s::uuid IS NULL OR user_uuid = %(user_uuid)s::uuid;
+                """,
+                {"user_uuid": user_uuid}
+            )
+            await cur.execute(
+                f"""
+                INSERT INTO expenditure_monthly_rollup (user_uuid, month, category, status, total, count)
+                {EXPECTED_ROLLUP};
+                """,
+                {"user_uuid": user_uuid}
+            )
+            return cur.rowcount
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Verify or rebuild the expenditure monthly rollup.")
+    parser.add_argument("command", choices=["verify", "rebuild"])
+    parser.add_argument("--user", dest="user_uuid", default=None, help="only check or rebuild this user")
+    args = parser.parse_args(argv)
+
+    async with await AsyncConnection.connect(str(settings.DATABASE_URL)) as conn:
+        if args.command == "rebuild":
+            written = await rebuild(conn, args.user_uuid)
+            print(f"Rebuilt {written} rollup buckets.")
+            return 0
+
+        drift = await verify(conn, args.user_uuid)
+        for row in drift:
+            print(
+                f"{row['user_uuid']} {row['month']} category={row['category']!r} status={row['status']!r}: "
+                f"expected {row['expected_total']} / {row['expected_count']}, "
+                f"found {row['actual_total']} / {row['actual_count']}"
+            )
+        print(f"{len(drift)} drifted rollup buckets.")
+        return 1 if drift else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,84 @@
+"""
+Production server: gunicorn managing uvicorn workers, started with `gunicorn app.main:app`.
+
+The app is imported once in the master and forked, so workers share the import cost and memory.
+Pending schema migrations run once in the master before any worker starts; the workers' startup
+hook then only confirms the version. Anything per connection (database pool, OpenAI client, LLM job
+workers) is still created in each worker's startup hook, after the fork.
+
+On SIGTERM every worker stops accepting connections, gives requests in flight (LLM calls and streams
+included) SERVER_DRAIN_TIMEOUT_SECONDS to finish, lets running LLM jobs finish for
+LLM_JOB_DRAIN_TIMEOUT_SECONDS and closes its pools. Workers still busy after `graceful_timeout` are killed.
+
+Metrics are kept per worker process, and a scrape of /metrics lands on whichever worker accepts it. Every
+worker therefore exports its metrics to METRICS_MULTIPROC_DIR and answers a scrape with the merge of all
+workers (see app/metrics.py), so one scrape target per container is enough.
+"""
+import asyncio
+import math
+import os
+import tempfile
+from pathlib import Path
+
+from config import settings
+from db import migrations
+
+
+def available_cores() -> int:
+    """
+    cores this process may run on, which can be fewer than the machine has
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = settings.SERVER_BIND
+# the workers are async, one per core keeps every core busy without contending for it
+workers = settings.SERVER_WORKERS or available_cores()
+worker_class = "app.worker.UvicornWorker"
+preload_app = True
+keepalive = settings.SERVER_KEEPALIVE_SECONDS
+# docker (compose.yml stop_grace_period) kills the container SERVER_STOP_TIMEOUT_SECONDS after SIGTERM,
+# gunicorn kills the workers this much earlier so the master still exits cleanly
+STOP_MARGIN_SECONDS = 10
+graceful_timeout = settings.SERVER_STOP_TIMEOUT_SECONDS - STOP_MARGIN_SECONDS
+# the slowest shutdown is a full request drain followed by a full LLM job drain and closing the database pool
+slowest_shutdown = math.ceil(
+    settings.SERVER_DRAIN_TIMEOUT_SECONDS
+    + settings.LLM_JOB_DRAIN_TIMEOUT_SECONDS
+    + settings.DB_POOL_CLOSE_TIMEOUT_SECONDS
+    + 5
+)
+if slowest_shutdown > graceful_timeout:
+    print(
+        f"WARNING: shutting down can take {slowest_shutdown}s but workers are killed after {graceful_timeout}s, "
+        f"raise SERVER_STOP_TIMEOUT_SECONDS to {slowest_shutdown + STOP_MARGIN_SECONDS} or lower the drain timeouts."
+    )
+accesslog = "-"
+
+# set before the app is preloaded and the workers are forked, so they all share it
+if not settings.METRICS_MULTIPROC_DIR:
+    settings.METRICS_MULTIPROC_DIR = tempfile.mkdtemp(prefix="hci-metrics-")
+
+
+def on_starting(server):
+    """
+    apply pending migrations once, before the workers are forked. the server does not start on failure.
+    metrics exported by the workers of a previous run are dropped.
+    """
+    Path(settings.METRICS_MULTIPROC_DIR).mkdir(parents=True, exist_ok=True)
+    for snapshot in Path(settings.METRICS_MULTIPROC_DIR).glob("*.json"):
+        snapshot.unlink(missing_ok=True)
+
+    try:
+        version = asyncio.run(migrations.run_migrations())
+        print(f"Database schema at version {version}.")
+    except Exception as e:
+        print(f"CRITICAL: Error migrating database schema: {e}")
+        raise
+
+
+def when_ready(server):
+    print(f"Serving on {bind} with {workers} workers.")
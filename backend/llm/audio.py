@@ -0,0 +1,193 @@
+"""
+Helpers for audio uploads sent to Whisper.
+Long recordings are split with ffmpeg, on silences where possible and otherwise into fixed windows that
+overlap a little so no word is lost at a cut. The overlap is transcribed twice and removed again when the
+segment transcripts are stitched together. Without an ffmpeg binary every file is sent in one piece.
+"""
+import asyncio
+import os
+import re
+import shutil
+import tempfile
+from typing import List, NamedTuple, Optional, Tuple
+
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+from config import settings
+
+
+# bytes read from the start of an upload to recognise its container
+SNIFF_BYTES = 16
+
+# Whisper refuses larger files, anything bigger has to be split
+WHISPER_MAX_BYTES = 25 * 1024 * 1024
+
+# how many words at a segment boundary are compared when removing the overlap
+OVERLAP_MAX_WORDS = 40
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class Segment(NamedTuple):
+    index: int
+    start: float
+    end: float
+    # the end of this segment is transcribed again at the start of the next one
+    overlaps_next: bool
+
+
+def sniff_audio_format(header: bytes) -> Optional[str]:
+    """
+    recognise the formats Whisper accepts from their magic bytes, None for anything else
+    """
+    if header.startswith(b"ID3") or (len(header) > 1 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0):
+        return "mp3"
+    if header.startswith(b"RIFF") and header[8:12] == b"WAVE":
+        return "wav"
+    if header.startswith(b"OggS"):
+        return "ogg"
+    if header.startswith(b"fLaC"):
+        return "flac"
+    if header[4:8] == b"ftyp":
+        return "mp4"
+    if header.startswith(b"\x1a\x45\xdf\xa3"):
+        return "webm"
+    return None
+
+
+def ffmpeg_binary() -> Optional[str]:
+    return shutil.which(settings.FFMPEG_BINARY)
+
+
+async def spool_to_file(upload: UploadFile, directory: Optional[str] = None) -> str:
+    """
+    copy an upload to a named temporary file ffmpeg can seek in, the caller deletes it
+    """
+    with tempfile.NamedTemporaryFile(prefix="audio-", dir=directory, delete=False) as spool:
+        try:
+            await upload.seek(0)
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                await run_in_threadpool(spool.write, chunk)
+        except BaseException:
+            os.unlink(spool.name)
+            raise
+    return spool.name
+
+
+async def _run_ffmpeg(*args: str) -> Tuple[bytes, bytes]:
+    process = await asyncio.create_subprocess_exec(
+        ffmpeg_binary(), "-hide_banner", "-nostdin", *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='replace').strip().splitlines()[-1:]}")
+    return stdout, stderr
+
+
+def _seconds(timestamp: str) -> float:
+    hours, minutes, seconds = timestamp.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+async def analyze(path: str) -> Tuple[float, List[Tuple[float, float]]]:
+    """
+    decode the file once and return its duration and the (start, end) of every silence in it
+    """
+    _, stderr = await _run_ffmpeg(
+        "-i", path, "-vn",
+        "-af", f"silencedetect=noise={settings.LLM_AUDIO_SILENCE_NOISE_DB}dB:d={settings.LLM_AUDIO_SILENCE_MIN_SECONDS}",
+        "-f", "null", "-",
+    )
+    log = stderr.decode(errors="replace")
+
+    # the header duration can be missing for streamed containers, the last progress time never is
+    times = [_seconds(value) for value in re.findall(r"(?:Duration|time)=?:? ?(\d+:\d+:\d+(?:\.\d+)?)", log)]
+    duration = max(times, default=0.0)
+
+    starts = [float(value) for value in re.findall(r"silence_start: (-?[\d.]+)", log)]
+    ends = [float(value) for value in re.findall(r"silence_end: ([\d.]+)", log)]
+    # a file ending in silence has no silence_end for the last one
+    ends += [duration] * (len(starts) - len(ends))
+    return duration, list(zip(starts, ends))
+
+
+def plan_segments(duration: float, silences: List[Tuple[float, float]]) -> List[Segment]:
+    """
+    cut the recording every LLM_AUDIO_SEGMENT_SECONDS, at the latest silence in the preceding
+    LLM_AUDIO_SILENCE_SEARCH_SECONDS if there is one and with LLM_AUDIO_SEGMENT_OVERLAP_SECONDS of overlap if not
+    """
+    target = settings.LLM_AUDIO_SEGMENT_SECONDS
+    overlap = settings.LLM_AUDIO_SEGMENT_OVERLAP_SECONDS
+    search = settings.LLM_AUDIO_SILENCE_SEARCH_SECONDS
+    midpoints = [(start + end) / 2 for start, end in silences]
+
+    segments: List[Segment] = []
+    start = 0.0
+    # a short remainder is folded into the last segment instead of becoming a segment of its own
+    while duration - start > target * 1.25:
+        ideal = start + target
+        # a cut has to move past the start, or the loop would never end
+        candidates = [point for point in midpoints if max(ideal - search, start) < point <= ideal]
+        if candidates:
+            cut = max(candidates)
+            segments.append(Segment(len(segments), start, cut, False))
+        else:
+            cut = ideal
+            segments.append(Segment(len(segments), start, cut + overlap, True))
+        start = cut
+
+    segments.append(Segment(len(segments), start, duration, False))
+    return segments
+
+
+async def extract_segment(path: str, segment: Segment) -> bytes:
+    """
+    re-encode one segment as 16 kHz mono FLAC, the input format Whisper works at anyway
+    """
+    stdout, _ = await _run_ffmpeg(
+        "-loglevel", "error",
+        "-ss", f"{segment.start:.3f}", "-t", f"{segment.end - segment.start:.3f}",
+        "-i", path, "-vn", "-ac", "1", "-ar", "16000", "-c:a", "flac", "-f", "flac", "pipe:1",
+    )
+    return stdout
+
+
+def _normalize_word(word: str) -> str:
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+def merge_overlap(previous: str, following: str) -> str:
+    """
+    drop the start of `following` that repeats the end of `previous`, the longest exact word run wins
+    """
+    previous_words = [_normalize_word(word) for word in previous.split()[-OVERLAP_MAX_WORDS:]]
+    following_words = following.split()
+    candidates = [_normalize_word(word) for word in following_words[:OVERLAP_MAX_WORDS]]
+
+    for length in range(min(len(previous_words), len(candidates)), 0, -1):
+        if previous_words[-length:] == candidates[:length]:
+            return " ".join(following_words[length:])
+    return following
+
+
+def stitch(segments: List[Segment], texts: List[str]) -> str:
+    """
+    join segment transcripts in order, removing the text repeated in overlapping windows
+    """
+    parts: List[str] = []
+    for segment, text in zip(segments, texts):
+        text = text.strip()
+        if parts and segment.index > 0 and segments[segment.index - 1].overlaps_next:
+            text = merge_overlap(parts[-1], text)
+        if text:
+            parts.append(text)
+    return " ".join(parts)
@@ -0,0 +1,254 @@
+"""
+Local expense extractors that answer simple text requests without a model call.
+An extractor takes the chat history as plain message dicts and returns the same body the model
+would (`response` and an `expense` list) together with a confidence between 0 and 1, or None when
+the request is outside what it understands. `route` applies LLM_EXTRACTION_ROUTING:
+    llm    every request goes to the model
+    auto   the local answer is used when its confidence reaches LLM_LOCAL_MIN_CONFIDENCE
+    local  every text request is answered locally, only image requests reach the model
+"""
+import re
+from datetime import date, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app.metrics import Counter
+from config import settings
+
+
+class Extraction(NamedTuple):
+    response: dict
+    confidence: float
+
+
+extraction_routes_total = Counter(
+    "llm_extraction_routes_total",
+    "Chat extraction requests by the engine that answered them and why",
+)
+
+
+# whole words only, so plurals are listed as keywords of their own
+CATEGORY_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "Food": (
+        "mcdonald", "mcdonalds", "kfc", "burger", "burgers", "pizza", "pizzas", "subway", "starbucks",
+        "coffee", "coffees", "kopi", "tea", "teas", "boba", "lunch", "dinner", "breakfast", "brunch", "supper",
+        "snack", "snacks", "restaurant", "cafe", "hawker", "rice", "noodle", "noodles", "chicken", "sushi",
+        "ramen", "bakery", "bread", "drink", "drinks", "juice", "food",
+    ),
+    "Groceries": (
+        "ntuc", "fairprice", "cold storage", "giant", "sheng siong", "grocer", "grocery", "groceries",
+        "supermarket", "market",
+    ),
+    "Transport": (
+        "grab", "gojek", "uber", "taxi", "taxis", "cab", "cabs", "bus", "buses", "mrt", "train", "trains",
+        "ez-link", "ezlink", "petrol", "fuel", "parking", "toll", "tolls", "erp",
+    ),
+    "Shopping": ("uniqlo", "shopee", "lazada", "amazon", "ikea", "clothes", "shirt", "shirts", "shoes", "mall"),
+    "Entertainment": (
+        "movie", "movies", "cinema", "netflix", "spotify", "disney", "concert", "concerts", "game", "games", "karaoke",
+    ),
+    "Utilities": ("electricity", "water bill", "internet", "phone bill", "singtel", "starhub", "m1", "utilities"),
+    "Health": ("clinic", "doctor", "dentist", "pharmacy", "guardian", "watsons", "medicine", "medicines", "hospital"),
+    "Travel": ("hotel", "hotels", "flight", "flights", "airbnb", "hostel", "airline"),
+}
+
+MONTHS = {
+    name: index + 1
+    for index, names in enumerate((
+        ("jan", "january"), ("feb", "february"), ("mar", "march"), ("apr", "april"), ("may",), ("jun", "june"),
+        ("jul", "july"), ("aug", "august"), ("sep", "sept", "september"), ("oct", "october"),
+        ("nov", "november"), ("dec", "december"),
+    ))
+    for name in names
+}
+
+# requests that need more than reading off items and prices
+UNSUPPORTED_PATTERN = re.compile(
+    r"\?|\b(how much|split|each|per person|refund|change|remove|delete|instead|actually|not|total of)\b",
+    re.IGNORECASE,
+)
+ITEM_SEPARATOR = re.compile(r"\s*(?:,(?!\d{3}\b)|;|\n|&|\+|\band\b|\bthen\b|\bplus\b)\s*", re.IGNORECASE)
+AMOUNT_PATTERN = re.compile(
+    r"(?P<prefix>(?:S\$|US\$|\$|SGD|USD)\s?)?"
+    r"(?P<amount>\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?|\d+(?:\.\d{1,2})?)"
+    r"(?P<suffix>\s?(?:dollars?|bucks|sgd|usd)\b)?",
+    re.IGNORECASE,
+)
+ISO_DATE_PATTERN = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+NUMERIC_DATE_PATTERN = re.compile(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?\b")
+DAY_MONTH_PATTERN = re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)?\s+([a-z]{3,9})\b", re.IGNORECASE)
+MONTH_DAY_PATTERN = re.compile(r"\b([a-z]{3,9})\s+(\d{1,2})(?:st|nd|rd|th)?\b", re.IGNORECASE)
+FILLER_PATTERN = re.compile(
+    r"\b(i|i've|we|spent|spend|paid|pay|bought|buy|got|had|for|at|on|from|a|an|the|some|today|yesterday|"
+    r"this morning|tonight|last night|cost|costs|was|were|of|about|around)\b",
+    re.IGNORECASE,
+)
+
+
+def _overlaps(span: Tuple[int, int], spans: List[Tuple[int, int]]) -> bool:
+    return any(start < span[1] and span[0] < end for start, end in spans)
+
+
+def parse_date(text: str, today: date) -> Tuple[Optional[date], str, bool]:
+    """
+    find the expense date in the text and return it with the date removed, None when no date is mentioned.
+    digits written as a price (e.g. "$15 Oct 3") are never read as a day. the last value is True when the
+    date is ambiguous, i.e. another reading of the same words gives a different date ("12 may 5").
+    """
+    lowered = text.lower()
+    if "yesterday" in lowered or "last night" in lowered:
+        return today - timedelta(days=1), text, False
+    if "today" in lowered or "this morning" in lowered or "tonight" in lowered:
+        return today, text, False
+
+    prices = [match.span("amount") for match in AMOUNT_PATTERN.finditer(text) if match["prefix"] or match["suffix"]]
+
+    # every possible reading in order of preference, month before day comes first as it cannot swallow a price
+    candidates = []
+    for match in ISO_DATE_PATTERN.finditer(text):
+        try:
+            candidates.append((match, date(int(match[1]), int(match[2]), int(match[3]))))
+        except ValueError:
+            pass
+    for match in NUMERIC_DATE_PATTERN.finditer(text):
+        year = int(match[3]) if match[3] else today.year
+        year += 2000 if year < 100 else 0
+        try:
+            # day first, as written in Singapore
+            candidates.append((match, date(year, int(match[2]), int(match[1]))))
+        except ValueError:
+            pass
+    for pattern, day_group, month_group in ((MONTH_DAY_PATTERN, 2, 1), (DAY_MONTH_PATTERN, 1, 2)):
+        for match in pattern.finditer(text):
+            if match[month_group].lower() not in MONTHS:
+                continue
+            try:
+                parsed = date(today.year, MONTHS[match[month_group].lower()], int(match[day_group]))
+            except ValueError:
+                continue
+            # a date later in the year than today is from last year
+            if parsed > today:
+                parsed = parsed.replace(year=today.year - 1)
+            candidates.append((match, parsed))
+
+    candidates = [(match, parsed) for match, parsed in candidates if not _overlaps(match.span(), prices)]
+    if not candidates:
+        return None, text, False
+
+    match, parsed = candidates[0]
+    ambiguous = any(
+        other.span() != match.span() and _overlaps(other.span(), [match.span()]) and other_date != parsed
+        for other, other_date in candidates[1:]
+    )
+    return parsed, text[:match.start()] + " " + text[match.end():], ambiguous
+
+
+CATEGORY_PATTERNS = [
+    (category, re.compile(r"\b(?:" + "|".join(re.escape(keyword) for keyword in keywords) + r")\b", re.IGNORECASE))
+    for category, keywords in CATEGORY_KEYWORDS.items()
+]
+
+
+def categorize(name: str) -> Optional[str]:
+    for category, pattern in CATEGORY_PATTERNS:
+        if pattern.search(name):
+            return category
+    return None
+
+
+class RuleExtractor:
+    """
+    deterministic parser for inputs like "Mcdonald's $10 and Bubble Tea $4.5 yesterday"
+    """
+
+    name = "rules"
+
+    def extract(self, messages: List[dict], prompt_date: str) -> Optional[Extraction]:
+        # follow ups need the whole conversation, which is the model's job
+        if len(messages) != 1 or messages[0]["role"] != "user":
+            return None
+        parts = messages[0]["content"]
+        if any(part["type"] != "text" for part in parts):
+            return None
+
+        text = " ".join(part["text"] for part in parts).strip()
+        if not text or len(text) > 500 or UNSUPPORTED_PATTERN.search(text):
+            return None
+
+        today = date.fromisoformat(prompt_date)
+        expense_date, text, date_ambiguous = parse_date(text, today)
+
+        expenses = []
+        # when the date could be read another way, its digits could as well be a price, the model decides
+        confidence = 0.0 if date_ambiguous else 1.0
+        for item in ITEM_SEPARATOR.split(text):
+            item = item.strip()
+            if not item:
+                continue
+
+            amounts = list(AMOUNT_PATTERN.finditer(item))
+            if not amounts:
+                # a fragment without a price, e.g. "Bubble Tea and Fries $8", can't be split reliably
+                return None
+            if len(amounts) > 1:
+                confidence -= 0.3
+            amount = amounts[-1]
+            if not (amount["prefix"] or amount["suffix"]):
+                confidence -= 0.2
+
+            name = FILLER_PATTERN.sub(" ", AMOUNT_PATTERN.sub(" ", item))
+            name = re.sub(r"\s+", " ", re.sub(r"[^\w'&.\- ]", " ", name)).strip(" .-")
+            if not name:
+                return None
+            if len(name.split()) > 5:
+                confidence -= 0.2
+
+            category = categorize(name)
+            if category is None:
+                confidence -= 0.15
+
+            expenses.append({
+                "name": name,
+                "category": category or "Others",
+                "price": round(float(amount["amount"].replace(",", "")), 2),
+                "date_of_expense": (expense_date or today).isoformat(),
+            })
+
+        if not expenses:
+            return None
+
+        total = sum(expense["price"] for expense in expenses)
+        summary = ", ".join(f"{expense['name']} (${expense['price']:.2f})" for expense in expenses)
+        response = {
+            "response": f"I found {len(expenses)} expense{'s' if len(expenses) > 1 else ''} totalling ${total:.2f}: {summary}.",
+            "expense": expenses,
+        }
+        return Extraction(response, max(confidence, 0.0))
+
+
+EXTRACTORS = {
+    RuleExtractor.name: RuleExtractor(),
+}
+
+
+def route(messages: List[dict], prompt_date: str) -> Optional[dict]:
+    """
+    return the local answer when the routing policy allows it, None when the model has to answer
+    """
+    policy = settings.LLM_EXTRACTION_ROUTING
+    if policy == "llm":
+        extraction_routes_total.inc(engine="llm", reason="policy")
+        return None
+
+    extractor = EXTRACTORS[settings.LLM_LOCAL_EXTRACTOR]
+    extraction = extractor.extract(messages, prompt_date)
+    if extraction is None:
+        extraction_routes_total.inc(engine="llm", reason="unsupported")
+        return None
+
+    if policy == "local" or extraction.confidence >= settings.LLM_LOCAL_MIN_CONFIDENCE:
+        extraction_routes_total.inc(engine=extractor.name, reason="confident" if policy == "auto" else "policy")
+        return extraction.response
+
+    extraction_routes_total.inc(engine="llm", reason="low_confidence")
+    return None
+
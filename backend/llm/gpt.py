@@ -1,10 +1,117 @@
-from app import main
-from openai import OpenAI
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
 
+import httpx
+from fastapi import HTTPException, Request, status
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 
-def get_openai_client() -> OpenAI:
+from app import tracing
+from app.metrics import Counter, Gauge, Histogram
+from config import settings
+
+
+_llm_semaphore: Optional[asyncio.Semaphore] = None
+
+llm_slots_in_use = Gauge("llm_slots_in_use", "Upstream model calls currently holding an llm_slot")
+llm_request_duration_seconds = Histogram(
+    "llm_request_duration_seconds", "Duration of upstream OpenAI calls by operation, model and outcome"
+)
+llm_tokens_total = Counter("llm_tokens_total", "Tokens reported by OpenAI by model and type (prompt or completion)")
+
+
+def create_openai_client() -> AsyncOpenAI:
+    """
+    Create the async OpenAI client on top of one shared, keep-alive http connection pool.
+    """
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=settings.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        timeout=httpx.Timeout(
+            settings.OPENAI_TIMEOUT_SECONDS,
+            connect=settings.OPENAI_CONNECT_TIMEOUT_SECONDS,
+        ),
+    )
+    return AsyncOpenAI(
+        http_client=http_client,
+        max_retries=settings.OPENAI_MAX_RETRIES,
+    )
+
+
+def get_openai_client(request: Request) -> AsyncOpenAI:
     """Dependency that returns the initialized global OpenAI client."""
-    if not hasattr(main.app.state, 'openai_client'):
+    if not hasattr(request.app.state, 'openai_client'):
          raise RuntimeError("OpenAI client not initialized during startup.")
-         
-    return main.app.state.openai_client
\ No newline at end of file
+
+    return request.app.state.openai_client
+
+
+@asynccontextmanager
+async def llm_slot(wait: bool = False) -> AsyncIterator[None]:
+    """
+    Limit the number of concurrent upstream model calls in this worker so that slow LLM traffic
+    cannot take over the event loop and connection pool used by the other endpoints.
+    Requests that wait longer than LLM_QUEUE_TIMEOUT_SECONDS for a slot are rejected with 503.
+    With `wait` the call queues for as long as it takes instead, for calls that are part of a request
+    already being worked on (the segments of one recording), where a 503 would throw away finished work.
+    """
+    global _llm_semaphore
+
+    if _llm_semaphore is None:
+        _llm_semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+
+    try:
+        timeout = None if wait else settings.LLM_QUEUE_TIMEOUT_SECONDS
+        await asyncio.wait_for(_llm_semaphore.acquire(), timeout=timeout)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent LLM requests. Please try again in a while.",
+            headers={"Retry-After": "5"},
+        )
+
+    llm_slots_in_use.inc()
+    try:
+        yield
+    finally:
+        llm_slots_in_use.dec()
+        _llm_semaphore.release()
+
+
+@asynccontextmanager
+async def track_llm_call(operation: str, model: str) -> AsyncIterator[tracing.NoopSpan]:
+    """
+    Time an upstream model call into llm_request_duration_seconds and run it inside an `llm.<operation>` span.
+    The outcome label is "ok" or the name of the exception raised, for streams the block should cover
+    reading the whole stream.
+    """
+    outcome = "ok"
+    start = time.perf_counter()
+    with tracing.span(f"llm.{operation}", **{"gen_ai.system": "openai", "gen_ai.request.model": model}) as span:
+        try:
+            yield span
+        except BaseException as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            llm_request_duration_seconds.observe(
+                time.perf_counter() - start, operation=operation, model=model, outcome=outcome
+            )
+
+
+def record_token_usage(model: str, usage, span: tracing.NoopSpan = tracing.NOOP_SPAN) -> None:
+    """
+    add the token usage of a response (its `usage` field, None when not reported) to llm_tokens_total
+    """
+    if usage is None:
+        return
+
+    for token_type in ("prompt", "completion"):
+        tokens = getattr(usage, f"{token_type}_tokens", None)
+        if tokens:
+            llm_tokens_total.inc(tokens, model=model, type=token_type)
+            span.set_attribute(f"gen_ai.usage.{token_type}_tokens", tokens)
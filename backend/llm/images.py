@@ -0,0 +1,178 @@
+"""
+Shrink chat images before they are sent to the model.
+Data URI images are decoded, rotated upright, optionally cropped to the receipt, downscaled to
+LLM_IMAGE_MAX_DIMENSION and re-encoded without EXIF or ICC metadata. Remote image URLs, formats
+Pillow cannot read and images the re-encoding would not make smaller are forwarded untouched. Decoding and resizing are cpu bound, so they run on a
+small dedicated thread pool instead of the event loop.
+"""
+import asyncio
+import base64
+import binascii
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+from PIL import Image, ImageFilter, ImageOps, UnidentifiedImageError
+
+from app.metrics import Counter, Summary
+from config import settings
+
+
+_image_executor = ThreadPoolExecutor(
+    max_workers=settings.LLM_IMAGE_MAX_WORKERS,
+    thread_name_prefix="image",
+)
+
+image_bytes_total = Counter("llm_image_bytes_total", "Chat image bytes before and after preprocessing")
+image_preprocess_seconds = Summary("llm_image_preprocess_seconds", "Time spent preprocessing one chat image")
+
+# receipts that fill less than this share of the photo are too uncertain to crop to
+AUTOCROP_MIN_AREA = 0.1
+AUTOCROP_MARGIN = 0.02
+
+
+def parse_data_uri(url: str) -> Optional[Tuple[str, bytes]]:
+    """
+    return (mime type, bytes) of a base64 data URI, None for anything else
+    """
+    if not url.startswith("data:"):
+        return None
+
+    header, _, data = url.partition(",")
+    if not header.endswith(";base64"):
+        return None
+
+    try:
+        return header[len("data:"):-len(";base64")], base64.b64decode(data, validate=True)
+    except binascii.Error:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Image data URI is not valid base64.",
+        )
+
+
+def _otsu_threshold(image: Image.Image) -> int:
+    """
+    grey level that best separates a bright receipt from a darker background
+    """
+    histogram = image.histogram()
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+
+    best_level, best_variance = 0, 0.0
+    background, weighted_background = 0, 0
+    for level, count in enumerate(histogram):
+        background += count
+        if background == 0:
+            continue
+        foreground = total - background
+        if foreground == 0:
+            break
+        weighted_background += level * count
+        mean_background = weighted_background / background
+        mean_foreground = (weighted_total - weighted_background) / foreground
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_level, best_variance = level, variance
+    return best_level
+
+
+def crop_to_receipt(image: Image.Image) -> Image.Image:
+    """
+    crop to the bounding box of the bright paper, the photo is returned as is when no clear receipt is found
+    """
+    probe = image.convert("L")
+    probe.thumbnail((256, 256))
+    threshold = _otsu_threshold(probe)
+    # erode so that specks of bright background do not stretch the box
+    mask = probe.point(lambda level: 255 if level > threshold else 0).filter(ImageFilter.MinFilter(5))
+    box = mask.getbbox()
+    if box is None:
+        return image
+
+    left, top, right, bottom = box
+    area = (right - left) * (bottom - top) / (probe.width * probe.height)
+    if area < AUTOCROP_MIN_AREA or area > 0.95:
+        return image
+
+    scale_x, scale_y = image.width / probe.width, image.height / probe.height
+    margin_x, margin_y = image.width * AUTOCROP_MARGIN, image.height * AUTOCROP_MARGIN
+    return image.crop((
+        max(0, int(left * scale_x - margin_x)),
+        max(0, int(top * scale_y - margin_y)),
+        min(image.width, int(right * scale_x + margin_x)),
+        min(image.height, int(bottom * scale_y + margin_y)),
+    ))
+
+
+def preprocess_image(data: bytes) -> Optional[Tuple[str, bytes]]:
+    """
+    return (mime type, bytes) of the shrunk image, None when Pillow cannot read it
+    """
+    max_dimension = settings.LLM_IMAGE_MAX_DIMENSION
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # open only reads the header, so oversized images are refused before anything is decoded
+            if image.width * image.height > settings.LLM_IMAGE_MAX_PIXELS:
+                raise Image.DecompressionBombError(f"{image.width}x{image.height}")
+
+            # lets the jpeg decoder scale down by up to 8x while decoding, far cheaper than resizing afterwards
+            image.draft("RGB", (max_dimension, max_dimension))
+            image = ImageOps.exif_transpose(image)
+
+            if settings.LLM_IMAGE_AUTOCROP:
+                image = crop_to_receipt(image)
+
+            image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS, reducing_gap=3.0)
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+
+            output = io.BytesIO()
+            # exif and icc_profile are only written when passed explicitly, so the metadata is dropped here
+            image.save(output, format=settings.LLM_IMAGE_FORMAT, quality=settings.LLM_IMAGE_QUALITY, optimize=True)
+
+    except Image.DecompressionBombError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Image has too many pixels.",
+        )
+    except (UnidentifiedImageError, OSError):
+        return None
+
+    return Image.MIME[settings.LLM_IMAGE_FORMAT.upper()], output.getvalue()
+
+
+def _preprocess_data_uri(url: str) -> str:
+    parsed = parse_data_uri(url)
+    if parsed is None:
+        return url
+
+    start = time.perf_counter()
+    _, data = parsed
+    processed = preprocess_image(data)
+    if processed is None:
+        return url
+
+    mime_type, shrunk = processed
+    image_preprocess_seconds.observe(time.perf_counter() - start)
+    image_bytes_total.inc(len(data), stage="original")
+    # an already small, well compressed upload can grow when re-encoded, it is sent as it came then
+    if len(shrunk) >= len(data):
+        image_bytes_total.inc(len(data), stage="processed")
+        return url
+
+    image_bytes_total.inc(len(shrunk), stage="processed")
+    return f"data:{mime_type};base64,{base64.b64encode(shrunk).decode('ascii')}"
+
+
+async def preprocess_image_url(url: str) -> str:
+    """
+    shrink a data URI image off the event loop, any other url is returned unchanged
+    """
+    if not settings.LLM_IMAGE_PREPROCESS or not url.startswith("data:"):
+        return url
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_image_executor, _preprocess_data_uri, url)
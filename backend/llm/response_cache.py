@@ -0,0 +1,150 @@
+"""
+Content-addressed cache for chat extraction responses.
+Entries are keyed by a hash of the normalized chat history together with the model name, the
+prompt version and the date baked into the system prompt, so a new day or a prompt change never
+serves a stale reply. Lookups go to an in-memory LRU first and, if enabled, a postgres table.
+"""
+import hashlib
+import json
+import re
+from typing import Optional
+
+from psycopg.types.json import Jsonb
+
+from app.cache import TTLCache
+from app.metrics import Counter
+from config import settings
+from db.postgres import get_pool
+
+
+memory_cache = TTLCache(
+    maxsize=settings.LLM_CACHE_MAX_ENTRIES,
+    ttl=settings.LLM_CACHE_TTL_SECONDS,
+    name="llm_response",
+)
+
+cache_lookups_total = Counter("llm_cache_lookups_total", "LLM response cache lookups by tier and result")
+
+_writes_since_eviction = 0
+_whitespace = re.compile(r"\s+")
+
+
+def _normalize(value):
+    """
+    collapse whitespace in text so trivially different resubmissions share a key
+    """
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    if isinstance(value, str):
+        return _whitespace.sub(" ", value).strip()
+    return value
+
+
+def cache_key(payload: dict, model: str, prompt_version: str, prompt_date: str) -> str:
+    """
+    sha256 of the normalized request payload and everything else that changes the model output
+    """
+    blob = json.dumps(
+        {
+            "payload": _normalize(payload),
+            "model": model,
+            "prompt_version": prompt_version,
+            "prompt_date": prompt_date,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+async def lookup(key: str) -> Optional[dict]:
+    """
+    return the cached response for the key, or None on a miss in every tier
+    """
+    response = memory_cache.get(key)
+    if response is not None:
+        cache_lookups_total.inc(tier="memory", result="hit")
+        return response
+    cache_lookups_total.inc(tier="memory", result="miss")
+
+    if not settings.LLM_CACHE_PERSISTENT:
+        return None
+
+    query = """
+        UPDATE llm_response_cache
+        SET last_hit_at = NOW(), hits = hits + 1
+        WHERE key = %s AND created_at > NOW() - make_interval(secs => %s)
+        RETURNING response;
+    """
+
+    try:
+        async with get_pool().connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(query, (key, settings.LLM_CACHE_PERSISTENT_TTL_SECONDS))
+                row = await cur.fetchone()
+
+    except Exception as e:
+        print(f"LLM response cache lookup failed: {e}")
+        return None
+
+    if row is None:
+        cache_lookups_total.inc(tier="postgres", result="miss")
+        return None
+
+    cache_lookups_total.inc(tier="postgres", result="hit")
+    memory_cache.set(key, row["response"])
+    return row["response"]
+
+
+async def store(key: str, response: dict) -> None:
+    """
+    store a response in every enabled tier, a failing persistent tier never fails the request
+    """
+    global _writes_since_eviction
+
+    memory_cache.set(key, response)
+
+    if not settings.LLM_CACHE_PERSISTENT:
+        return
+
+    insert_query = """
+        INSERT INTO llm_response_cache (key, response)
+        VALUES (%s, %s)
+        ON CONFLICT (key) DO UPDATE
+        SET response = EXCLUDED.response, created_at = NOW(), last_hit_at = NOW();
+    """
+    # drop expired rows and everything beyond the newest LLM_CACHE_PERSISTENT_MAX_ENTRIES by last use
+    evict_query = """
+        DELETE FROM llm_response_cache
+        WHERE created_at <= NOW() - make_interval(secs => %s)
+        OR key IN (
+            SELECT key FROM llm_response_cache
+            ORDER BY last_hit_at DESC
+            OFFSET %s
+        );
+    """
+
+    try:
+        async with get_pool().connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(insert_query, (key, Jsonb(response)))
+
+                _writes_since_eviction += 1
+                if _writes_since_eviction >= settings.LLM_CACHE_EVICT_EVERY:
+                    _writes_since_eviction = 0
+                    await cur.execute(
+                        evict_query,
+                        (settings.LLM_CACHE_PERSISTENT_TTL_SECONDS, settings.LLM_CACHE_PERSISTENT_MAX_ENTRIES)
+                    )
+
+    except Exception as e:
+        print(f"LLM response cache write failed: {e}")
+
+
+def stats() -> dict:
+    return {
+        "memory": memory_cache.stats(),
+        "lookups": cache_lookups_total.snapshot(),
+    }
@@ -0,0 +1,88 @@
+import json
+from typing import List
+
+
+class ExpenseStreamParser:
+    """
+    Incrementally scans the streamed JSON reply of the model and returns every element of the
+    top level `expense` array as soon as its closing brace arrives, so the client can render
+    extracted expenses before the full completion is generated.
+    """
+
+    def __init__(self, array_key: str = "expense"):
+        self.array_key = array_key
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string = None
+        self._key = None
+        self._array_depth = None
+        self._element_start = None
+
+    def feed(self, delta: str) -> List[dict]:
+        """
+        add a chunk of streamed text and return the expense elements completed by it
+        """
+        self._text += delta
+        completed = []
+        text = self._text
+
+        for i in range(self._pos, len(text)):
+            char = text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = text[self._string_start:i + 1]
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = i
+
+            elif char == ":" and self._depth == 1 and self._last_string is not None:
+                self._key = json.loads(self._last_string)
+                self._last_string = None
+
+            elif char == "," and self._depth == 1:
+                self._key = None
+                self._last_string = None
+
+            elif char in "{[":
+                self._depth += 1
+                if char == "[" and self._depth == 2 and self._key == self.array_key and self._array_depth is None:
+                    self._array_depth = self._depth
+                elif char == "{" and self._array_depth is not None and self._depth == self._array_depth + 1:
+                    self._element_start = i
+
+            elif char in "}]":
+                if char == "}" and self._element_start is not None and self._depth == self._array_depth + 1:
+                    try:
+                        completed.append(json.loads(text[self._element_start:i + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    self._element_start = None
+                elif char == "]" and self._array_depth is not None and self._depth == self._array_depth:
+                    self._array_depth = None
+                self._depth -= 1
+
+        self._pos = len(text)
+        return completed
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    def close(self) -> dict:
+        """
+        parse the complete reply once the stream has ended, raises json.JSONDecodeError if it is not valid json
+        """
+        return json.loads(self._text)
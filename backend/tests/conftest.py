@@ -0,0 +1,16 @@
+"""
+Unit tests that run without a database or an OpenAI key: `pytest` from the backend directory.
+config.Settings requires these, values from the environment or a .env file take precedence.
+"""
+import os
+
+for name, value in {
+    "POSTGRES_USER": "postgres",
+    "POSTGRES_PASSWORD": "postgres",
+    "POSTGRES_PORT": "5432",
+    "POSTGRES_DB": "postgres",
+    "JWT_SECRET_KEY": "test",
+    "JWT_ALGORITHM": "HS256",
+    "JWT_ACCESS_TOKEN_EXPIRE_MINUTES": "60",
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,51 @@
+import pytest
+
+from config import settings
+from llm.audio import plan_segments
+
+
+@pytest.fixture(autouse=True)
+def segment_settings(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_AUDIO_SEGMENT_SECONDS", 300.0)
+    monkeypatch.setattr(settings, "LLM_AUDIO_SEGMENT_OVERLAP_SECONDS", 2.0)
+    monkeypatch.setattr(settings, "LLM_AUDIO_SILENCE_SEARCH_SECONDS", 30.0)
+
+
+def bounds(segments):
+    return [(segment.start, segment.end, segment.overlaps_next) for segment in segments]
+
+
+def test_short_recording_is_one_segment():
+    # a remainder up to a quarter of a segment is folded into the last one
+    assert bounds(plan_segments(370.0, [])) == [(0.0, 370.0, False)]
+
+
+def test_cuts_without_silence_overlap():
+    assert bounds(plan_segments(800.0, [])) == [
+        (0.0, 302.0, True),
+        (300.0, 602.0, True),
+        (600.0, 800.0, False),
+    ]
+
+
+def test_cuts_at_the_latest_silence_before_the_target():
+    silences = [(270.0, 272.0), (285.0, 287.0), (310.0, 312.0)]
+
+    assert bounds(plan_segments(600.0, silences)) == [
+        (0.0, 286.0, False),
+        (286.0, 600.0, False),
+    ]
+
+
+def test_silence_outside_the_search_window_is_ignored():
+    assert bounds(plan_segments(700.0, [(100.0, 102.0)]))[0] == (0.0, 302.0, True)
+
+
+def test_silence_at_the_segment_start_is_never_a_cut(monkeypatch):
+    # a search window as long as the segment reaches back to its start, which used to loop forever
+    monkeypatch.setattr(settings, "LLM_AUDIO_SILENCE_SEARCH_SECONDS", 300.0)
+
+    segments = plan_segments(1000.0, [(0.0, 0.0), (290.0, 310.0)])
+
+    assert all(segment.end > segment.start for segment in segments)
+    assert segments[-1].end == 1000.0
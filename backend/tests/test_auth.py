@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from app import auth
+from config import settings
+
+
+def blocking_call(release: threading.Event):
+    release.wait(5)
+    return "hashed"
+
+
+def test_bcrypt_calls_count_as_pending_until_their_thread_finishes(monkeypatch):
+    # the pool has BCRYPT_MAX_WORKERS threads, with no queue every further call is rejected
+    monkeypatch.setattr(settings, "BCRYPT_MAX_QUEUE", 0)
+    release = threading.Event()
+
+    async def main():
+        running = [
+            asyncio.create_task(auth._run_bcrypt("hash", blocking_call, release))
+            for _ in range(settings.BCRYPT_MAX_WORKERS)
+        ]
+        await asyncio.sleep(0.05)
+
+        # the requests go away but the threads keep hashing
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        assert auth._bcrypt_pending == settings.BCRYPT_MAX_WORKERS
+
+        with pytest.raises(HTTPException) as rejected:
+            await auth._run_bcrypt("hash", blocking_call, release)
+        assert rejected.value.status_code == 503
+
+        release.set()
+        for _ in range(100):
+            if auth._bcrypt_pending == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert auth._bcrypt_pending == 0
+        assert await auth._run_bcrypt("hash", lambda: "hashed") == "hashed"
+
+    asyncio.run(main())
+
+
+def test_cancelled_bcrypt_call_still_queued_is_released_right_away(monkeypatch):
+    monkeypatch.setattr(settings, "BCRYPT_MAX_QUEUE", 1)
+    release = threading.Event()
+
+    async def main():
+        running = [
+            asyncio.create_task(auth._run_bcrypt("hash", blocking_call, release))
+            for _ in range(settings.BCRYPT_MAX_WORKERS)
+        ]
+        await asyncio.sleep(0.05)
+        queued = asyncio.create_task(auth._run_bcrypt("hash", blocking_call, release))
+        await asyncio.sleep(0.05)
+        assert auth._bcrypt_pending == settings.BCRYPT_MAX_WORKERS + 1
+
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        assert auth._bcrypt_pending == settings.BCRYPT_MAX_WORKERS
+
+        release.set()
+        assert await asyncio.gather(*running) == ["hashed"] * settings.BCRYPT_MAX_WORKERS
+        assert auth._bcrypt_pending == 0
+
+    asyncio.run(main())
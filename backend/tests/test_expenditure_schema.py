@@ -0,0 +1,25 @@
+from uuid import uuid4
+
+import pytest
+from pydantic import ValidationError
+
+from app.api.expenditure.schema import ExpenditureBatchPatch
+
+
+@pytest.mark.parametrize("field", ["name", "date_of_expense", "amount"])
+def test_batch_patch_rejects_null_for_required_columns(field):
+    with pytest.raises(ValidationError, match="can not be cleared"):
+        ExpenditureBatchPatch.model_validate({"id": str(uuid4()), field: None})
+
+
+@pytest.mark.parametrize("field", ["category", "notes", "status"])
+def test_batch_patch_clears_nullable_columns(field):
+    patch = ExpenditureBatchPatch.model_validate({"id": str(uuid4()), field: None})
+
+    assert patch.model_dump(exclude_unset=True)[field] is None
+
+
+def test_batch_patch_leaves_out_unset_fields():
+    patch = ExpenditureBatchPatch.model_validate({"id": str(uuid4()), "amount": "7.5"})
+
+    assert set(patch.model_dump(exclude_unset=True)) == {"id", "amount"}
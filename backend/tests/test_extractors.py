@@ -0,0 +1,59 @@
+import pytest
+
+from config import settings
+from llm.extractors import RuleExtractor, categorize
+
+
+def extract(message: str, prompt_date: str = "2026-10-17"):
+    return RuleExtractor().extract([{"role": "user", "content": [{"type": "text", "text": message}]}], prompt_date)
+
+
+def answered_locally(extraction) -> bool:
+    return extraction is not None and extraction.confidence >= settings.LLM_LOCAL_MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize("message, prices, date_of_expense", [
+    ("Mcdonald's $10 and Bubble Tea $4.5", [10.0, 4.5], "2026-10-17"),
+    ("Taxi $15 Oct 3", [15.0], "2026-10-03"),
+    ("Lunch $12 may 5", [12.0], "2026-05-05"),
+    ("Coffee $4 oct 2", [4.0], "2026-10-02"),
+    ("Coffee 4 dollars 2nd oct", [4.0], "2026-10-02"),
+    ("Grab $12.50 on 3/10", [12.5], "2026-10-03"),
+    ("Lunch $9 2026-10-01", [9.0], "2026-10-01"),
+])
+def test_prices_and_dates(message, prices, date_of_expense):
+    extraction = extract(message)
+
+    assert answered_locally(extraction)
+    expenses = extraction.response["expense"]
+    assert [expense["price"] for expense in expenses] == prices
+    assert expenses[0]["date_of_expense"] == date_of_expense
+
+
+def test_price_that_may_be_a_day_goes_to_the_model():
+    # "12 may 5" is either $12 on May 5 or $5 on May 12
+    assert not answered_locally(extract("Lunch 12 may 5"))
+
+
+@pytest.mark.parametrize("name, category", [
+    ("Cable bill", None),
+    ("Business lunch", "Food"),
+    ("Business trip", None),
+    ("Teamwork workshop", None),
+    ("Grocery run", "Groceries"),
+    ("Groceries", "Groceries"),
+    ("Bus", "Transport"),
+    ("Buses to work", "Transport"),
+    ("Mcdonald's", "Food"),
+    ("Movies with friends", "Entertainment"),
+])
+def test_categories_match_whole_words(name, category):
+    assert categorize(name) == category
+
+
+def test_keyword_inside_a_word_does_not_set_a_confident_category():
+    extraction = extract("Cable bill $50")
+
+    assert extraction is not None
+    assert extraction.response["expense"][0]["category"] != "Transport"
+    assert extraction.confidence < 1.0
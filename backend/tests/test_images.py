@@ -0,0 +1,38 @@
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+from config import settings
+from llm.images import _preprocess_data_uri
+
+
+@pytest.fixture(autouse=True)
+def image_settings(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_IMAGE_MAX_DIMENSION", 256)
+    monkeypatch.setattr(settings, "LLM_IMAGE_FORMAT", "JPEG")
+    monkeypatch.setattr(settings, "LLM_IMAGE_AUTOCROP", False)
+
+
+def data_uri(image: Image.Image, format: str) -> str:
+    output = io.BytesIO()
+    image.save(output, format=format)
+    return f"data:{Image.MIME[format]};base64,{base64.b64encode(output.getvalue()).decode('ascii')}"
+
+
+def test_large_image_is_shrunk():
+    url = data_uri(Image.radial_gradient("L").resize((1024, 1024)).convert("RGB"), "BMP")
+    processed = _preprocess_data_uri(url)
+    assert processed.startswith("data:image/jpeg;base64,")
+    assert len(processed) < len(url)
+
+
+def test_original_kept_when_not_smaller():
+    # a tiny flat png is smaller than any jpeg it could be re-encoded to
+    url = data_uri(Image.new("RGB", (16, 16), "white"), "PNG")
+    assert _preprocess_data_uri(url) == url
+
+
+def test_remote_url_untouched():
+    assert _preprocess_data_uri("https://example.com/receipt.jpg") == "https://example.com/receipt.jpg"
@@ -0,0 +1,37 @@
+import asyncio
+import time
+
+import pytest
+
+from app import watchdog
+
+
+def test_strict_raises_on_a_blocking_call():
+    async def main():
+        with pytest.raises(watchdog.LoopBlockedError, match="blocked"):
+            with watchdog.strict(50):
+                await asyncio.sleep(0.01)
+                time.sleep(0.2)
+
+    asyncio.run(main())
+
+
+def test_strict_reports_the_blocking_frame():
+    async def main():
+        with pytest.raises(watchdog.LoopBlockedError) as blocked:
+            with watchdog.strict(50):
+                await asyncio.sleep(0.01)
+                time.sleep(0.3)
+        return str(blocked.value)
+
+    assert "test_strict_reports_the_blocking_frame" in asyncio.run(main())
+
+
+def test_strict_passes_when_the_loop_keeps_running():
+    async def main():
+        with watchdog.strict(50) as blocks:
+            for _ in range(10):
+                await asyncio.sleep(0.01)
+        return blocks
+
+    assert asyncio.run(main()) == []